@@ -0,0 +1,1282 @@
+import os
+import re
+import sys
+import time
+import atexit
+import threading
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from sqlalchemy import text
+
+import tools
+from tools import (
+    Fore, Style, MAPA_DATAS, get_df_by_name, converter_coluna_data, aplicar_filtro_inteligente,
+    encontrar_coluna_flexivel, encontrar_coluna_empresa, normalizar_texto, normalizar_serie
+)
+from logs import LOG, campos
+from rastreamento import anotar
+from turno_ferramentas import no_rascunho
+
+# Arrow é opcional: sem pyarrow instalado o backend 'arrow' fica indisponível
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except Exception:
+    pa = None
+    pc = None
+
+# ====================================================
+# BACKENDS DE EXECUÇÃO DO PLANO DE KPIs
+# ====================================================
+# Todos recebem o mesmo plano (kpi_plano.montar_plano) e devolvem
+# {medida: Series indexada pelas chaves de grupo}. Um grupo só aparece numa
+# medida se alguma linha passou pelos predicados dela (mesma regra do groupby).
+#   pandas -> DataFrames em memória do cache de tools.get_df_by_name
+#   sqlite -> SQL agregado direto na GLOBAL_ENGINE (sem carregar a tabela)
+#   arrow  -> tabelas colunares pyarrow com colunas derivadas em cache
+#   streaming -> leitura em lotes do SQLite com acumulação incremental (memória limitada)
+#   processos -> tabelas fragmentadas por empresa/ano entre processos; parciais somados no coordenador
+
+def resolver_coluna(df, termo):
+    """Localiza a coluna pelo termo (ou tupla de termos alternativos) no nome normalizado."""
+    if termo in COLUNAS_ESPECIAIS:
+        return COLUNAS_ESPECIAIS[termo](df)
+    termos = termo if isinstance(termo, tuple) else (termo,)
+    return next((c for c in df.columns if any(t in normalizar_texto(c) for t in termos)), None)
+
+def _coluna_situacao(df):
+    # Tenta 'situacaodocumento', depois 'status', depois 'situacao' (ignorando datas)
+    col = next((c for c in df.columns if "situacaodocumento" in normalizar_texto(c)), None)
+    if not col: col = next((c for c in df.columns if "status" in normalizar_texto(c)), None)
+    if not col:
+        col = next((c for c in df.columns if "situacao" in normalizar_texto(c) and not any(x in normalizar_texto(c) for x in ['dt', 'hr', 'data'])), None)
+    return col
+
+COLUNAS_ESPECIAIS = {"situacao": _coluna_situacao}
+
+def _chaves(agrupar_por):
+    return [f"__{c}" for c in agrupar_por] or ["__todos"]
+
+def _intervalo(data_inicial, data_final):
+    """Limites do período como Timestamps (fim inclui o dia inteiro)."""
+    ini = pd.to_datetime(data_inicial) if data_inicial else None
+    fim = pd.to_datetime(data_final) + pd.Timedelta(days=1) - pd.Timedelta(seconds=1) if data_final else None
+    return ini, fim
+
+# ====================================================
+# Backend pandas
+# ====================================================
+
+def _chave_onibus(df):
+    col = resolver_coluna(df, "onibus")
+    if not col: return None
+    chave = df[col].astype(str).str.strip()
+    # Mesma regra do prompt: Ônibus IS NOT NULL AND TRIM(Ônibus) <> ''
+    return chave.mask(df[col].isna() | (chave == ""))
+
+def _chave_empresa(df):
+    col = encontrar_coluna_empresa(df)
+    return df[col].astype(str).str.strip().str.lower() if col else None
+
+CHAVES_AGRUPAMENTO = {"empresa": _chave_empresa, "onibus": _chave_onibus}
+
+def preparar_tabela(nome_tabela, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por=()):
+    """
+    Carrega a tabela, converte a data UMA vez, aplica período e filtro categórico
+    e anota as chaves de agrupamento ('__empresa', '__mes', '__onibus').
+    O resultado é compartilhado pelos planos do mesmo turno (turno_ferramentas): somente leitura.
+    """
+    df = get_df_by_name(nome_tabela, copiar=False)
+    if df is None: return None
+    chave = ("plano", nome_tabela, tools.versao_tabela(nome_tabela), filtro_coluna, filtro_valor, data_inicial, data_final, tuple(agrupar_por))
+    return tools.no_rascunho_com_filtro(chave, lambda: _preparar_tabela(df, nome_tabela, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por))
+
+def _aproximadas(filtro_valor, candidatas, indice_de):
+    """
+    [(coluna, chaves, modo, valores originais)] das candidatas em que o índice de valores resolve o filtro
+    sem ambiguidade. Se só houver resoluções ambíguas, registra a ambiguidade para o texto da tool.
+    """
+    resolvidas, ambigua = [], None
+    for col in candidatas:
+        indice = indice_de(col)
+        chaves, modo = indice.resolver(filtro_valor)
+        if not chaves or modo == "exato":
+            continue
+        if modo == "ambiguo":
+            ambigua = ambigua or (col, indice.originais_de(chaves))
+        else:
+            resolvidas.append((col, chaves, modo, indice.originais_de(chaves)))
+    if not resolvidas and ambigua:
+        tools.registrar_resolucao_filtro(filtro_valor, ambigua[0], ambigua[1], "ambiguo")
+    return resolvidas
+
+def _preparar_tabela(df, nome_tabela, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por):
+    datas = None
+    if data_inicial or data_final or "mes" in agrupar_por:
+        col_data = encontrar_coluna_flexivel(df, MAPA_DATAS[nome_tabela])
+        if col_data:
+            datas = converter_coluna_data(df[col_data])
+        elif "mes" in agrupar_por:
+            return None
+
+    if datas is not None and (data_inicial or data_final):
+        ini, fim = _intervalo(data_inicial, data_final)
+        mask = datas.notna()
+        if ini is not None: mask &= (datas >= ini)
+        if fim is not None: mask &= (datas <= fim)
+        df = df[mask]
+
+    if filtro_coluna and filtro_valor:
+        r, _ = aplicar_filtro_inteligente(df, filtro_coluna, filtro_valor)
+        # Valor inexistente volta como DataFrame() sem colunas: mantém as colunas para achar as chaves de grupo
+        if r is not None: df = r if len(r) else df.iloc[:0]
+
+    df = df.copy()
+    for chave in agrupar_por:
+        if chave == "mes":
+            df["__mes"] = datas.loc[df.index].dt.to_period("M")
+        else:
+            valores = CHAVES_AGRUPAMENTO[chave](df)
+            if valores is None: return None
+            df[f"__{chave}"] = valores
+    if not agrupar_por:
+        df["__todos"] = True
+    return df
+
+def _avaliar_predicado(df, predicado, cache):
+    """Máscara booleana do predicado; colunas normalizadas e máscaras ficam no cache do plano."""
+    if predicado in cache:
+        return cache[predicado]
+
+    operador = predicado[0]
+    if operador == "ou":
+        a = _avaliar_predicado(df, predicado[1], cache)
+        b = _avaliar_predicado(df, predicado[2], cache)
+        mask = (a if a is not None else False) | (b if b is not None else False)
+        if a is None and b is None: mask = None
+    else:
+        _, termo, arg = predicado
+        col = resolver_coluna(df, termo)
+        if not col:
+            mask = None
+        elif operador == "contem":
+            chave_norm = ("__norm", col)
+            if chave_norm not in cache:
+                cache[chave_norm] = normalizar_serie(df[col])
+            mask = cache[chave_norm].str.contains(arg, case=False, regex=True)
+        else:
+            chave_upper = ("__upper", col)
+            if chave_upper not in cache:
+                cache[chave_upper] = df[col].astype(str).str.strip().str.upper()
+            if operador == "igual":
+                mask = cache[chave_upper] == arg
+            else:
+                chars, sigla = arg
+                mask = cache[chave_upper].str.slice(0, chars) == sigla
+
+    cache[predicado] = mask
+    return mask
+
+def _agregar_medida(df, spec, chaves, cache):
+    mask = pd.Series(True, index=df.index)
+    for predicado in spec["predicados"]:
+        m = _avaliar_predicado(df, predicado, cache)
+        if m is None: return None
+        mask &= m
+
+    df_sel = df[mask]
+    grupos = [df_sel[k] for k in chaves]
+    if spec["agregacao"] == "linhas":
+        return df_sel.groupby(grupos).size()
+
+    col = resolver_coluna(df, spec["coluna"])
+    if not col: return None
+    if spec["agregacao"] == "soma":
+        return pd.to_numeric(df_sel[col], errors='coerce').fillna(0).groupby(grupos).sum()
+    return df_sel.groupby(grupos)[col].nunique()
+
+def _celula_pivo(spec):
+    """(sigla, regra) do pivô de siglas do INDMANTMANUAL (tools.pivo_siglas_manual) equivalente à medida, ou None."""
+    if spec["tabela"] != "INDMANTMANUAL" or spec["agregacao"] != "soma" or spec["coluna"] != "valor" or len(spec["predicados"]) != 1:
+        return None
+
+    def celula(predicado):
+        if predicado[:2] == ("igual", "simbolo") and predicado[2] in tools.SIGLAS_MANUAL:
+            return predicado[2], "simbolo"
+        if predicado[:2] == ("prefixo", "descricao"):
+            chars, sigla = predicado[2]
+            if tools.SIGLAS_MANUAL.get(sigla) == chars:
+                return sigla, "descricao"
+        if predicado[0] == "ou":
+            a, b = celula(predicado[1]), celula(predicado[2])
+            if a and b and a[0] == b[0] and {a[1], b[1]} == {"simbolo", "descricao"}:
+                return a[0], "simbolo_ou_descricao"
+        return None
+
+    return celula(spec["predicados"][0])
+
+class BackendPandas:
+    """Executa o plano sobre os DataFrames em memória (cache de get_df_by_name)."""
+    nome = "pandas"
+
+    def agregar(self, plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=()):
+        chaves = _chaves(agrupar_por)
+        tabelas = {}
+        pivos = {}
+        for nome in plano["tabelas"]:
+            # Sem agrupamento, as somas por sigla do INDMANTMANUAL vêm do pivô em cache compartilhado com as tools
+            if not agrupar_por and all(_celula_pivo(s) for s in plano["specs"].values() if s["tabela"] == nome):
+                pivos[nome] = tools.pivo_siglas_manual(filtro_coluna, filtro_valor, data_inicial, data_final)
+                continue
+            df = preparar_tabela(nome, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por)
+            if df is None:
+                LOG.warning("plano: tabela indisponível", extra=campos(tabela=nome, agrupar_por=agrupar_por or "total", backend=self.nome))
+            tabelas[nome] = (df, {})
+
+        series = {}
+        for medida in plano["medidas"]:
+            spec = plano["specs"][medida]
+            if spec["tabela"] in pivos:
+                pivo = pivos[spec["tabela"]]
+                valor = pivo.at[_celula_pivo(spec)] if pivo is not None else float("nan")
+                if not pd.isna(valor):
+                    series[medida] = pd.Series([valor], index=pd.Index([True], name="__todos"))
+                continue
+            df, cache = tabelas[spec["tabela"]]
+            if df is None: continue
+            resultado = _agregar_medida(df, spec, chaves, cache)
+            if resultado is not None:
+                series[medida] = resultado
+        return series
+
+# ====================================================
+# Backend SQLite (SQL agregado)
+# ====================================================
+
+def expressao_data_sql(coluna):
+    """
+    Expressão SQL (só funções nativas, indexável) que converte a data em 'AAAA-MM-DD'
+    com a mesma regra de converter_coluna_data: ISO direto; 'NN/NN/AAAA' é mês/dia
+    quando o primeiro número é <= 12 e dia/mês caso contrário. Outros formatos -> NULL
+    (o BackendSQLite completa com raybot_data; o BackendStreaming decide no pandas).
+    """
+    c = f'trim("{coluna}")'
+    return (f"date(CASE "
+            f"WHEN {c} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' THEN substr({c}, 1, 10) "
+            f"WHEN {c} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*' THEN "
+            f"CASE WHEN CAST(substr({c}, 1, 2) AS INTEGER) <= 12 "
+            f"THEN substr({c}, 7, 4) || '-' || substr({c}, 1, 2) || '-' || substr({c}, 4, 2) "
+            f"ELSE substr({c}, 7, 4) || '-' || substr({c}, 4, 2) || '-' || substr({c}, 1, 2) END "
+            f"END)")
+
+@lru_cache(maxsize=65536)
+def _data(valor):
+    """
+    Uma data em formato que expressao_data_sql não reconhece ('5/3/2024', '2024/03/05',
+    '05-03-2024'...) -> 'AAAA-MM-DD' pela mesma regra de converter_coluna_data (None se inválida).
+    """
+    texto = pd.Series([str(valor).strip()])
+    data = pd.to_datetime(texto, format='mixed', errors='coerce')[0]
+    if pd.isna(data):
+        data = pd.to_datetime(texto, dayfirst=True, format='mixed', errors='coerce')[0]
+    return None if pd.isna(data) else data.strftime("%Y-%m-%d")
+
+def _num(valor):
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return None
+
+def _regexp(padrao, valor):
+    return 1 if re.search(padrao, valor or "", re.IGNORECASE) else 0
+
+# Funções Python registradas na conexão para reproduzir a semântica do pandas
+# (astype(str) + normalizar_texto, str.strip().upper(), to_numeric(errors='coerce'))
+FUNCOES_SQLITE = {
+    "raybot_norm": (1, lambda v: normalizar_texto(str(v))),
+    "raybot_upper": (1, lambda v: str(v).strip().upper()),
+    "raybot_chave": (1, lambda v: str(v).strip().lower()),
+    "raybot_num": (1, _num),
+    "raybot_data": (1, _data),
+    "raybot_regexp": (2, _regexp),
+}
+
+def registrar_funcoes_sqlite(conn):
+    """Registra as funções auxiliares na conexão DB-API por trás da conexão SQLAlchemy."""
+    raw = conn.connection.dbapi_connection
+    for nome, (nargs, func) in FUNCOES_SQLITE.items():
+        raw.create_function(nome, nargs, func, deterministic=True)
+
+def _q(coluna):
+    return '"' + coluna.replace('"', '""') + '"'
+
+def _indice_sql(conn, nome_real, coluna_real):
+    """Índice de valores (tools.IndiceValores) da coluna lido do SQLite, versionado pela marca d'água."""
+    sql = f"SELECT DISTINCT {_q(coluna_real)} FROM {_q(nome_real)} WHERE {_q(coluna_real)} IS NOT NULL"
+    return tools.indice_valores(nome_real, coluna_real, tools._marca_dagua(conn, nome_real),
+                                lambda: [r[0] for r in conn.execute(text(sql))])
+
+class BackendSQLite:
+    """Empurra filtros e agregações para o SQLite: uma consulta GROUP BY por tabela do plano."""
+    nome = "sqlite"
+
+    def __init__(self, engine=None):
+        self._engine = engine
+        self._colunas = {}
+        # Últimas consultas executadas (sql, params), usadas pelo assistente de índices
+        self.ultimas_consultas = deque(maxlen=100)
+
+    @property
+    def engine(self):
+        return self._engine or tools.GLOBAL_ENGINE
+
+    def _colunas_tabela(self, conn, nome_real):
+        """{coluna minúscula: coluna real}, como o cache do pandas enxerga os nomes."""
+        if nome_real not in self._colunas:
+            linhas = conn.execute(text(f"PRAGMA table_info({_q(nome_real)})")).fetchall()
+            self._colunas[nome_real] = {row[1].lower(): row[1] for row in linhas}
+        return self._colunas[nome_real]
+
+    def _sql_predicado(self, predicado, colunas, params):
+        operador = predicado[0]
+        if operador == "ou":
+            a = self._sql_predicado(predicado[1], colunas, params)
+            b = self._sql_predicado(predicado[2], colunas, params)
+            if a is None and b is None: return None
+            return f"(({a or '0'}) OR ({b or '0'}))"
+
+        _, termo, arg = predicado
+        col = resolver_coluna(pd.DataFrame(columns=list(colunas)), termo)
+        if not col: return None
+        p = f"p{len(params)}"
+        ref = _q(colunas[col])
+        if operador == "contem":
+            params[p] = arg
+            return f"raybot_regexp(:{p}, raybot_norm({ref}))"
+        if operador == "igual":
+            params[p] = arg
+            return f"raybot_upper({ref}) = :{p}"
+        chars, sigla = arg
+        params[p] = sigla
+        return f"substr(raybot_upper({ref}), 1, {int(chars)}) = :{p}"
+
+    def _sql_chave(self, chave, colunas, expr_data):
+        vazio = pd.DataFrame(columns=list(colunas))
+        if chave == "mes":
+            if not expr_data: return None, None
+            completa = f"coalesce({expr_data[0]}, {expr_data[1]})"
+            return f"substr({completa}, 1, 7)", f"{completa} IS NOT NULL"
+        if chave == "empresa":
+            col = encontrar_coluna_empresa(vazio)
+            return (f"raybot_chave({_q(colunas[col])})", None) if col else (None, None)
+        col = resolver_coluna(vazio, "onibus")
+        if not col: return None, None
+        ref = _q(colunas[col])
+        return f"trim({ref})", f"{ref} IS NOT NULL AND trim({ref}) <> ''"
+
+    def _filtro_categorico(self, conn, nome_real, colunas, onde, params, filtro_coluna, filtro_valor):
+        """Mesma regra de aplicar_filtro_inteligente: 1ª coluna candidata com algum valor igual, depois o índice de valores."""
+        termo = normalizar_texto(filtro_coluna)
+        candidatas = [c for c in colunas if termo in normalizar_texto(c)]
+        if not candidatas:
+            return None
+        params["filtro_valor"] = str(filtro_valor).strip().lower()
+        for col in candidatas:
+            cond = f"raybot_chave({_q(colunas[col])}) = :filtro_valor"
+            sql = f"SELECT 1 FROM {_q(nome_real)} WHERE {' AND '.join(onde + [cond])} LIMIT 1"
+            self.ultimas_consultas.append((sql, dict(params)))
+            if conn.execute(text(sql), params).first():
+                return cond
+        for col, chaves, modo, originais in _aproximadas(filtro_valor, candidatas, lambda c: _indice_sql(conn, nome_real, colunas[c])):
+            marcadores = []
+            for i, chave in enumerate(chaves):
+                params[f"filtro_valor_{i}"] = chave
+                marcadores.append(f":filtro_valor_{i}")
+            cond = f"raybot_chave({_q(colunas[col])}) IN ({', '.join(marcadores)})"
+            sql = f"SELECT 1 FROM {_q(nome_real)} WHERE {' AND '.join(onde + [cond])} LIMIT 1"
+            self.ultimas_consultas.append((sql, dict(params)))
+            if conn.execute(text(sql), params).first():
+                anotar(filtro_coluna=col, filtro_resolvido=",".join(chaves), modo=modo)
+                tools.registrar_resolucao_filtro(filtro_valor, col, originais, modo)
+                return cond
+        return "0"
+
+    def _converter_chave(self, chave, valores):
+        if chave == "mes":
+            return [pd.Period(v, "M") for v in valores]
+        if chave == "todos":
+            return [True] * len(valores)
+        return list(valores)
+
+    def agregar(self, plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=()):
+        series = {}
+        with self.engine.connect() as conn:
+            registrar_funcoes_sqlite(conn)
+            for tabela in plano["tabelas"]:
+                nome_real = tools.resolver_nome_tabela(tabela)
+                if not nome_real: continue
+                medidas = [m for m in plano["medidas"] if plano["specs"][m]["tabela"] == tabela]
+                series.update(self._agregar_tabela(conn, tabela, nome_real, medidas, plano["specs"],
+                                                   filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por))
+        return series
+
+    def _agregar_tabela(self, conn, tabela, nome_real, medidas, specs, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por):
+        colunas = self._colunas_tabela(conn, nome_real)
+        vazio = pd.DataFrame(columns=list(colunas))
+        params, onde = {}, ["1"]
+
+        expr_data = None
+        if data_inicial or data_final or "mes" in agrupar_por:
+            col_data = encontrar_coluna_flexivel(vazio, MAPA_DATAS[tabela])
+            # (expressão nativa e indexável, conversão em Python para os formatos que ela devolve NULL)
+            if col_data: expr_data = (expressao_data_sql(colunas[col_data]), f"raybot_data({_q(colunas[col_data])})")
+        if expr_data and (data_inicial or data_final):
+            ini, fim = _intervalo(data_inicial, data_final)
+            nativa, python = expr_data
+            faixa_nativa, faixa_python = [f"{nativa} IS NOT NULL"], [f"{nativa} IS NULL", f"{python} IS NOT NULL"]
+            if ini is not None:
+                params["dt_ini"] = ini.strftime("%Y-%m-%d")
+                faixa_nativa.append(f"{nativa} >= :dt_ini")
+                faixa_python.append(f"{python} >= :dt_ini")
+            if fim is not None:
+                params["dt_fim"] = fim.strftime("%Y-%m-%d")
+                faixa_nativa.append(f"{nativa} <= :dt_fim")
+                faixa_python.append(f"{python} <= :dt_fim")
+            # Os dois ramos usam o índice da expressão nativa (faixa / IS NULL)
+            onde.append(f"(({' AND '.join(faixa_nativa)}) OR ({' AND '.join(faixa_python)}))")
+
+        if filtro_coluna and filtro_valor:
+            cond = self._filtro_categorico(conn, nome_real, colunas, onde, params, filtro_coluna, filtro_valor)
+            if cond: onde.append(cond)
+
+        grupos = []
+        for chave in agrupar_por:
+            expr, cond = self._sql_chave(chave, colunas, expr_data)
+            if expr is None:
+                LOG.warning("plano: tabela indisponível", extra=campos(tabela=tabela, agrupar_por=agrupar_por, backend=self.nome))
+                return {}
+            grupos.append(expr)
+            if cond: onde.append(cond)
+
+        selecoes, validas = [], []
+        for i, medida in enumerate(medidas):
+            spec = specs[medida]
+            conds = [self._sql_predicado(p, colunas, params) for p in spec["predicados"]]
+            if any(c is None for c in conds): continue
+            pred = " AND ".join(conds) or "1"
+
+            if spec["agregacao"] == "linhas":
+                valor = f"TOTAL(CASE WHEN {pred} THEN 1 ELSE 0 END)"
+            else:
+                col = resolver_coluna(vazio, spec["coluna"])
+                if not col: continue
+                ref = _q(colunas[col])
+                if spec["agregacao"] == "soma":
+                    valor = f"TOTAL(CASE WHEN {pred} THEN coalesce(raybot_num({ref}), 0) END)"
+                else:
+                    valor = f"COUNT(DISTINCT CASE WHEN {pred} THEN {ref} END)"
+            selecoes += [f"{valor} AS v{i}", f"TOTAL(CASE WHEN {pred} THEN 1 ELSE 0 END) AS n{i}"]
+            validas.append((i, medida, spec["agregacao"]))
+
+        if not validas:
+            return {}
+
+        nomes_grupos = [f"g{j}" for j in range(len(grupos))]
+        select_grupos = [f"{g} AS {n}" for g, n in zip(grupos, nomes_grupos)]
+        sql = f"SELECT {', '.join(select_grupos + selecoes)} FROM {_q(nome_real)} WHERE {' AND '.join(onde)}"
+        if grupos:
+            sql += f" GROUP BY {', '.join(nomes_grupos)}"
+        self.ultimas_consultas.append((sql, dict(params)))
+        resultado = pd.read_sql_query(text(sql), conn, params=params)
+
+        chaves = list(agrupar_por) or ["todos"]
+        if grupos:
+            niveis = [self._converter_chave(c, resultado[n]) for c, n in zip(chaves, nomes_grupos)]
+        else:
+            niveis = [self._converter_chave("todos", resultado.index)]
+        indice = pd.MultiIndex.from_arrays(niveis, names=_chaves(agrupar_por)) if len(niveis) > 1 else pd.Index(niveis[0], name=_chaves(agrupar_por)[0])
+
+        series = {}
+        for i, medida, agregacao in validas:
+            s = pd.Series(resultado[f"v{i}"].values, index=indice)
+            s = s[resultado[f"n{i}"].values > 0]
+            series[medida] = s.astype("int64") if agregacao in ("distintos", "linhas") else s.astype(float)
+        return series
+
+# ====================================================
+# Backend Arrow (colunar em processo)
+# ====================================================
+
+class BackendArrow:
+    """
+    Converte cada tabela do cache para pyarrow uma vez e mantém colunas derivadas
+    (data convertida, texto normalizado, valores numéricos) em cache; filtros e
+    agregações rodam com pyarrow.compute.
+    """
+    nome = "arrow"
+
+    def __init__(self):
+        if pa is None:
+            raise ImportError("pyarrow não está instalado; backend 'arrow' indisponível.")
+        self._tabelas = {}
+
+    def _estado(self, nome):
+        df = get_df_by_name(nome, copiar=False)
+        if df is None: return None
+        estado = self._tabelas.get(nome)
+        if estado is None or estado["df"] is not df:
+            estado = {"df": df, "derivadas": {}}
+            self._tabelas[nome] = estado
+        return estado
+
+    def _derivada(self, estado, chave, construir):
+        if chave not in estado["derivadas"]:
+            estado["derivadas"][chave] = construir(estado["df"])
+        return estado["derivadas"][chave]
+
+    def _texto(self, serie):
+        return pa.array(serie.tolist(), type=pa.string())
+
+    def _coluna(self, estado, tipo, col):
+        df = estado["df"]
+        if tipo == "norm":
+            return self._derivada(estado, ("norm", col), lambda d: self._texto(normalizar_serie(d[col])))
+        if tipo == "upper":
+            return self._derivada(estado, ("upper", col), lambda d: self._texto(d[col].astype(str).str.strip().str.upper()))
+        if tipo == "chave":
+            return self._derivada(estado, ("chave", col), lambda d: self._texto(d[col].astype(str).str.strip().str.lower()))
+        if tipo == "num":
+            return self._derivada(estado, ("num", col), lambda d: pa.array(pd.to_numeric(d[col], errors='coerce').fillna(0).to_numpy(dtype=float)))
+        if tipo == "bruta":
+            return self._derivada(estado, ("bruta", col), lambda d: self._texto(d[col].map(lambda v: None if pd.isna(v) else str(v))))
+        raise ValueError(tipo)
+
+    def _datas(self, estado, col):
+        return self._derivada(estado, ("data", col), lambda d: pa.array(converter_coluna_data(d[col])))
+
+    def _mascara_predicado(self, estado, predicado):
+        df = estado["df"]
+        operador = predicado[0]
+        if operador == "ou":
+            a = self._mascara_predicado(estado, predicado[1])
+            b = self._mascara_predicado(estado, predicado[2])
+            if a is None and b is None: return None
+            if a is None: return b
+            if b is None: return a
+            return pc.or_(a, b)
+
+        _, termo, arg = predicado
+        col = resolver_coluna(df, termo)
+        if not col: return None
+        if operador == "contem":
+            return pc.match_substring_regex(self._coluna(estado, "norm", col), arg, ignore_case=True)
+        upper = self._coluna(estado, "upper", col)
+        if operador == "igual":
+            return pc.equal(upper, arg)
+        chars, sigla = arg
+        return pc.equal(pc.utf8_slice_codeunits(upper, 0, chars), sigla)
+
+    def agregar(self, plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=()):
+        series = {}
+        for tabela in plano["tabelas"]:
+            estado = self._estado(tabela)
+            if estado is None: continue
+            medidas = [m for m in plano["medidas"] if plano["specs"][m]["tabela"] == tabela]
+            series.update(self._agregar_tabela(estado, tabela, medidas, plano["specs"],
+                                               filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por))
+        return series
+
+    def _agregar_tabela(self, estado, tabela, medidas, specs, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por):
+        df = estado["df"]
+        n = len(df)
+        base = pa.array([True] * n, type=pa.bool_())
+
+        datas = None
+        if data_inicial or data_final or "mes" in agrupar_por:
+            col_data = encontrar_coluna_flexivel(df, MAPA_DATAS[tabela])
+            if col_data:
+                datas = self._datas(estado, col_data)
+            elif "mes" in agrupar_por:
+                return {}
+        if datas is not None and (data_inicial or data_final):
+            ini, fim = _intervalo(data_inicial, data_final)
+            base = pc.is_valid(datas)
+            if ini is not None: base = pc.and_(base, pc.greater_equal(datas, pa.scalar(ini.to_pydatetime())))
+            if fim is not None: base = pc.and_(base, pc.less_equal(datas, pa.scalar(fim.to_pydatetime())))
+            base = pc.fill_null(base, False)
+
+        if filtro_coluna and filtro_valor:
+            termo = normalizar_texto(filtro_coluna)
+            candidatas = [c for c in df.columns if termo in normalizar_texto(c)]
+            if candidatas:
+                val = str(filtro_valor).strip().lower()
+                achou = None
+                for col in candidatas:
+                    m = pc.and_(base, pc.equal(self._coluna(estado, "chave", col), val))
+                    if pc.any(m).as_py():
+                        achou = m
+                        break
+                for col, chaves, modo, originais in (_aproximadas(filtro_valor, candidatas, lambda c: tools.indice_da_coluna(df, c))
+                                                     if achou is None else []):
+                    m = pc.and_(base, pc.is_in(self._coluna(estado, "chave", col), value_set=pa.array(chaves, type=pa.string())))
+                    if pc.any(m).as_py():
+                        anotar(filtro_coluna=col, filtro_resolvido=",".join(chaves), modo=modo)
+                        tools.registrar_resolucao_filtro(filtro_valor, col, originais, modo)
+                        achou = m
+                        break
+                base = achou if achou is not None else pa.array([False] * n, type=pa.bool_())
+
+        chaves = _chaves(agrupar_por)
+        colunas_chave = {}
+        for chave in agrupar_por:
+            if chave == "mes":
+                colunas_chave["__mes"] = pc.strftime(datas, format="%Y-%m")
+            elif chave == "empresa":
+                col = encontrar_coluna_empresa(df)
+                if not col: return {}
+                colunas_chave["__empresa"] = self._coluna(estado, "chave", col)
+            else:
+                col = resolver_coluna(df, "onibus")
+                if not col: return {}
+                bruta = self._coluna(estado, "bruta", col)
+                onibus = pc.utf8_trim_whitespace(bruta)
+                colunas_chave["__onibus"] = pc.if_else(pc.equal(onibus, ""), pa.scalar(None, pa.string()), onibus)
+        if not agrupar_por:
+            colunas_chave["__todos"] = pa.array([True] * n, type=pa.bool_())
+
+        series = {}
+        for medida in medidas:
+            spec = specs[medida]
+            mask = base
+            impossivel = False
+            for predicado in spec["predicados"]:
+                m = self._mascara_predicado(estado, predicado)
+                if m is None:
+                    impossivel = True
+                    break
+                mask = pc.and_(mask, pc.fill_null(m, False))
+            if impossivel: continue
+
+            if spec["agregacao"] == "linhas":
+                valores, agg = pa.array([1] * n, type=pa.int64()), "sum"
+            else:
+                col = resolver_coluna(df, spec["coluna"])
+                if not col: continue
+                if spec["agregacao"] == "soma":
+                    valores, agg = self._coluna(estado, "num", col), "sum"
+                else:
+                    valores, agg = self._coluna(estado, "bruta", col), "count_distinct"
+
+            tabela_pa = pa.table({**colunas_chave, "__v": valores}).filter(mask)
+            for k in chaves:
+                tabela_pa = tabela_pa.filter(pc.is_valid(tabela_pa[k]))
+            agregado = tabela_pa.group_by(chaves).aggregate([("__v", agg)]).to_pandas()
+
+            niveis = []
+            for k in chaves:
+                valores_k = agregado[k]
+                if k == "__mes": valores_k = [pd.Period(v, "M") for v in valores_k]
+                niveis.append(list(valores_k))
+            indice = pd.MultiIndex.from_arrays(niveis, names=chaves) if len(chaves) > 1 else pd.Index(niveis[0], name=chaves[0])
+            s = pd.Series(agregado[f"__v_{agg}"].values, index=indice)
+            series[medida] = s.astype(float) if spec["agregacao"] == "soma" else s.astype("int64")
+        return series
+
+# ====================================================
+# Backend streaming (tabelas maiores que a memória)
+# ====================================================
+
+def _pares_distintos(df):
+    """
+    Linhas sem repetição via groupby (fatoriza os Period do '__mes' sem criar um objeto por linha,
+    ao contrário de drop_duplicates). Pares com chave ou valor nulo saem aqui, mas também não
+    contariam no nunique por grupo do final.
+    """
+    return df.groupby(list(df.columns), sort=False).size().index.to_frame(index=False)
+
+class BackendStreaming:
+    """
+    Lê só as colunas necessárias em lotes (cursor do SQLite + chunksize), com o período
+    empurrado para o WHERE, e acumula numerador/denominador lote a lote com a mesma
+    semântica do backend pandas. Contagens distintas continuam exatas: guardamos os pares
+    (grupo, valor) já vistos, então a memória depende do nº de valores distintos e do
+    tamanho do lote, não do tamanho da tabela (RAYBOT_TAMANHO_LOTE, padrão 100.000).
+    """
+    nome = "streaming"
+
+    def __init__(self, engine=None, tamanho_lote=None):
+        self._engine = engine
+        self.tamanho_lote = tamanho_lote or int(os.getenv("RAYBOT_TAMANHO_LOTE", "100000"))
+
+    @property
+    def engine(self):
+        return self._engine or tools.GLOBAL_ENGINE
+
+    def agregar(self, plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=()):
+        series = {}
+        with self.engine.connect() as conn:
+            for tabela in plano["tabelas"]:
+                nome_real = tools.resolver_nome_tabela(tabela)
+                if not nome_real: continue
+                medidas = [m for m in plano["medidas"] if plano["specs"][m]["tabela"] == tabela]
+                series.update(self._agregar_tabela(conn, tabela, nome_real, medidas, plano["specs"],
+                                                   filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por))
+        return series
+
+    def _colunas_necessarias(self, vazio, tabela, medidas, specs, candidatas, agrupar_por, usa_data):
+        """Só as colunas que o plano realmente toca (data, filtro, predicados, medidas, chaves)."""
+        necessarias = set(candidatas)
+        if usa_data:
+            col = encontrar_coluna_flexivel(vazio, MAPA_DATAS[tabela])
+            if col: necessarias.add(col)
+
+        def colunas_predicado(p):
+            if p[0] == "ou":
+                return colunas_predicado(p[1]) | colunas_predicado(p[2])
+            col = resolver_coluna(vazio, p[1])
+            return {col} if col else set()
+
+        for medida in medidas:
+            spec = specs[medida]
+            for p in spec["predicados"]:
+                necessarias |= colunas_predicado(p)
+            if spec["coluna"]:
+                col = resolver_coluna(vazio, spec["coluna"])
+                if col: necessarias.add(col)
+        if "empresa" in agrupar_por:
+            col = encontrar_coluna_empresa(vazio)
+            if col: necessarias.add(col)
+        if "onibus" in agrupar_por:
+            col = resolver_coluna(vazio, "onibus")
+            if col: necessarias.add(col)
+        return necessarias
+
+    def _agregar_tabela(self, conn, tabela, nome_real, medidas, specs, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por):
+        linhas = conn.execute(text(f"PRAGMA table_info({_q(nome_real)})")).fetchall()
+        colunas = {row[1].lower(): row[1] for row in linhas}
+        vazio = pd.DataFrame(columns=list(colunas))
+        chaves = _chaves(agrupar_por)
+
+        # Filtro categórico: acumulamos em paralelo para cada coluna candidata e, no fim,
+        # ficamos com a 1ª que teve algum valor igual (mesma regra de aplicar_filtro_inteligente)
+        candidatas = []
+        if filtro_coluna and filtro_valor:
+            termo = normalizar_texto(filtro_coluna)
+            candidatas = [c for c in colunas if termo in normalizar_texto(c)]
+        variantes = [(c, (tools.chave_filtro(filtro_valor),)) for c in candidatas] or [None]
+
+        usa_data = bool(data_inicial or data_final or "mes" in agrupar_por)
+        necessarias = self._colunas_necessarias(vazio, tabela, medidas, specs, candidatas, agrupar_por, usa_data)
+        col_data = encontrar_coluna_flexivel(vazio, MAPA_DATAS[tabela]) if usa_data else None
+        if "mes" in agrupar_por and not col_data:
+            return {}
+
+        # Período empurrado para o SQL de forma permissiva: formatos que a expressão SQL
+        # não reconhece (NULL) passam e são decididos pela conversão do pandas no lote
+        params, onde = {}, ["1"]
+        ini, fim = _intervalo(data_inicial, data_final)
+        if col_data and (ini is not None or fim is not None):
+            expr = expressao_data_sql(colunas[col_data])
+            faixa = []
+            if ini is not None:
+                params["dt_ini"] = ini.strftime("%Y-%m-%d")
+                faixa.append(f"{expr} >= :dt_ini")
+            if fim is not None:
+                params["dt_fim"] = fim.strftime("%Y-%m-%d")
+                faixa.append(f"{expr} <= :dt_fim")
+            onde.append(f"({expr} IS NULL OR ({' AND '.join(faixa)}))")
+
+        # Mantém a ordem original das colunas para que a resolução por termo escolha as mesmas
+        select = ", ".join(_q(colunas[c]) for c in colunas if c in necessarias) or "1"
+        sql = f"SELECT {select} FROM {_q(nome_real)} WHERE {' AND '.join(onde)}"
+
+        def ler(variantes):
+            acumulado = {v: {} for v in variantes}
+            achou = {v: False for v in variantes}
+            for lote in pd.read_sql_query(text(sql), conn, params=params, chunksize=self.tamanho_lote):
+                lote.columns = lote.columns.str.lower()
+                self._processar_lote(lote, col_data, ini, fim, variantes, agrupar_por, chaves, medidas, specs, acumulado, achou)
+            return acumulado, next((v for v in variantes if v is None or achou[v]), False)
+
+        acumulado, escolhida = ler(variantes)
+        if escolhida is False:
+            # Valor exato em nenhuma candidata: 2ª leitura com os valores resolvidos pelo índice de valores
+            resolvidas = _aproximadas(filtro_valor, candidatas, lambda c: _indice_sql(conn, nome_real, colunas[c]))
+            if not resolvidas:
+                return {}
+            aproximadas = [(c, tuple(valores)) for c, valores, _, _ in resolvidas]
+            acumulado, escolhida = ler(aproximadas)
+            if escolhida is False:
+                return {}
+            _, _, modo, originais = resolvidas[aproximadas.index(escolhida)]
+            anotar(filtro_coluna=escolhida[0], filtro_resolvido=",".join(escolhida[1]), modo=modo)
+            tools.registrar_resolucao_filtro(filtro_valor, escolhida[0], originais, modo)
+        return self._finalizar(acumulado[escolhida], medidas, specs, chaves)
+
+    def _processar_lote(self, lote, col_data, ini, fim, variantes, agrupar_por, chaves, medidas, specs, acumulado, achou, datas=None):
+        """Acumula o lote em cada variante do filtro; `datas` já convertidas podem vir prontas (ver BackendProcessos)."""
+        if col_data:
+            if datas is None:
+                datas = converter_coluna_data(lote[col_data])
+            if ini is not None or fim is not None:
+                mask = datas.notna()
+                if ini is not None: mask &= (datas >= ini)
+                if fim is not None: mask &= (datas <= fim)
+                lote, datas = lote[mask], datas[mask]
+
+        for chave in agrupar_por:
+            if chave == "mes":
+                lote = lote.assign(__mes=datas.dt.to_period("M"))
+            else:
+                valores = CHAVES_AGRUPAMENTO[chave](lote)
+                if valores is None: return
+                lote = lote.assign(**{f"__{chave}": valores})
+        if not agrupar_por:
+            lote = lote.assign(__todos=True)
+
+        for variante in variantes:
+            df = lote
+            if variante is not None:
+                col, valores = variante
+                df = lote[lote[col].astype(str).str.strip().str.lower().isin(valores)]
+                if len(df) == 0: continue
+                achou[variante] = True
+
+            cache = {}
+            for medida in medidas:
+                spec = specs[medida]
+                mask = pd.Series(True, index=df.index)
+                impossivel = False
+                for predicado in spec["predicados"]:
+                    m = _avaliar_predicado(df, predicado, cache)
+                    if m is None:
+                        impossivel = True
+                        break
+                    mask &= m
+                if impossivel: continue
+                self._acumular(acumulado[variante], medida, spec, df[mask], chaves)
+
+    def _acumular(self, acumulado, medida, spec, df_sel, chaves):
+        grupos = [df_sel[k] for k in chaves]
+        if spec["agregacao"] == "linhas":
+            parcial = df_sel.groupby(grupos).size()
+        else:
+            col = resolver_coluna(df_sel, spec["coluna"])
+            if not col: return
+            if spec["agregacao"] == "soma":
+                parcial = pd.to_numeric(df_sel[col], errors='coerce').fillna(0).groupby(grupos).sum()
+            else:
+                # Distintos exatos: acumula os pares (grupo, valor) sem repetição
+                pares = _pares_distintos(df_sel[chaves + [col]])
+                anterior = acumulado.get(medida)
+                acumulado[medida] = pares if anterior is None else _pares_distintos(pd.concat([anterior, pares]))
+                return
+
+        anterior = acumulado.get(medida)
+        acumulado[medida] = parcial if anterior is None else anterior.add(parcial, fill_value=0)
+
+    def _finalizar(self, acumulado, medidas, specs, chaves):
+        series = {}
+        for medida in medidas:
+            if medida not in acumulado: continue
+            valor = acumulado[medida]
+            if specs[medida]["agregacao"] == "distintos":
+                col = [c for c in valor.columns if c not in chaves][0]
+                valor = valor.groupby(chaves)[col].nunique()
+            series[medida] = valor
+        return series
+
+# ====================================================
+# Backend processos (tabelas fragmentadas por empresa/ano em processos separados)
+# ====================================================
+# Cada processo trabalhador abre o banco somente leitura (mmap: as páginas do arquivo ficam no
+# cache do sistema, compartilhadas entre os processos) e guarda só o seu fragmento de cada tabela,
+# com as datas já convertidas. O coordenador espalha cada plano para todos os fragmentos e junta os
+# parciais como o backend streaming junta lotes: somas e contagens se somam e os distintos vêm como
+# pares (grupo, valor) sem repetição, então o resultado é exato mesmo que um valor apareça em dois
+# fragmentos. As unidades (empresa, ano) são distribuídas pelo nº de linhas (maior primeiro para o
+# processo menos carregado); tabelas sem empresa nem data são divididas por rowid.
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_PROCESSOS (nº de CPUs)       processos trabalhadores (ative com RAYBOT_BACKEND=processos)
+#   RAYBOT_PROCESSOS_POR_ANO (1)        fragmenta por empresa e ano (0 = só por empresa)
+
+_FRAGMENTO = {"engine": None, "tabelas": {}}  # estado do processo trabalhador
+
+def _iniciar_trabalhador(caminho):
+    from conexao import criar_engine
+    _FRAGMENTO["engine"] = criar_engine(caminho, somente_leitura=True, wal=False, pool_size=1, max_overflow=0)
+
+def _tabela_do_fragmento(nome_real, versao, onde, params, col_data):
+    """(DataFrame, datas convertidas) do fragmento deste processo; recarrega quando a versão da tabela muda."""
+    atual = _FRAGMENTO["tabelas"].get(nome_real)
+    if atual is None or atual["versao"] != versao:
+        with _FRAGMENTO["engine"].connect() as conn:
+            registrar_funcoes_sqlite(conn)
+            df = pd.read_sql_query(text(f"SELECT * FROM {_q(nome_real)} WHERE {onde}"), conn, params=params)
+        df.columns = df.columns.str.lower()
+        atual = {"versao": versao, "df": df, "datas": {}}
+        _FRAGMENTO["tabelas"][nome_real] = atual
+    if col_data and col_data not in atual["datas"]:
+        atual["datas"][col_data] = converter_coluna_data(atual["df"][col_data])
+    return atual["df"], atual["datas"].get(col_data)
+
+def _agregar_no_fragmento(indice, pedidos):
+    """Roda no processo trabalhador: [(acumulado, achou) por variante do filtro] para cada tabela pedida."""
+    acumulador = BackendStreaming()
+    respostas = []
+    for p in pedidos:
+        onde, params = p["fragmentos"][indice]
+        df, datas = _tabela_do_fragmento(p["nome_real"], p["versao"], onde, params, p["col_data"])
+        acumulado = {v: {} for v in p["variantes"]}
+        achou = {v: False for v in p["variantes"]}
+        acumulador._processar_lote(df, p["col_data"], p["ini"], p["fim"], p["variantes"], p["agrupar_por"], p["chaves"],
+                                   p["medidas"], p["specs"], acumulado, achou, datas=datas)
+        respostas.append((acumulado, achou))
+    return respostas
+
+class BackendProcessos(BackendStreaming):
+    """
+    Mesma acumulação do backend streaming, com cada "lote" sendo o fragmento de um processo:
+    um INDOA do ano ou um painel da frota inteira usa todos os núcleos em vez de um só.
+    Os processos sobem na primeira consulta (spawn) e carregam seus fragmentos sob demanda.
+    """
+    nome = "processos"
+
+    def __init__(self, engine=None, processos=None, por_ano=None):
+        super().__init__(engine)
+        self.processos = processos or int(os.getenv("RAYBOT_PROCESSOS", "0")) or os.cpu_count() or 1
+        self.por_ano = (os.getenv("RAYBOT_PROCESSOS_POR_ANO", "1").strip().lower() in ("1", "true", "sim", "yes")
+                        if por_ano is None else por_ano)
+        self._executores = None
+        self._particoes = {}
+        self._lock = threading.RLock()
+
+    def _iniciar(self):
+        """Um executor de 1 processo por fragmento: cada pedido cai sempre no processo que tem o fragmento."""
+        with self._lock:
+            if self._executores is None:
+                with self.engine.connect() as conn:
+                    caminho = conn.execute(text("PRAGMA database_list")).fetchone()[2]
+                if not caminho:
+                    raise RuntimeError("backend 'processos' precisa de um banco em arquivo")
+                contexto = multiprocessing.get_context("spawn")
+                self._executores = [ProcessPoolExecutor(1, mp_context=contexto, initializer=_iniciar_trabalhador,
+                                                        initargs=(caminho,)) for _ in range(self.processos)]
+                atexit.register(self.encerrar)
+                LOG.info("backend processos: trabalhadores iniciados", extra=campos(processos=self.processos, banco=caminho))
+            return self._executores
+
+    def encerrar(self):
+        with self._lock:
+            for executor in self._executores or []:
+                executor.shutdown(wait=False, cancel_futures=True)
+            self._executores = None
+            self._particoes.clear()
+
+    def _particao(self, conn, tabela, nome_real, colunas):
+        """{"versao", "fragmentos": [(onde, params)] por processo}; refeita quando a marca d'água da tabela muda."""
+        with self._lock:
+            return self._particao_atual(conn, tabela, nome_real, colunas)
+
+    def _particao_atual(self, conn, tabela, nome_real, colunas):
+        atual = self._particoes.get(nome_real)
+        agora = time.monotonic()
+        if atual and agora - atual["verificado_em"] < tools.INTERVALO_VERIFICACAO_CACHE:
+            return atual
+        versao = tools._marca_dagua(conn, nome_real)
+        if atual and atual["versao"] == versao:
+            atual["verificado_em"] = agora
+            return atual
+
+        vazio = pd.DataFrame(columns=list(colunas))
+        partes = []
+        col_empresa = encontrar_coluna_empresa(vazio)
+        if col_empresa:
+            partes.append(f"raybot_chave({_q(colunas[col_empresa])})")
+        col_data = encontrar_coluna_flexivel(vazio, MAPA_DATAS[tabela]) if self.por_ano and tabela in MAPA_DATAS else None
+        if col_data:
+            partes.append(f"coalesce(substr({expressao_data_sql(colunas[col_data])}, 1, 4), '')")
+
+        if partes:
+            unidade = " || '|' || ".join(partes)
+            contagens = conn.execute(text(f"SELECT {unidade} AS u, count(*) FROM {_q(nome_real)} GROUP BY u")).fetchall()
+            cargas, unidades = [0] * self.processos, [[] for _ in range(self.processos)]
+            for u, linhas in sorted(contagens, key=lambda c: -c[1]):
+                i = cargas.index(min(cargas))
+                unidades[i].append(u)
+                cargas[i] += linhas
+            fragmentos = []
+            for us in unidades:
+                params = {f"u{j}": u for j, u in enumerate(us)}
+                fragmentos.append((f"{unidade} IN ({', '.join(':' + k for k in params)})" if us else "0", params))
+        else:
+            cargas = None
+            fragmentos = [(f"rowid % {self.processos} = {i}", {}) for i in range(self.processos)]
+
+        atual = {"versao": versao, "verificado_em": agora, "fragmentos": fragmentos}
+        self._particoes[nome_real] = atual
+        LOG.debug("backend processos: partição refeita", extra=campos(tabela=nome_real, linhas_por_processo=cargas))
+        return atual
+
+    def _espalhar(self, pedidos):
+        """Manda os pedidos a todos os processos e junta os parciais de cada tabela e variante."""
+        executores = self._iniciar()
+        try:
+            futuros = [executor.submit(_agregar_no_fragmento, i, pedidos) for i, executor in enumerate(executores)]
+            por_processo = [f.result() for f in futuros]
+        except BrokenProcessPool:
+            self.encerrar()  # a próxima consulta sobe processos novos
+            raise
+
+        juntos = []
+        for n, p in enumerate(pedidos):
+            acumulado, achou = {}, {}
+            for v in p["variantes"]:
+                partes = [r[n][0][v] for r in por_processo]
+                achou[v] = any(r[n][1][v] for r in por_processo)
+                acumulado[v] = self._juntar(partes, p["specs"])
+            juntos.append((acumulado, achou))
+        return juntos
+
+    def _juntar(self, partes, specs):
+        por_medida = {}
+        for parcial in partes:
+            for medida, valor in parcial.items():
+                por_medida.setdefault(medida, []).append(valor)
+        acumulado = {}
+        for medida, valores in por_medida.items():
+            if specs[medida]["agregacao"] == "distintos":
+                acumulado[medida] = _pares_distintos(pd.concat(valores))
+            else:
+                total = valores[0]
+                for valor in valores[1:]:
+                    total = total.add(valor, fill_value=0)
+                acumulado[medida] = total
+        return acumulado
+
+    def agregar(self, plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=()):
+        chaves = _chaves(agrupar_por)
+        ini, fim = _intervalo(data_inicial, data_final)
+        usa_data = bool(data_inicial or data_final or "mes" in agrupar_por)
+        pedidos, candidatas_por_tabela = [], {}
+        with self.engine.connect() as conn:
+            registrar_funcoes_sqlite(conn)
+            for tabela in plano["tabelas"]:
+                nome_real = tools.resolver_nome_tabela(tabela)
+                if not nome_real: continue
+                linhas = conn.execute(text(f"PRAGMA table_info({_q(nome_real)})")).fetchall()
+                colunas = {row[1].lower(): row[1] for row in linhas}
+                vazio = pd.DataFrame(columns=list(colunas))
+                col_data = encontrar_coluna_flexivel(vazio, MAPA_DATAS[tabela]) if usa_data else None
+                if "mes" in agrupar_por and not col_data:
+                    continue
+
+                # Mesma regra do streaming: 1ª coluna candidata com o valor exato, somando todos os processos
+                candidatas = []
+                if filtro_coluna and filtro_valor:
+                    termo = normalizar_texto(filtro_coluna)
+                    candidatas = [c for c in colunas if termo in normalizar_texto(c)]
+                candidatas_por_tabela[nome_real] = (candidatas, colunas)
+                particao = self._particao(conn, tabela, nome_real, colunas)
+                pedidos.append({"nome_real": nome_real, "versao": particao["versao"], "fragmentos": particao["fragmentos"],
+                                "col_data": col_data, "ini": ini, "fim": fim, "agrupar_por": tuple(agrupar_por), "chaves": chaves,
+                                "medidas": [m for m in plano["medidas"] if plano["specs"][m]["tabela"] == tabela],
+                                "specs": plano["specs"],
+                                "variantes": [(c, (tools.chave_filtro(filtro_valor),)) for c in candidatas] or [None]})
+            if not pedidos:
+                return {}
+
+            anotar(processos=self.processos, tabelas=len(pedidos))
+            resultados = dict(zip((p["nome_real"] for p in pedidos), self._espalhar(pedidos)))
+
+            # Valor exato em nenhuma candidata: 2ª rodada só dessas tabelas, com os valores do índice de valores
+            segunda, resolucoes = [], {}
+            for p in pedidos:
+                acumulado, achou = resultados[p["nome_real"]]
+                if next((v for v in p["variantes"] if v is None or achou[v]), False) is not False:
+                    continue
+                candidatas, colunas = candidatas_por_tabela[p["nome_real"]]
+                aproximadas = []
+                for c, valores, modo, originais in _aproximadas(filtro_valor, candidatas,
+                                                                lambda c: _indice_sql(conn, p["nome_real"], colunas[c])):
+                    aproximadas.append((c, tuple(valores)))
+                    resolucoes[(p["nome_real"], aproximadas[-1])] = (modo, originais)
+                if aproximadas:
+                    segunda.append({**p, "variantes": aproximadas})
+            if segunda:
+                resultados.update(zip((p["nome_real"] for p in segunda), self._espalhar(segunda)))
+                pedidos = [next((s for s in segunda if s["nome_real"] == p["nome_real"]), p) for p in pedidos]
+
+        series = {}
+        for p in pedidos:
+            acumulado, achou = resultados[p["nome_real"]]
+            escolhida = next((v for v in p["variantes"] if v is None or achou[v]), False)
+            if escolhida is False:
+                continue
+            if escolhida is not None and escolhida[1] != (tools.chave_filtro(filtro_valor),):
+                modo, originais = resolucoes[(p["nome_real"], escolhida)]
+                anotar(filtro_coluna=escolhida[0], filtro_resolvido=",".join(escolhida[1]), modo=modo)
+                tools.registrar_resolucao_filtro(filtro_valor, escolhida[0], originais, modo)
+            series.update(self._finalizar(acumulado[escolhida], p["medidas"], p["specs"], chaves))
+        return series
+
+# ====================================================
+# Seleção do backend
+# ====================================================
+
+BACKENDS = {"pandas": BackendPandas, "sqlite": BackendSQLite, "arrow": BackendArrow, "streaming": BackendStreaming,
+            "processos": BackendProcessos}
+_INSTANCIAS = {}
+# {tabela: (max_rowid, linhas, verificado_em)}: revista a cada RAYBOT_INTERVALO_VERIFICACAO_CACHE s
+_CONTAGEM_LINHAS = {}
+
+def obter_backend(nome):
+    if nome not in _INSTANCIAS:
+        _INSTANCIAS[nome] = BACKENDS[nome]()
+    return _INSTANCIAS[nome]
+
+def _linhas_tabela(tabela):
+    """
+    Quantidade de linhas para decidir entre memória e SQL no modo 'auto'. Fica em cache pelo mesmo
+    intervalo do cache de tabelas; depois disso a marca d'água é conferida e a contagem refeita
+    se o max(rowid) mudou, para que uma tabela que cresceu além do limite passe a ir para o SQL.
+    """
+    agora = time.monotonic()
+    anterior = _CONTAGEM_LINHAS.get(tabela)
+    if anterior and agora - anterior[2] < tools.INTERVALO_VERIFICACAO_CACHE:
+        return anterior[1]
+    nome_real = tools.resolver_nome_tabela(tabela)
+    if not nome_real: return 0
+    with tools.GLOBAL_ENGINE.connect() as conn:
+        max_rowid = conn.execute(text(f"SELECT max(rowid) FROM {_q(nome_real)}")).scalar() if anterior and anterior[0] is not None else None
+        if anterior and max_rowid is not None and max_rowid == anterior[0]:
+            linhas = anterior[1]
+        else:
+            max_rowid, linhas = tools._marca_dagua(conn, nome_real)
+    _CONTAGEM_LINHAS[tabela] = (max_rowid, linhas, agora)
+    return linhas
+
+def escolher_backend(plano=None):
+    """
+    Backend definido por RAYBOT_BACKEND (pandas | sqlite | arrow | streaming | processos | auto; padrão auto).
+    No modo auto usa pandas quando as tabelas já estão em memória ou são pequenas,
+    e SQL agregado quando alguma tabela ainda não carregada passa de
+    RAYBOT_LIMITE_LINHAS_MEMORIA linhas (padrão 2.000.000).
+    """
+    nome = os.getenv("RAYBOT_BACKEND", "auto").strip().lower()
+    if nome == "arrow" and pa is None:
+        LOG.warning("pyarrow não instalado; usando backend pandas")
+        nome = "pandas"
+    if nome in BACKENDS:
+        return obter_backend(nome)
+
+    limite = int(os.getenv("RAYBOT_LIMITE_LINHAS_MEMORIA", "2000000"))
+    with tools._CACHE_LOCK:
+        em_memoria = {nome_cache.lower() for nome_cache in tools._DF_CACHE}
+    for tabela in (plano or {}).get("tabelas", {}):
+        if any(tabela.lower() in c for c in em_memoria): continue
+        if _linhas_tabela(tabela) > limite:
+            return obter_backend("sqlite")
+    return obter_backend("pandas")
+
+def aquecer_cache_do_backend():
+    """
+    Aquece o cache só com o que o backend configurado vai ler da memória: com sqlite, streaming
+    ou processos os KPIs não usam o cache; no modo auto ficam de fora as tabelas acima de
+    RAYBOT_LIMITE_LINHAS_MEMORIA (carregá-las faria o auto escolher pandas). METAS é sempre
+    carregada (pequena, lida da memória pelo INDOA em qualquer backend).
+    """
+    nome = os.getenv("RAYBOT_BACKEND", "auto").strip().lower()
+    if nome in ("sqlite", "streaming", "processos"):
+        tabelas = []
+    elif nome in BACKENDS:
+        tabelas = list(MAPA_DATAS)
+    else:
+        limite = int(os.getenv("RAYBOT_LIMITE_LINHAS_MEMORIA", "2000000"))
+        tabelas = [t for t in MAPA_DATAS if _linhas_tabela(t) <= limite]
+    LOG.info("cache: aquecimento", extra=campos(backend=nome, tabelas=tabelas + ["METAS"]))
+    tools.aquecer_cache(tabelas + ["METAS"])
+
+# ====================================================
+# Conformidade entre backends
+# ====================================================
+
+CASOS_CONFORMIDADE = [
+    {},
+    {"data_inicial": "2024-03-01", "data_final": "2024-03-31"},
+    {"data_inicial": "2023-01-01", "data_final": "2023-12-31", "filtro_coluna": "empresa", "filtro_valor": "Leblon"},
+    {"filtro_coluna": "onibus", "filtro_valor": "B 1010"},
+    # Valores resolvidos pelo índice de valores (tools.IndiceValores)
+    {"data_inicial": "2024-03-01", "data_final": "2024-03-31", "filtro_coluna": "onibus", "filtro_valor": "ônibus b-1010"},
+    {"filtro_coluna": "empresa", "filtro_valor": "Lebon"},
+    {"data_inicial": "2024-01-01", "data_final": "2024-12-31", "agrupar_por": ("empresa", "mes")},
+    {"data_inicial": "2024-01-01", "data_final": "2024-06-30", "agrupar_por": ("onibus",)},
+    {"data_inicial": "2024-01-01", "data_final": "2024-12-31", "agrupar_por": ("onibus", "mes")},
+    # Valor de filtro inexistente com agrupamento: grade vazia com os níveis dos grupos
+    {"data_inicial": "2024-01-01", "data_final": "2024-12-31", "filtro_coluna": "empresa", "filtro_valor": "Inexistente",
+     "agrupar_por": ("empresa", "mes")},
+]
+
+def _divergencias_tools(plano, grade, caso):
+    """
+    Texto das tools de KPI (tools.CONFIG_KPI) contra o plano: o número escrito pela tool tem de ser
+    o valor do KPI no formato de DEFINICOES_KPI, e a direção de melhoria tem de ser a mesma.
+    """
+    from kpi_plano import DEFINICOES_KPI, aplicar_formulas, formatar_kpi
+
+    valores = aplicar_formulas(plano, grade).iloc[0]
+    divergencias = []
+    for kpi, config in tools.CONFIG_KPI.items():
+        if kpi not in DEFINICOES_KPI: continue  # INDOA: composição, conferida pelos componentes
+        if config["melhor"] != DEFINICOES_KPI[kpi]["melhor"]:
+            divergencias.append(("tools", caso, kpi, "melhor", config["melhor"], DEFINICOES_KPI[kpi]["melhor"]))
+        if pd.isna(valores[kpi]): continue
+        texto = config["func"].func(**caso)
+        esperado = formatar_kpi(kpi, valores[kpi])
+        if tools.extrair_valor_numerico(texto) != tools.extrair_valor_numerico(esperado):
+            divergencias.append(("tools", caso, kpi, texto, esperado))
+    return divergencias
+
+def verificar_conformidade(backends=None, casos=None, tolerancia=1e-9):
+    """
+    Roda todos os KPIs em cada caso com cada backend e compara as grades de medidas
+    com o backend pandas (referência); nos casos sem agrupamento confere também o texto
+    das tools de KPI contra o plano. Retorna a lista de divergências encontradas.
+    """
+    from kpi_plano import DEFINICOES_KPI, montar_plano, executar_plano
+
+    backends = backends or [n for n in BACKENDS if n != "pandas" and (n != "arrow" or pa is not None)]
+    plano = montar_plano(list(DEFINICOES_KPI))
+    divergencias = []
+    for caso in casos or CASOS_CONFORMIDADE:
+        referencia = executar_plano(plano, backend=obter_backend("pandas"), **caso)
+        if not caso.get("agrupar_por"):
+            divergencias += _divergencias_tools(plano, referencia, caso)
+        for nome in backends:
+            grade = executar_plano(plano, backend=obter_backend(nome), **caso)
+            # Grades vazias só diferem no dtype dos níveis do índice
+            if not referencia.index.equals(grade.index) and not (len(referencia) == 0 and len(grade) == 0):
+                divergencias.append((nome, caso, "índice", len(referencia), len(grade)))
+                continue
+            for medida in plano["medidas"]:
+                a, b = referencia[medida].astype(float), grade[medida].astype(float)
+                iguais = ((a - b).abs() <= tolerancia * a.abs().clip(lower=1)) | (a.isna() & b.isna())
+                if not iguais.all():
+                    divergencias.append((nome, caso, medida, a[~iguais].head(3).to_dict(), b[~iguais].head(3).to_dict()))
+    return divergencias
+
+if __name__ == "__main__":
+    # Uso: python backends.py [caminho_db]
+    from sqlalchemy import create_engine
+
+    caminho = sys.argv[1] if len(sys.argv) > 1 else "db_raybot"
+    tools.set_db_engine(create_engine(f"sqlite:///{caminho}"))
+    divergencias = verificar_conformidade()
+    for d in divergencias:
+        print(f"{Fore.RED}❌ {d}{Style.RESET_ALL}")
+    print(f"{Fore.GREEN if not divergencias else Fore.RED}Conformidade: {len(divergencias)} divergência(s).{Style.RESET_ALL}")
+    sys.exit(1 if divergencias else 0)
@@ -0,0 +1,159 @@
+import io
+import os
+import sys
+import json
+import asyncio
+import argparse
+import platform
+import datetime
+import statistics
+import contextlib
+
+# Harness sempre offline: sem cache de respostas (toda pergunta passa pelo agente)
+os.environ["RAYBOT_CACHE_RESPOSTAS"] = "0"
+
+import main as raybot
+import rastreamento
+import logs
+import tools as kpi_tools
+from tools import Fore, Style
+
+# ====================================================
+# Latência do agente de ponta a ponta, offline (LLMRoteiro no lugar da OpenAI)
+# ====================================================
+# Cada caso é uma pergunta com um roteiro de tools (llm_falso.LLMRoteiro) rodando no mesmo
+# create_react_agent do main.py (memória, prompt, streaming). O tempo de cada turno é dividido em:
+#   modelo      chamadas ao modelo (latência simulada = --atraso-modelo por chamada)
+#   ferramentas execução das tools (união dos intervalos: tools em paralelo não contam em dobro)
+#   grafo       o resto: LangGraph, prompt, memória, eventos
+# A divisão vem dos spans de rastreamento.py. O JSON de saída pode ser comparado com um anterior.
+#
+# Uso: python benchmark_agente.py [--db db_sintetico] [--ano 2024] [--repeticoes 5] [--atraso-modelo 0.2]
+#                                 [--casos sem_tools,kpi_por_mes] [--saida r.json] [--comparar anterior.json]
+
+def montar_casos(ano, empresa="Leblon"):
+    """{nome: (pergunta, passos do roteiro)}; cada passo é a lista de tools pedidas numa chamada ao modelo."""
+    periodo = {"data_inicial": f"{ano}-03-01", "data_final": f"{ano}-03-31"}
+    filtro = {"filtro_coluna": "empresa", "filtro_valor": empresa}
+    return {
+        "sem_tools": ("Olá, o que você sabe fazer?", []),
+        "kpi_por_mes": (f"ICMQ mês a mês em {ano}", [[{"nome": "calcular_kpi_por_mes", "args": {"indicador": "ICMQ", "ano": ano}}]]),
+        "icmq_idf_paralelo": (f"ICMQ e IDF da {empresa} em março de {ano}", [[
+            {"nome": "calcular_icmq", "args": {**periodo, **filtro}},
+            {"nome": "calcular_idf", "args": {**periodo, **filtro}}]]),
+        "painel": (f"Painel de ICMQ, IDF e IMP de março de {ano}", [[
+            {"nome": "calcular_painel_kpis", "args": {"indicadores": ["ICMQ", "IDF", "IMP"], **periodo}}]]),
+        "evolucao_e_meta": (f"O IDF da {empresa} melhorou de fevereiro para março de {ano}? E a meta?", [
+            [{"nome": "analisar_evolucao_kpi", "args": {
+                "indicador": "IDF", "data_atual_ini": f"{ano}-03-01", "data_atual_fim": f"{ano}-03-31",
+                "data_anterior_ini": f"{ano}-02-01", "data_anterior_fim": f"{ano}-02-28", **filtro}}],
+            [{"nome": "consultar_meta_indicador", "args": {"indicador": "IDF", "empresa": empresa, "data_referencia": f"{ano}-03-01"}}]]),
+        "sql": ("Quantos lançamentos de custo existem?", [[{"nome": "sql_db_query", "args": {"query": "SELECT count(*) FROM CTM"}}]]),
+    }
+
+def _uniao_s(intervalos):
+    """Tempo coberto por intervalos (inicio, fim) que podem se sobrepor."""
+    total, fim_atual = 0.0, None
+    for inicio, fim in sorted(intervalos):
+        if fim_atual is None or inicio > fim_atual:
+            total += fim - inicio
+            fim_atual = fim
+        elif fim > fim_atual:
+            total += fim - fim_atual
+            fim_atual = fim
+    return total
+
+def dividir_turno(turno_id, total_s):
+    """{total_s, modelo_s, ferramentas_s, grafo_s, chamadas_modelo, chamadas_tools} a partir dos spans do turno."""
+    with rastreamento._LOCK:
+        spans = [s for s in rastreamento.SPANS if s["turno"] == turno_id]
+    intervalos = lambda nome: [(s["inicio"], s["inicio"] + s["duracao_ms"] / 1000) for s in spans if s["nome"] == nome]
+    modelo, ferramentas = _uniao_s(intervalos("llm")), _uniao_s(intervalos("ferramenta"))
+    return {"total_s": total_s, "modelo_s": modelo, "ferramentas_s": ferramentas,
+            "grafo_s": max(total_s - modelo - ferramentas, 0.0),
+            "chamadas_modelo": len(intervalos("llm")), "chamadas_tools": len(intervalos("ferramenta"))}
+
+async def medir_caso(agente, pergunta, repeticoes):
+    medidas = []
+    for _ in range(repeticoes):
+        # Prints do main.py (tamanho do prompt) não entram no relatório
+        with contextlib.redirect_stdout(io.StringIO()):
+            resultado = await raybot.responder(agente, pergunta)
+        if resultado["erro"]:
+            raise RuntimeError(f"'{pergunta}' terminou com erro: {resultado['erro']}")
+        medidas.append(dividir_turno(resultado["turno"], resultado["duracao_s"]))
+
+    def mediana(campo):
+        return round(statistics.median(m[campo] for m in medidas), 4)
+    totais = sorted(m["total_s"] for m in medidas)
+    return {"total_mediana_s": mediana("total_s"), "total_p95_s": round(totais[min(int(len(totais) * 0.95), len(totais) - 1)], 4),
+            "modelo_mediana_s": mediana("modelo_s"), "ferramentas_mediana_s": mediana("ferramentas_s"),
+            "grafo_mediana_s": mediana("grafo_s"), "chamadas_modelo": medidas[-1]["chamadas_modelo"],
+            "chamadas_tools": medidas[-1]["chamadas_tools"], "resposta": resultado["resposta"].splitlines()[0][:120]}
+
+def comparar(atual, anterior):
+    print(f"\n📊 Comparação com {anterior['gerado_em']} ({anterior['db']}, atraso {anterior['atraso_modelo_s']}s)")
+    print(f"{'caso':<20}{'grafo antes':>13}{'grafo agora':>13}{'tools antes':>13}{'tools agora':>13}{'total':>16}")
+    for nome, r in atual["resultados"].items():
+        a = anterior["resultados"].get(nome)
+        if not a:
+            continue
+        cor = Fore.RED if r["grafo_mediana_s"] > a["grafo_mediana_s"] * 1.2 + 0.005 else ""
+        print(f"{nome:<20}{a['grafo_mediana_s']:>13.4f}{cor}{r['grafo_mediana_s']:>13.4f}{Style.RESET_ALL}"
+              f"{a['ferramentas_mediana_s']:>13.4f}{r['ferramentas_mediana_s']:>13.4f}"
+              f"{a['total_mediana_s']:>8.3f}->{r['total_mediana_s']:<7.3f}")
+
+async def principal(args):
+    casos = montar_casos(args.ano, args.empresa)
+    if args.casos:
+        casos = {n: c for n, c in casos.items() if n in {x.strip() for x in args.casos.split(",")}}
+
+    logs.configurar(nivel="WARNING")
+    raybot.USAR_ROTEADOR = False  # perguntas simples iriam pela rota rápida, sem passar pelo grafo
+    llm = raybot.criar_llm("roteiro", roteiros={p: passos for p, passos in casos.values()}, atraso=args.atraso_modelo)
+    with contextlib.redirect_stderr(io.StringIO()):  # avisos do SQLAlchemy ao refletir índices de expressão
+        agente = raybot.construir_agente(llm=llm, db=raybot.configurar_banco(args.db))
+    await asyncio.to_thread(kpi_tools.aquecer_cache)
+
+    print(f"\n⏱️ Latência do agente ({args.db}, {args.repeticoes} repetições, modelo simulado {args.atraso_modelo}s/chamada)")
+    print(f"{'caso':<20}{'total':>9}{'p95':>9}{'modelo':>9}{'tools':>9}{'grafo':>9}{'chamadas':>10}")
+    resultados = {}
+    for nome, (pergunta, _) in casos.items():
+        await medir_caso(agente, pergunta, 1)  # aquecimento (1ª execução da tool, imports tardios)
+        r = await medir_caso(agente, pergunta, args.repeticoes)
+        resultados[nome] = r
+        print(f"{nome:<20}{r['total_mediana_s']:>9.3f}{r['total_p95_s']:>9.3f}{r['modelo_mediana_s']:>9.3f}"
+              f"{r['ferramentas_mediana_s']:>9.3f}{r['grafo_mediana_s']:>9.3f}{r['chamadas_modelo']:>5}/{r['chamadas_tools']:<4}")
+
+    saida = {"gerado_em": datetime.datetime.now().isoformat(timespec="seconds"), "db": args.db, "ano": args.ano,
+             "repeticoes": args.repeticoes, "atraso_modelo_s": args.atraso_modelo,
+             "backend": os.getenv("RAYBOT_BACKEND", "auto"), "python": platform.python_version(),
+             "grafo_total_s": round(sum(r["grafo_mediana_s"] for r in resultados.values()), 4),
+             "resultados": resultados}
+    print(f"\nOverhead do grafo (soma das medianas): {saida['grafo_total_s']:.3f}s")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência do agente de ponta a ponta com modelo simulado (offline).")
+    parser.add_argument("--db", default="db_sintetico")
+    parser.add_argument("--ano", type=int, default=2024)
+    parser.add_argument("--empresa", default="Leblon")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--atraso-modelo", type=float, default=0.0, help="Latência simulada de cada chamada ao modelo (s)")
+    parser.add_argument("--casos", default=None, help="Só os casos com estes nomes (separados por vírgula)")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar os resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"Banco '{args.db}' não encontrado (crie um sintético com: python gerar_db.py).")
+        sys.exit(1)
+    asyncio.run(principal(args))
+
+if __name__ == "__main__":
+    main()
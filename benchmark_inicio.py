@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import select
+import argparse
+import platform
+import datetime
+import statistics
+import subprocess
+from collections import defaultdict
+
+from tools import Fore, Style
+
+# ====================================================
+# Tempo de inicialização da CLI (até o prompt) e custo de cada import
+# ====================================================
+# Mede, em processos novos (sem nada em cache no interpretador):
+#   prompt_s    do início do processo até aparecer "Pergunte:" no terminal
+#   pronto_s    respondendo "sair" assim que o prompt aparece: até o processo terminar, ou seja, até
+#               o agente (modelo, tools, grafo) e o cache de tabelas montados em segundo plano ficarem prontos
+#   imports     python -X importtime -c "import main": tempo acumulado de cada import direto do main.py
+#               e tempo próprio somado por pacote (pandas, langchain_openai, langgraph, sqlalchemy...)
+# Nada é perguntado ao modelo: com --modelo openai (padrão) uma chave falsa basta, não há chamada de rede.
+#
+# Uso: python benchmark_inicio.py [--db db_sintetico] [--modelo openai] [--repeticoes 5]
+#                                 [--saida r.json] [--comparar anterior.json]
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+MARCA_PROMPT = b"Pergunte:"
+
+def _ambiente(db, modelo):
+    env = {**os.environ, "RAYBOT_DB_CAMINHO": os.path.abspath(db), "RAYBOT_MODELO": modelo,
+           "PYTHONIOENCODING": "utf-8", "RAYBOT_LOG_NIVEL": "WARNING", "RAYBOT_CACHE_RESPOSTAS": "0"}
+    if modelo == "openai":
+        env.setdefault("OPENAI_API_KEY", "sk-benchmark-sem-rede")
+    return env
+
+def medir_prompt(db, modelo, tempo_maximo=120):
+    """(prompt_s, pronto_s) de uma execução da CLI: espera o prompt, manda 'sair' e espera o processo terminar."""
+    inicio = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, "main.py"], cwd=PASTA, env=_ambiente(db, modelo),
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    saida, prompt_s = b"", None
+    try:
+        while prompt_s is None:
+            restante = tempo_maximo - (time.perf_counter() - inicio)
+            if restante <= 0 or not select.select([proc.stdout], [], [], restante)[0]:
+                raise RuntimeError(f"prompt não apareceu em {tempo_maximo}s")
+            bloco = os.read(proc.stdout.fileno(), 65536)
+            if not bloco:
+                raise RuntimeError(f"main.py terminou antes do prompt: {saida.decode(errors='replace')[-300:]}")
+            saida += bloco
+            if MARCA_PROMPT in saida:
+                prompt_s = time.perf_counter() - inicio
+        proc.stdin.write(b"sair\n")
+        proc.stdin.flush()
+        proc.communicate(timeout=tempo_maximo)
+        return prompt_s, time.perf_counter() - inicio
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+
+def medir_imports(db, modelo):
+    """
+    {"total_s", "diretos": {módulo: s}, "pacotes": {pacote: s}} de um 'import main' com -X importtime.
+    diretos = acumulado de cada import feito pelo próprio main.py; pacotes = tempo próprio somado por pacote raiz.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"], cwd=PASTA,
+                          env=_ambiente(db, modelo), capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import main falhou: {proc.stderr[-300:]}")
+    diretos, pacotes, total = {}, defaultdict(float), 0.0
+    for linha in proc.stderr.splitlines():
+        # "import time:       123 |        456 |   pacote.modulo" (µs próprio | µs acumulado | nome indentado)
+        if not linha.startswith("import time:") or linha.count("|") != 2:
+            continue
+        proprio, acumulado, nome = linha[len("import time:"):].split("|")
+        if not proprio.strip().isdigit():
+            continue  # cabeçalho
+        profundidade = (len(nome) - len(nome.lstrip())) // 2
+        nome = nome.strip()
+        pacotes[nome.split(".")[0]] += int(proprio) / 1e6
+        if nome == "main":
+            total = int(acumulado) / 1e6
+        elif profundidade == 1:
+            diretos[nome] = diretos.get(nome, 0) + int(acumulado) / 1e6
+    ordenar = lambda d: {k: round(v, 4) for k, v in sorted(d.items(), key=lambda kv: -kv[1])}
+    return {"total_s": round(total, 4), "diretos": ordenar(diretos), "pacotes": ordenar(pacotes)}
+
+def comparar(atual, anterior):
+    print(f"\n📊 Comparação com {anterior['gerado_em']} ({anterior['db']}, modelo {anterior['modelo']})")
+    print(f"{'medida':<22}{'antes':>10}{'agora':>10}")
+    for campo in ("prompt_mediana_s", "pronto_mediana_s"):
+        cor = Fore.RED if atual[campo] > anterior[campo] * 1.2 + 0.05 else ""
+        print(f"{campo:<22}{anterior[campo]:>10.3f}{cor}{atual[campo]:>10.3f}{Style.RESET_ALL}")
+    print(f"{'import main':<22}{anterior['imports']['total_s']:>10.3f}{atual['imports']['total_s']:>10.3f}")
+    for nome in list(anterior["imports"]["diretos"])[:10]:
+        print(f"  {nome:<20}{anterior['imports']['diretos'][nome]:>10.3f}{atual['imports']['diretos'].get(nome, 0.0):>10.3f}")
+
+def principal(args):
+    print(f"\n⏱️ Inicialização da CLI ({args.db}, modelo {args.modelo}, {args.repeticoes} repetições)")
+    medidas = []
+    for i in range(args.repeticoes):
+        prompt_s, pronto_s = medir_prompt(args.db, args.modelo)
+        medidas.append((prompt_s, pronto_s))
+        print(f"  execução {i + 1}: prompt {prompt_s:.3f}s | pronto {pronto_s:.3f}s")
+    imports = medir_imports(args.db, args.modelo)
+
+    saida = {"gerado_em": datetime.datetime.now().isoformat(timespec="seconds"), "db": args.db, "modelo": args.modelo,
+             "repeticoes": args.repeticoes, "python": platform.python_version(),
+             "prompt_mediana_s": round(statistics.median(m[0] for m in medidas), 4),
+             "pronto_mediana_s": round(statistics.median(m[1] for m in medidas), 4),
+             "imports": imports}
+    print(f"\nTempo até o prompt (mediana): {saida['prompt_mediana_s']:.3f}s | agente pronto: {saida['pronto_mediana_s']:.3f}s")
+    print(f"\n📦 import main: {imports['total_s']:.3f}s")
+    print(f"{'import direto do main.py':<40}{'acumulado (s)':>15}")
+    for nome, s in list(imports["diretos"].items())[:args.top]:
+        print(f"{nome:<40}{s:>15.3f}")
+    print(f"\n{'pacote':<40}{'próprio (s)':>15}")
+    for nome, s in list(imports["pacotes"].items())[:args.top]:
+        print(f"{nome:<40}{s:>15.3f}")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo até o prompt da CLI e custo de import de cada módulo.")
+    parser.add_argument("--db", default="db_sintetico")
+    parser.add_argument("--modelo", default="openai", help="RAYBOT_MODELO da CLI medida (openai, falso...)")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="Quantos imports/pacotes mostrar")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar os resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"Banco '{args.db}' não encontrado (crie um sintético com: python gerar_db.py).")
+        sys.exit(1)
+    principal(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import platform
+import datetime
+import statistics
+import tracemalloc
+import pandas as pd
+
+import tools
+from tools import Fore, Style, CONFIG_KPI
+from conexao import criar_engine
+import logs
+
+# ====================================================
+# Benchmark das tools de KPI (frio = cache de tabelas vazio, quente = tabelas já em memória)
+# ====================================================
+# Mede cada tool de CONFIG_KPI + calcular_kpi_por_mes, analisar_evolucao_kpi e calcular_indoa:
+# tempo frio, mediana/mínimo quente e pico de memória (tracemalloc, numa execução à parte para
+# não distorcer o tempo). O JSON de saída pode ser comparado com um anterior via --comparar.
+#
+# Uso: python benchmark_kpis.py [--db db_sintetico] [--gerar 1000000] [--ano 2024] [--repeticoes 3]
+#                               [--filtro-empresa Leblon] [--saida resultado.json] [--comparar anterior.json]
+
+def montar_casos(ano, empresa=None):
+    """{nome: (tool, kwargs)}; período = março do ano e, se houver, filtro de empresa."""
+    filtro = {"filtro_coluna": "empresa", "filtro_valor": empresa} if empresa else {}
+    periodo = {"data_inicial": f"{ano}-03-01", "data_final": f"{ano}-03-31", **filtro}
+    casos = {nome: (cfg["func"], periodo) for nome, cfg in CONFIG_KPI.items()}
+    casos["KPI_POR_MES(ICMQ)"] = (tools.calcular_kpi_por_mes, {"indicador": "ICMQ", "ano": ano, **filtro})
+    casos["KPI_POR_MES(OEMCP)"] = (tools.calcular_kpi_por_mes, {"indicador": "OEMCP", "ano": ano, **filtro})
+    casos["EVOLUCAO(IDF)"] = (tools.analisar_evolucao_kpi, {
+        "indicador": "IDF", "data_atual_ini": f"{ano}-03-01", "data_atual_fim": f"{ano}-03-31",
+        "data_anterior_ini": f"{ano}-02-01", "data_anterior_fim": f"{ano}-02-28", **filtro})
+    casos["INDOA(ano)"] = (tools.calcular_indoa, {"data_inicial": f"{ano}-01-01", "data_final": f"{ano}-12-31", **filtro})
+    return casos
+
+def _executar(tool, kwargs):
+    """Chama a função original da tool (sem o wrapper do LangChain)."""
+    return tool.func(**kwargs)
+
+def _medir_pico(tool, kwargs):
+    tracemalloc.start()
+    try:
+        _executar(tool, kwargs)
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def medir_caso(tool, kwargs, repeticoes):
+    # Frio: todas as tabelas saem do cache; a tool paga a leitura do SQLite
+    tools.invalidar_cache()
+    inicio = time.perf_counter()
+    resposta = _executar(tool, kwargs)
+    frio = time.perf_counter() - inicio
+
+    quentes = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        _executar(tool, kwargs)
+        quentes.append(time.perf_counter() - inicio)
+    pico_quente = _medir_pico(tool, kwargs)
+    tools.invalidar_cache()
+    pico_frio = _medir_pico(tool, kwargs)
+
+    return {"frio_s": round(frio, 4), "quente_mediana_s": round(statistics.median(quentes), 4),
+            "quente_min_s": round(min(quentes), 4), "pico_frio_mb": round(pico_frio, 1),
+            "pico_quente_mb": round(pico_quente, 1),
+            # Resumo da resposta: mudança aqui entre dois JSONs = resultado diferente, não só tempo
+            "resposta_sha1": hashlib.sha1(resposta.encode("utf-8")).hexdigest()[:12],
+            "resposta": resposta.splitlines()[0][:120] if resposta else ""}
+
+def contar_linhas(engine):
+    from sqlalchemy import text
+    with engine.connect() as conn:
+        nomes = [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))]
+        return {n: conn.execute(text(f'SELECT count(*) FROM "{n}"')).scalar() for n in nomes}
+
+def comparar(atual, anterior):
+    print(f"\n📊 Comparação com {anterior['gerado_em']} ({anterior['db']})")
+    print(f"{'caso':<26}{'quente antes':>14}{'quente agora':>14}{'ganho':>8}{'pico MB':>16}  resultado")
+    for nome, r in atual["resultados"].items():
+        a = anterior["resultados"].get(nome)
+        if not a:
+            continue
+        ganho = a["quente_mediana_s"] / r["quente_mediana_s"] if r["quente_mediana_s"] else 0
+        igual = "=" if a["resposta_sha1"] == r["resposta_sha1"] else f"{Fore.RED}DIFERENTE{Style.RESET_ALL}"
+        print(f"{nome:<26}{a['quente_mediana_s']:>14.4f}{r['quente_mediana_s']:>14.4f}{ganho:>7.2f}x"
+              f"{a['pico_quente_mb']:>8.1f}->{r['pico_quente_mb']:<7.1f} {igual}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark das tools de KPI (frio/quente, tempo e memória).")
+    parser.add_argument("--db", default="db_sintetico")
+    parser.add_argument("--gerar", type=int, default=None, help="Gera o banco sintético com N linhas antes (gerar_db.py)")
+    parser.add_argument("--ano", type=int, default=2024)
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--filtro-empresa", default=None, help="Roda todos os casos filtrando esta empresa")
+    parser.add_argument("--casos", default=None, help="Só os casos com estes nomes (separados por vírgula)")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar os resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+
+    if args.gerar:
+        from gerar_db import gerar_db
+        gerar_db(args.db, args.gerar)
+    if not os.path.exists(args.db):
+        print(f"Banco '{args.db}' não encontrado (use --gerar N para criar um sintético).")
+        sys.exit(1)
+
+    # Só avisos e erros: o log de cada chamada de tool não entra na medição
+    logs.configurar(nivel="WARNING")
+    engine = criar_engine(args.db)
+    tools.set_db_engine(engine)
+    casos = montar_casos(args.ano, args.filtro_empresa)
+    if args.casos:
+        casos = {n: c for n, c in casos.items() if n in {x.strip() for x in args.casos.split(",")}}
+
+    print(f"\n⏱️ Benchmark de KPIs ({args.db}, ano {args.ano}, {args.repeticoes} repetições quentes)")
+    print(f"{'caso':<26}{'frio':>10}{'quente':>10}{'pico frio':>12}{'pico quente':>13}")
+    resultados = {}
+    for nome, (tool, kwargs) in casos.items():
+        r = medir_caso(tool, kwargs, args.repeticoes)
+        resultados[nome] = r
+        print(f"{nome:<26}{r['frio_s']:>10.4f}{r['quente_mediana_s']:>10.4f}{r['pico_frio_mb']:>10.1f}MB{r['pico_quente_mb']:>11.1f}MB")
+
+    saida = {"gerado_em": datetime.datetime.now().isoformat(timespec="seconds"), "db": args.db,
+             "ano": args.ano, "filtro_empresa": args.filtro_empresa, "repeticoes": args.repeticoes,
+             "backend": os.getenv("RAYBOT_BACKEND", "auto"), "linhas": contar_linhas(engine),
+             "python": platform.python_version(), "pandas": pd.__version__,
+             "total_quente_s": round(sum(r["quente_mediana_s"] for r in resultados.values()), 4),
+             "resultados": resultados}
+    print(f"\nTotal quente: {saida['total_quente_s']:.3f}s")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+
+if __name__ == "__main__":
+    main()
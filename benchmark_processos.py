@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import tools
+import backends
+import logs
+from tools import Fore, Style
+from conexao import criar_engine
+from kpi_plano import DEFINICOES_KPI, montar_plano, executar_plano
+
+# ====================================================
+# Vazão do plano de KPIs: backend pandas (1 núcleo, threads disputam o GIL) x backend processos
+# ====================================================
+# Várias consultas da frota inteira (painel, matriz do INDOA por empresa e mês, total por empresa)
+# rodam ao mesmo tempo em --concorrencia threads, como perguntas simultâneas no servidor. Para cada
+# quantidade de processos mede consultas/s e a latência mediana; a 1ª rodada de cada configuração
+# (subida dos processos e carga dos fragmentos) fica fora da medida.
+#
+# Uso: python benchmark_processos.py [--db db_sintetico] [--ano 2024] [--processos 1,2,4] [--consultas 24]
+#                                    [--concorrencia 8] [--saida r.json] [--comparar anterior.json]
+
+def montar_casos(ano, empresa="Leblon"):
+    ano_todo = {"data_inicial": f"{ano}-01-01", "data_final": f"{ano}-12-31"}
+    return {
+        "painel_frota": (list(DEFINICOES_KPI), {"data_inicial": f"{ano}-03-01", "data_final": f"{ano}-03-31"}),
+        "indoa_matriz": (list(tools.INDICADORES_INDOA), {**ano_todo, "agrupar_por": ("empresa", "mes")}),
+        "por_empresa": (list(DEFINICOES_KPI), {**ano_todo, "agrupar_por": ("empresa",)}),
+        "uma_empresa": (list(DEFINICOES_KPI), {**ano_todo, "filtro_coluna": "empresa", "filtro_valor": empresa}),
+    }
+
+def medir(backend, casos, consultas, concorrencia):
+    planos = [(montar_plano(indicadores), kwargs) for indicadores, kwargs in casos.values()]
+    for plano, kwargs in planos:
+        executar_plano(plano, backend=backend, **kwargs)  # aquecimento
+
+    def uma(i):
+        plano, kwargs = planos[i % len(planos)]
+        inicio = time.perf_counter()
+        executar_plano(plano, backend=backend, **kwargs)
+        return time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(concorrencia) as executor:
+        latencias = list(executor.map(uma, range(consultas)))
+    total = time.perf_counter() - inicio
+    return {"consultas_s": round(consultas / total, 3), "latencia_mediana_s": round(statistics.median(latencias), 4),
+            "total_s": round(total, 3)}
+
+def comparar(atual, anterior):
+    print(f"\n📊 Comparação com {anterior['gerado_em']} ({anterior['db']}, {anterior['cpus']} CPUs)")
+    print(f"{'configuração':<16}{'antes (c/s)':>13}{'agora (c/s)':>13}")
+    for nome, r in atual["resultados"].items():
+        a = anterior["resultados"].get(nome)
+        if not a:
+            continue
+        cor = Fore.RED if r["consultas_s"] < a["consultas_s"] * 0.8 else ""
+        print(f"{nome:<16}{a['consultas_s']:>13.2f}{cor}{r['consultas_s']:>13.2f}{Style.RESET_ALL}")
+
+def principal(args):
+    logs.configurar(nivel="WARNING")
+    tools.set_db_engine(criar_engine(args.db))
+    tools.aquecer_cache()
+    casos = montar_casos(args.ano, args.empresa)
+
+    print(f"\n⏱️ Vazão do plano de KPIs ({args.db}, {os.cpu_count()} CPUs, {args.consultas} consultas, "
+          f"{args.concorrencia} em paralelo)")
+    print(f"{'configuração':<16}{'consultas/s':>13}{'ganho':>8}{'mediana (s)':>13}")
+    resultados = {"pandas": medir(backends.obter_backend("pandas"), casos, args.consultas, args.concorrencia)}
+    for n in [int(x) for x in args.processos.split(",")]:
+        backend = backends.BackendProcessos(processos=n)
+        try:
+            resultados[f"processos:{n}"] = medir(backend, casos, args.consultas, args.concorrencia)
+        finally:
+            backend.encerrar()
+    base = resultados["pandas"]["consultas_s"]
+    for nome, r in resultados.items():
+        print(f"{nome:<16}{r['consultas_s']:>13.2f}{r['consultas_s'] / base:>7.2f}x{r['latencia_mediana_s']:>13.3f}")
+
+    saida = {"gerado_em": datetime.datetime.now().isoformat(timespec="seconds"), "db": args.db, "ano": args.ano,
+             "cpus": os.cpu_count(), "consultas": args.consultas, "concorrencia": args.concorrencia,
+             "python": platform.python_version(), "resultados": resultados}
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            comparar(saida, json.load(f))
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do plano de KPIs: pandas x processos fragmentados por empresa/ano.")
+    parser.add_argument("--db", default="db_sintetico")
+    parser.add_argument("--ano", type=int, default=2024)
+    parser.add_argument("--empresa", default="Leblon")
+    parser.add_argument("--processos", default=",".join(str(n) for n in sorted({1, 2, os.cpu_count() or 1})),
+                        help="Quantidades de processos a medir (separadas por vírgula)")
+    parser.add_argument("--consultas", type=int, default=24)
+    parser.add_argument("--concorrencia", type=int, default=8, help="Consultas simultâneas (threads)")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar os resultados")
+    parser.add_argument("--comparar", default=None, help="JSON de uma execução anterior para comparar")
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"Banco '{args.db}' não encontrado (crie um sintético com: python gerar_db.py).")
+        sys.exit(1)
+    principal(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import sys
+import time
+import json
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+from conexao import criar_engine
+
+# ====================================================
+# Benchmark: engine padrão vs engine ajustada (conexao.criar_engine)
+# ====================================================
+# Uso: python benchmark_sqlite.py [--db db_raybot] [--repeticoes 5] [--leitores 8] [--saida resultado.json]
+
+TABELAS = ["CTM", "MANT001", "MANT002", "MANT004", "IND003", "INDMANTMANUAL"]
+
+def _nome_real(engine, parcial):
+    with engine.connect() as conn:
+        nomes = [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table'"))]
+    return next((n for n in nomes if parcial.lower() in n.lower()), None)
+
+def _cronometrar(func, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        func()
+        tempos.append(time.perf_counter() - inicio)
+    return {"mediana_s": statistics.median(tempos), "min_s": min(tempos)}
+
+def _consultas_agregadas(engine, tabelas):
+    """Agregações típicas do agente: contagem por mês e por ônibus."""
+    consultas = []
+    for tabela in tabelas:
+        consultas.append(f'SELECT count(*) FROM "{tabela}"')
+        with engine.connect() as conn:
+            colunas = [r[1] for r in conn.execute(text(f'PRAGMA table_info("{tabela}")'))]
+        onibus = next((c for c in colunas if "nibus" in c.lower()), None)
+        if onibus:
+            consultas.append(f'SELECT "{onibus}", count(*) FROM "{tabela}" GROUP BY 1 ORDER BY 2 DESC LIMIT 10')
+    return consultas
+
+def medir(engine, tabelas, repeticoes, leitores):
+    resultado = {}
+
+    def carregar_tudo():
+        for tabela in tabelas:
+            with engine.connect() as conn:
+                pd.read_sql_query(text(f'SELECT * FROM "{tabela}"'), conn)
+    resultado["select_todas_tabelas"] = _cronometrar(carregar_tudo, repeticoes)
+
+    consultas = _consultas_agregadas(engine, tabelas)
+    def agregar():
+        with engine.connect() as conn:
+            for sql in consultas:
+                conn.execute(text(sql)).fetchall()
+    resultado["consultas_agregadas"] = _cronometrar(agregar, repeticoes)
+
+    def concorrente():
+        with ThreadPoolExecutor(max_workers=leitores) as pool:
+            list(pool.map(lambda _: agregar(), range(leitores)))
+    resultado[f"agregadas_{leitores}_leitores"] = _cronometrar(concorrente, repeticoes)
+    return resultado
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara a engine SQLite padrão com a engine ajustada.")
+    parser.add_argument("--db", default="db_raybot")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--leitores", type=int, default=8)
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar os resultados")
+    args = parser.parse_args()
+
+    engines = {
+        "padrao": create_engine(f"sqlite:///{args.db}"),
+        "ajustada": criar_engine(args.db),
+    }
+    tabelas = [t for t in (_nome_real(engines["padrao"], p) for p in TABELAS) if t]
+    if not tabelas:
+        print(f"Nenhuma tabela conhecida encontrada em '{args.db}'.")
+        sys.exit(1)
+
+    resultados = {nome: medir(engine, tabelas, args.repeticoes, args.leitores) for nome, engine in engines.items()}
+
+    print(f"\n📊 Benchmark SQLite ({args.db}, {args.repeticoes} repetições, mediana em segundos)")
+    print(f"{'etapa':<28}{'padrão':>12}{'ajustada':>12}{'ganho':>9}")
+    for etapa in resultados["padrao"]:
+        a = resultados["padrao"][etapa]["mediana_s"]
+        b = resultados["ajustada"][etapa]["mediana_s"]
+        print(f"{etapa:<28}{a:>12.4f}{b:>12.4f}{a / b if b else 0:>8.2f}x")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"db": args.db, "tabelas": tabelas, "resultados": resultados}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import json
+import sqlite3
+import hashlib
+import argparse
+import threading
+from sqlalchemy import text
+
+import tools as kpi_tools
+from tools import Fore, Style, normalizar_texto
+
+# ====================================================
+# CACHE DE RESPOSTAS (perguntas repetidas no mesmo dia, sobre os mesmos dados)
+# ====================================================
+# Chave = pergunta normalizada (acentos, caixa, espaços) + data de hoje do prompt + versão dos dados.
+# Fica num SQLite local próprio, então sobrevive a reinícios do processo.
+#
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_CACHE_RESPOSTAS (1)                           liga/desliga
+#   RAYBOT_CACHE_RESPOSTAS_ARQUIVO (cache_respostas.db)  arquivo do cache
+#   RAYBOT_CACHE_RESPOSTAS_TTL (21600)                   segundos de validade de cada resposta
+#   RAYBOT_CACHE_RESPOSTAS_MAX (2000)                    respostas guardadas; acima disso saem as usadas há mais tempo
+#
+# Uso: python cache_respostas.py [--limpar]
+
+ATIVO = os.getenv("RAYBOT_CACHE_RESPOSTAS", "1").strip().lower() in ("1", "true", "sim", "yes")
+ARQUIVO = os.getenv("RAYBOT_CACHE_RESPOSTAS_ARQUIVO", "cache_respostas.db")
+TTL_SEGUNDOS = float(os.getenv("RAYBOT_CACHE_RESPOSTAS_TTL", "21600"))
+MAX_ENTRADAS = int(os.getenv("RAYBOT_CACHE_RESPOSTAS_MAX", "2000"))
+
+def normalizar_pergunta(pergunta):
+    """'  ICMQ de Março da LEBLON? ' -> 'icmq de marco da leblon'"""
+    texto = re.sub(r"\s+", " ", normalizar_texto(pergunta)).strip()
+    return texto.rstrip("?!. ").strip()
+
+def versao_dados(engine=None):
+    """
+    Assinatura dos dados do banco: tamanho e mtime do arquivo e do -wal (qualquer escrita do ETL,
+    inclusive UPDATE in place, muda um dos dois). O -wal vazio só entra se tiver frames: abrir o banco
+    com escrita (ver conexao._ativar_wal) o trunca e mexe no mtime sem mudar dado nenhum.
+    Banco sem arquivo: marca d'água de cada tabela.
+    """
+    engine = engine or kpi_tools.GLOBAL_ENGINE
+    with engine.connect() as conn:
+        arquivo = next((r[2] for r in conn.execute(text("PRAGMA database_list")) if r[1] == "main"), "")
+        if arquivo:
+            partes = []
+            for caminho in (arquivo, arquivo + "-wal"):
+                st = os.stat(caminho) if os.path.exists(caminho) else None
+                if st and st.st_size:
+                    partes.append(f"{caminho}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            tabelas = [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' ORDER BY name"))]
+            partes = [f"{t}:{kpi_tools._marca_dagua(conn, t)}" for t in tabelas]
+    return hashlib.sha1("|".join(partes).encode("utf-8")).hexdigest()[:16]
+
+class CacheRespostas:
+    def __init__(self, arquivo=None, ttl_segundos=None, max_entradas=None):
+        self.arquivo = arquivo or ARQUIVO
+        self.ttl_segundos = TTL_SEGUNDOS if ttl_segundos is None else ttl_segundos
+        self.max_entradas = max_entradas or MAX_ENTRADAS
+        self._lock = threading.Lock()
+        self.contadores = {"acertos": 0, "faltas": 0, "gravacoes": 0, "expiradas": 0, "descartadas": 0}
+        self._conn = sqlite3.connect(self.arquivo, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS respostas (
+            chave TEXT PRIMARY KEY, pergunta TEXT, hoje TEXT, versao TEXT, resposta TEXT, rota TEXT,
+            criado_em REAL, usado_em REAL, acertos INTEGER DEFAULT 0)""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_respostas_usado_em ON respostas (usado_em)")
+        self._conn.commit()
+
+    @staticmethod
+    def chave(pergunta, hoje, versao):
+        return hashlib.sha256(f"{normalizar_pergunta(pergunta)}|{hoje}|{versao}".encode("utf-8")).hexdigest()
+
+    def buscar(self, pergunta, hoje, versao):
+        """Resposta guardada ({'resposta', 'rota'}) ou None se não existe / expirou."""
+        chave, agora = self.chave(pergunta, hoje, versao), time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT resposta, rota, criado_em FROM respostas WHERE chave = ?", (chave,)).fetchone()
+            if row and agora - row[2] > self.ttl_segundos:
+                self._conn.execute("DELETE FROM respostas WHERE chave = ?", (chave,))
+                self._conn.commit()
+                self.contadores["expiradas"] += 1
+                row = None
+            if row is None:
+                self.contadores["faltas"] += 1
+                return None
+            self._conn.execute("UPDATE respostas SET usado_em = ?, acertos = acertos + 1 WHERE chave = ?", (agora, chave))
+            self._conn.commit()
+            self.contadores["acertos"] += 1
+        return {"resposta": row[0], "rota": row[1]}
+
+    def gravar(self, pergunta, hoje, versao, resposta, rota):
+        agora = time.time()
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO respostas (chave, pergunta, hoje, versao, resposta, rota, criado_em, usado_em) "
+                               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                               (self.chave(pergunta, hoje, versao), pergunta, hoje, versao, resposta, rota, agora, agora))
+            self.contadores["gravacoes"] += 1
+            # Limites: expiradas saem primeiro, depois as usadas há mais tempo
+            self._conn.execute("DELETE FROM respostas WHERE criado_em < ?", (agora - self.ttl_segundos,))
+            excesso = self._conn.execute("SELECT count(*) FROM respostas").fetchone()[0] - self.max_entradas
+            if excesso > 0:
+                self._conn.execute("DELETE FROM respostas WHERE chave IN (SELECT chave FROM respostas ORDER BY usado_em LIMIT ?)", (excesso,))
+                self.contadores["descartadas"] += excesso
+            self._conn.commit()
+
+    def limpar(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM respostas")
+            self._conn.commit()
+
+    def estatisticas(self):
+        with self._lock:
+            entradas = self._conn.execute("SELECT count(*) FROM respostas").fetchone()[0]
+            consultas = self.contadores["acertos"] + self.contadores["faltas"]
+            return {**self.contadores, "entradas": entradas,
+                    "taxa_acerto": round(self.contadores["acertos"] / consultas, 3) if consultas else None}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Estatísticas / limpeza do cache de respostas.")
+    parser.add_argument("--arquivo", default=None)
+    parser.add_argument("--limpar", action="store_true", help="Apaga todas as respostas guardadas")
+    args = parser.parse_args()
+    cache = CacheRespostas(args.arquivo)
+    if args.limpar:
+        cache.limpar()
+        print(f"{Fore.GREEN}🧹 Cache de respostas limpo.{Style.RESET_ALL}")
+    mais_usadas = cache._conn.execute("SELECT pergunta, hoje, acertos FROM respostas ORDER BY acertos DESC LIMIT 10").fetchall()
+    print(json.dumps({"entradas": cache.estatisticas()["entradas"], "mais_usadas": mais_usadas}, ensure_ascii=False, indent=2))
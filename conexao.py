@@ -0,0 +1,73 @@
+import os
+import sqlite3
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import QueuePool
+
+from logs import LOG, campos
+
+# ====================================================
+# Engine SQLite ajustada para leitura concorrente
+# ====================================================
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_DB_CAMINHO (db_raybot)       arquivo do banco
+#   RAYBOT_DB_SOMENTE_LEITURA (1)       abre com URI mode=ro (agente e KPIs nunca escrevem)
+#   RAYBOT_DB_WAL (1)                   journal_mode=WAL: leitores não bloqueiam a carga do ETL
+#   RAYBOT_DB_MMAP_MB (256)             PRAGMA mmap_size
+#   RAYBOT_DB_CACHE_MB (16)             PRAGMA cache_size por conexão
+#   RAYBOT_DB_POOL (5)                  conexões mantidas no pool (+ RAYBOT_DB_POOL_EXTRA)
+
+def _env_bool(nome, padrao):
+    return os.getenv(nome, "1" if padrao else "0").strip().lower() in ("1", "true", "sim", "yes")
+
+def _ativar_wal(caminho):
+    """journal_mode=WAL é persistente no arquivo, mas exige uma conexão com escrita para ligar."""
+    try:
+        conn = sqlite3.connect(caminho)
+        modo = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        conn.close()
+        return modo.lower() == "wal"
+    except Exception as e:
+        LOG.warning("não foi possível ativar WAL: %s", e, extra=campos(caminho=caminho))
+        return False
+
+def criar_engine(caminho=None, somente_leitura=None, wal=None, mmap_mb=None, cache_mb=None, pool_size=None, max_overflow=None):
+    """
+    Cria a engine SQLAlchemy compartilhada pelas tools de SQL do agente e pelo tools.py,
+    com pragmas de leitura (mmap, cache) aplicados a cada conexão nova do pool.
+    Parâmetros não informados vêm das variáveis RAYBOT_DB_*.
+    """
+    caminho = caminho or os.getenv("RAYBOT_DB_CAMINHO", "db_raybot")
+    somente_leitura = _env_bool("RAYBOT_DB_SOMENTE_LEITURA", True) if somente_leitura is None else somente_leitura
+    wal = _env_bool("RAYBOT_DB_WAL", True) if wal is None else wal
+    mmap_mb = int(os.getenv("RAYBOT_DB_MMAP_MB", "256")) if mmap_mb is None else mmap_mb
+    cache_mb = int(os.getenv("RAYBOT_DB_CACHE_MB", "16")) if cache_mb is None else cache_mb
+    pool_size = int(os.getenv("RAYBOT_DB_POOL", "5")) if pool_size is None else pool_size
+    max_overflow = int(os.getenv("RAYBOT_DB_POOL_EXTRA", "5")) if max_overflow is None else max_overflow
+
+    if wal and os.path.exists(caminho):
+        _ativar_wal(caminho)
+
+    if somente_leitura:
+        url = f"sqlite:///file:{os.path.abspath(caminho)}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{caminho}"
+
+    engine = create_engine(
+        url,
+        poolclass=QueuePool,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_pre_ping=False,
+        connect_args={"check_same_thread": False},
+    )
+
+    @event.listens_for(engine, "connect")
+    def _pragmas(dbapi_conn, _):
+        cursor = dbapi_conn.cursor()
+        cursor.execute(f"PRAGMA mmap_size={mmap_mb * 1024 * 1024}")
+        cursor.execute(f"PRAGMA cache_size={-cache_mb * 1024}")
+        if somente_leitura:
+            cursor.execute("PRAGMA query_only=1")
+        cursor.close()
+
+    return engine
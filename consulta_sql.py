@@ -0,0 +1,146 @@
+import os
+import json
+import time
+import sqlite3
+import datetime
+import logging
+import threading
+from langchain.tools import tool
+from pydantic import BaseModel, Field
+
+import tools
+from rastreamento import rastrear, anotar
+from logs import LOG, campos
+
+# ====================================================
+# sql_db_query protegido (substitui a tool do SQLDatabaseToolkit)
+# ====================================================
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_SQL_MAX_LINHAS (50)         linhas devolvidas ao modelo; o resto nem é lido do banco
+#   RAYBOT_SQL_TEMPO_MAX (10)          segundos por consulta; o progress handler do SQLite interrompe
+#   RAYBOT_SQL_MAX_CARACTERES (200)    tamanho máximo de cada valor exibido
+#   RAYBOT_SQL_LOG (sql_consultas.jsonl)  log com sql, plano, duração e linhas (vazio desliga)
+
+MAX_LINHAS = int(os.getenv("RAYBOT_SQL_MAX_LINHAS", "50"))
+TEMPO_MAX_SEGUNDOS = float(os.getenv("RAYBOT_SQL_TEMPO_MAX", "10"))
+MAX_CARACTERES_VALOR = int(os.getenv("RAYBOT_SQL_MAX_CARACTERES", "200"))
+ARQUIVO_LOG = os.getenv("RAYBOT_SQL_LOG", "sql_consultas.jsonl")
+
+# Instruções SQLite entre checagens do relógio no progress handler
+PASSOS_VERIFICACAO = 10000
+
+_LOG_LOCK = threading.Lock()
+
+class InputConsultaSQL(BaseModel):
+    query: str = Field(..., description="A detailed and correct SQL query.")
+
+def _registrar_log(registro):
+    if not ARQUIVO_LOG:
+        return
+    try:
+        with _LOG_LOCK, open(ARQUIVO_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+    except Exception as e:
+        LOG.warning("não foi possível gravar o log de SQL: %s", e, extra=campos(arquivo=ARQUIVO_LOG))
+
+def _valor_curto(valor):
+    if isinstance(valor, str) and len(valor) > MAX_CARACTERES_VALOR:
+        return valor[:MAX_CARACTERES_VALOR] + "…"
+    return valor
+
+@rastrear("sql.consulta")
+def executar_consulta_protegida(sql, max_linhas=None, tempo_max=None, engine=None):
+    """
+    Executa a consulta com limite de linhas e de tempo, lendo o cursor em lotes (fetchmany)
+    e parando em max_linhas + 1. Retorna dict com colunas, linhas, truncado, duracao_s, plano e erro.
+    """
+    max_linhas = MAX_LINHAS if max_linhas is None else max_linhas
+    tempo_max = TEMPO_MAX_SEGUNDOS if tempo_max is None else tempo_max
+    engine = engine or tools.GLOBAL_ENGINE
+    resultado = {"sql": sql, "colunas": [], "linhas": [], "truncado": False, "plano": [], "erro": None}
+
+    inicio = time.perf_counter()
+    limite = time.monotonic() + tempo_max
+    estourou = False
+
+    def _progresso():
+        nonlocal estourou
+        if time.monotonic() > limite:
+            estourou = True
+            return 1  # != 0 interrompe a instrução em andamento
+        return 0
+
+    with engine.connect() as conn:
+        raw = conn.connection.dbapi_connection
+        raw.set_progress_handler(_progresso, PASSOS_VERIFICACAO)
+        cursor = raw.cursor()
+        try:
+            try:
+                resultado["plano"] = [r[3] for r in cursor.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+            except sqlite3.Error:
+                pass  # o erro real (sintaxe, coluna) aparece na execução abaixo
+
+            cursor.execute(sql)
+            resultado["colunas"] = [d[0] for d in cursor.description or []]
+            while len(resultado["linhas"]) <= max_linhas:
+                lote = cursor.fetchmany(min(500, max_linhas + 1 - len(resultado["linhas"])))
+                if not lote:
+                    break
+                resultado["linhas"].extend(lote)
+            if len(resultado["linhas"]) > max_linhas:
+                resultado["linhas"] = resultado["linhas"][:max_linhas]
+                resultado["truncado"] = True
+        except sqlite3.Error as e:
+            if estourou:
+                resultado["erro"] = (f"consulta interrompida após {tempo_max:g}s. Restrinja o período com WHERE "
+                                     f"na coluna de data, agregue (COUNT/SUM/GROUP BY) ou use LIMIT.")
+            else:
+                resultado["erro"] = str(e)
+        finally:
+            cursor.close()
+            raw.set_progress_handler(None, 0)
+
+    resultado["duracao_s"] = round(time.perf_counter() - inicio, 4)
+    anotar(linhas_saida=len(resultado["linhas"]), truncado=resultado["truncado"], interrompida=estourou)
+    return resultado
+
+def formatar_resultado(resultado):
+    """Texto para o modelo: cabeçalho, linhas (valores longos cortados) e resumo quando truncado."""
+    if resultado["erro"]:
+        return f"Error: {resultado['erro']}"
+    if not resultado["colunas"]:
+        return ""
+    linhas = [tuple(_valor_curto(v) for v in linha) for linha in resultado["linhas"]]
+    texto = f"Colunas: {tuple(resultado['colunas'])}\n{linhas}"
+    if resultado["truncado"]:
+        texto += (f"\n⚠️ Resultado truncado: exibindo as primeiras {len(linhas)} linhas (há mais). "
+                  f"Para totais use COUNT/SUM/GROUP BY em vez de listar linhas.")
+    return texto
+
+@tool("sql_db_query", args_schema=InputConsultaSQL)
+def sql_db_query(query: str) -> str:
+    """
+    Execute a SQL query against the database and get back the result.
+    Results are limited to a maximum number of rows and a time budget; prefer aggregations (COUNT, SUM, GROUP BY) and WHERE on date columns.
+    If the query is not correct, an error message will be returned.
+    If an error is returned, rewrite the query, check the query, and try again.
+    """
+    LOG.info("🛠️ tool chamada", extra=campos(tool="SQL", sql=" ".join(query.split())[:200]))
+    resultado = executar_consulta_protegida(query)
+
+    varreduras = [p for p in resultado["plano"] if p.startswith("SCAN") and "USING" not in p]
+    nivel = logging.ERROR if resultado["erro"] else (logging.WARNING if resultado["truncado"] or varreduras else logging.INFO)
+    LOG.log(nivel, "consulta SQL executada", extra=campos(duracao_s=resultado["duracao_s"], linhas=len(resultado["linhas"]),
+                                                           truncado=resultado["truncado"] or None,
+                                                           varreduras="; ".join(varreduras) or None, erro=resultado["erro"]))
+
+    _registrar_log({
+        "quando": datetime.datetime.now().isoformat(timespec="seconds"),
+        "sql": query,
+        "plano": resultado["plano"],
+        "duracao_s": resultado["duracao_s"],
+        "linhas": len(resultado["linhas"]),
+        "truncado": resultado["truncado"],
+        "erro": resultado["erro"],
+    })
+    return formatar_resultado(resultado)
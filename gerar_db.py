@@ -0,0 +1,225 @@
+import os
+import sys
+import time
+import random
+import sqlite3
+import argparse
+import datetime
+
+from tools import Fore, Style
+
+# ====================================================
+# GERADOR DE db_raybot SINTÉTICO (para benchmark e testes sem dados de produção)
+# ====================================================
+# Mesmas tabelas e colunas do dicionário do prompt.py (CTM, MANT001, MANT002, MANT004, IND003)
+# mais INDMANTMANUAL e METAS_INDICADORES no formato lido pelo tools.py. Datas em formatos mistos
+# (aaaa-mm-dd 00:00:00, dd/mm/aaaa, aaaa-mm-dd e, em poucas linhas, d/m/aaaa, aaaa/mm/dd e dd-mm-aaaa),
+# nomes com acento e distribuições de tipo/situação próximas das reais. As linhas são gravadas em lotes: a memória não cresce com a escala.
+#
+# Uso: python gerar_db.py db_sintetico --linhas 1000000 [--inicio 2023-01-01 --dias 730 --semente 42 --indices]
+
+EMPRESAS = [("1", "Leblon"), ("2", "Nobel"), ("3", "São Bento")]
+
+# Fração do total de linhas de cada tabela (IND003 e MANT004 são diárias por ônibus, por isso maiores)
+PROPORCOES = {"CTM": 0.20, "IND003": 0.25, "MANT004": 0.25, "MANT001": 0.10, "MANT002": 0.15, "INDMANTMANUAL": 0.05}
+
+# (valor, peso)
+TIPOS_MANUTENCAO = [("Corretiva", 55), ("Preventiva", 30), ("Inspeção", 15)]
+SITUACOES = [("Liquidado", 70), ("Em Execução", 10), ("Aguardando Liberação", 8), ("Parado", 5), ("Cancelado", 7)]
+DETALHES_SERVICO = [("na Garagem troca de {peca}", 45), ("no Terminal troca de {peca}", 25),
+                    ("no Trajeto - {peca}", 20), ("Quebra de {peca}", 10)]
+PECAS = ["Lona de Freio", "Pneu", "Lâmpada", "Correia", "Bateria", "Óleo do Motor", "Embreagem", "Suspensão", "Retrovisor"]
+CATEGORIAS = [("Mecânica", 45), ("Elétrica", 20), ("Borracharia", 20), ("Funilaria", 10), ("Limpeza", 5)]
+CLASSES = ["Freio", "Motor", "Câmbio", "Ar-condicionado", "Porta", "Iluminação", "Pneu furado"]
+TURNOS = [("Manhã", 45), ("Tarde", 35), ("Noite", 20)]
+SIGLAS_MANUAIS = [("CDTDML", 12), ("CAIEFO", 12), ("CAIEMF", 10), ("QVA", 14), ("QVV", 14),
+                  ("TIC", 12), ("TIA", 12), ("TO", 8), ("TOPP", 6)]
+# Formatos de data misturados na mesma coluna, como chegam do ETL
+# (strftime ou função; 'd/m/aaaa' sem zeros à esquerda não tem diretiva portável)
+FORMATOS_DATA = [("%Y-%m-%d 00:00:00", 70), ("%d/%m/%Y", 20), ("%Y-%m-%d", 10),
+                 (lambda d: f"{d.day}/{d.month}/{d.year}", 2), ("%Y/%m/%d", 2), ("%d-%m-%Y", 2)]
+LINHAS = [("101", "Centro - Rodoviária"), ("202", "Leblon - São Conrado"), ("303", "Jardim Botânico"), ("404", "Penha - Olaria")]
+PESSOAS = ["José Araújo", "Maria Conceição", "João Gonçalves", "Ana Lúcia", "Antônio Brandão"]
+
+ESQUEMAS = {
+    "CTM": ["CodigoEmpresa", "CodigoContabil", "Descricao", "DtGasto", "CodigoReduzido", "Historico", "Credito",
+            "ValorGasto", "NomeEmpresa", "String Após Execução", "oidcontacontabilmov", "Ônibus", "OIDBem",
+            "OIDDocumento", "TipoDocumento", "NomePessoaResposável"],
+    # DetalhesServiço antes de TipoDocumento: as tools pegam a primeira coluna com "detalhesservico" ou "tipo"
+    "MANT001": ["Dtemissao", "DetalhesServiço", "OIDDocumento", "CodigoEmpresa", "DtSituacao", "DtOcorrencia",
+                "HrOcorrencia", "Numero", "Turno", "TipoDocumento", "SituaçãoDocumento", "Nome Empresa", "Ônibus", "Motorista"],
+    "MANT002": ["Dtemissao", "Numero", "CodigoEmpresa", "TipoManutenção", "OIDDocumento", "DtSituacao", "DtManutencao",
+                "Turno", "TipoDocumento", "NomePessoaResposável", "SituaçãoDocumento", "TempoGasto", "Ônibus",
+                "NomeEmpresa", "Classe", "Categoria"],
+    # Data da saída em DataSaida (nome usado por MAPA_DATAS no tools.py)
+    "MANT004": ["CodigoEmpresa", "DataSaida", "OIDFcvProgramada", "OIDDocumento", "Numero", "HrSaida",
+                "SituaçãoDocumento", "Turno", "NomeEmpresa", "Ônibus"],
+    "IND003": ["DtOperacao", "CodigoEmpresa", "Estabelecimento", "KmRodado", "Ônibus", "LinhaCodigo", "OIDBem",
+               "DtFabricacao", "LinhaDescricao", "AnoFabricação", "NomeEmpresa"],
+    "INDMANTMANUAL": ["DtMovimento", "Simbolo", "Descricao", "Valor", "CodigoEmpresa", "NomeEmpresa"],
+}
+
+COLUNAS_METAS = ["data", "empresa", "ICMQ", "IDF", "IMP", "OEMCP", "OEMPP", "KMFALHAS", "QETG", "QETT",
+                 "CDTDM", "IAVLIT", "PCV", "IOALO"]
+
+def _sorteador(rng, opcoes):
+    """Função que sorteia k valores de [(valor, peso)] de uma vez (rng.choices é bem mais rápido em lote)."""
+    valores, pesos = zip(*opcoes)
+    return lambda k: rng.choices(valores, weights=pesos, k=k)
+
+class Gerador:
+    def __init__(self, linhas=100_000, inicio="2023-01-01", dias=730, onibus_por_empresa=40, semente=42, lote=50_000):
+        self.linhas = linhas
+        self.inicio = datetime.date.fromisoformat(inicio)
+        self.dias = dias
+        self.lote = lote
+        self.rng = random.Random(semente)
+        # Frota: (código empresa, nome empresa, prefixo do ônibus, OIDBem, ano de fabricação)
+        self.frota = [(cod, nome, f"B {1000 + i * onibus_por_empresa + j}", f"{90000 + i * onibus_por_empresa + j}",
+                       self.rng.randint(2012, 2022))
+                      for i, (cod, nome) in enumerate(EMPRESAS) for j in range(onibus_por_empresa)]
+        self.formato_data = _sorteador(self.rng, FORMATOS_DATA)
+        self.tipo = _sorteador(self.rng, TIPOS_MANUTENCAO)
+        self.situacao = _sorteador(self.rng, SITUACOES)
+        self.detalhe = _sorteador(self.rng, DETALHES_SERVICO)
+        self.categoria = _sorteador(self.rng, CATEGORIAS)
+        self.turno = _sorteador(self.rng, TURNOS)
+        self.sigla = _sorteador(self.rng, SIGLAS_MANUAIS)
+
+    def _datas(self, k):
+        """k datas como texto, cada uma num dos formatos misturados."""
+        formatos = self.formato_data(k)
+        datas = [self.inicio + datetime.timedelta(days=self.rng.randrange(self.dias)) for _ in formatos]
+        return [f(d) if callable(f) else d.strftime(f) for d, f in zip(datas, formatos)]
+
+    def _onibus(self, k):
+        return self.rng.choices(self.frota, k=k)
+
+    def _hora(self):
+        return f"{self.rng.randrange(24):02d}:{self.rng.randrange(60):02d}:00"
+
+    def _linhas_ctm(self, n, base):
+        datas, frota = self._datas(n), self._onibus(n)
+        for i in range(n):
+            cod, emp, bus, oid_bem, _ = frota[i]
+            peca = self.rng.choice(PECAS)
+            # ~3% sem ônibus (gasto administrativo), como na base real
+            bus_txt = "" if self.rng.random() < 0.03 else bus
+            valor = round(self.rng.lognormvariate(4.5, 1.0), 2)
+            credito = round(valor * self.rng.random(), 2) if self.rng.random() < 0.05 else 0.0
+            execucao = str(500000 + base + i)
+            yield (cod, f"3.1.{self.rng.randint(1, 9)}.{self.rng.randint(10, 99)}", peca, datas[i], str(self.rng.randint(100, 999)),
+                   f"Requisição de Itens {base + i} {peca} Ordem Execução {execucao}", credito, valor, emp, execucao,
+                   str(700000 + base + i), bus_txt, oid_bem, str(base + i), "Requisição", self.rng.choice(PESSOAS))
+
+    def _linhas_mant001(self, n, base):
+        datas, frota, detalhes, turnos = self._datas(n), self._onibus(n), self.detalhe(n), self.turno(n)
+        situacoes = self.situacao(n)
+        for i in range(n):
+            cod, emp, bus, oid_bem, _ = frota[i]
+            # Algumas ocorrências têm mais de uma linha (mesmo OIDDocumento)
+            doc = str((base + i) // 2 if self.rng.random() < 0.2 else 10_000_000 + base + i)
+            yield (datas[i], detalhes[i].format(peca=self.rng.choice(PECAS)), doc, cod, datas[i], datas[i], self._hora(),
+                   str(base + i), turnos[i], "Ocorrência", situacoes[i], emp, bus, self.rng.choice(PESSOAS))
+
+    def _linhas_mant002(self, n, base):
+        datas, frota, tipos, situacoes = self._datas(n), self._onibus(n), self.tipo(n), self.situacao(n)
+        categorias, turnos = self.categoria(n), self.turno(n)
+        for i in range(n):
+            cod, emp, bus, _, _ = frota[i]
+            # OS com várias linhas de serviço: OIDDocumento repetido em ~1/3 das linhas
+            doc = str(20_000_000 + (base + i) // 3 * 3 if self.rng.random() < 0.33 else 30_000_000 + base + i)
+            tempo = None if self.rng.random() < 0.1 else round(self.rng.expovariate(1 / 90), 1)
+            yield (datas[i], str(base + i), cod, tipos[i], doc, datas[i], datas[i], turnos[i], "Ordem de Serviço",
+                   self.rng.choice(PESSOAS), situacoes[i], tempo, bus, emp, self.rng.choice(CLASSES), categorias[i])
+
+    def _linhas_mant004(self, n, base):
+        datas, frota, turnos = self._datas(n), self._onibus(n), self.turno(n)
+        for i in range(n):
+            cod, emp, bus, _, _ = frota[i]
+            yield (cod, datas[i], str(base + i), str(40_000_000 + base + i), str(base + i), self._hora(),
+                   "Liquidado", turnos[i], emp, bus)
+
+    def _linhas_ind003(self, n, base):
+        datas, frota = self._datas(n), self._onibus(n)
+        for i in range(n):
+            cod, emp, bus, oid_bem, ano = frota[i]
+            linha_cod, linha_desc = LINHAS[int(bus[2:]) % len(LINHAS)]
+            km = round(max(self.rng.gauss(220, 60), 0), 1)
+            yield (datas[i], cod, f"0{cod}", km, bus, linha_cod, oid_bem, f"{ano}-01-15", linha_desc, str(ano), emp)
+
+    def _linhas_indmantmanual(self, n, base):
+        datas, siglas = self._datas(n), self.sigla(n)
+        for i in range(n):
+            cod, emp = EMPRESAS[self.rng.randrange(len(EMPRESAS))]
+            # 1/3 sem Símbolo: a sigla só aparece no começo da Descrição
+            yield (datas[i], "" if (base + i) % 3 == 0 else siglas[i], f"{siglas[i]} - item {self.rng.randint(1, 40)}",
+                   self.rng.randint(1, 20), cod, emp)
+
+    def _metas(self):
+        anos = range(self.inicio.year, (self.inicio + datetime.timedelta(days=self.dias)).year + 1)
+        for ano in anos:
+            for mes in range(1, 13):
+                for _, emp in EMPRESAS:
+                    yield (f"{ano}-{mes:02d}-01", emp, 1.2, 0.85, 0.4, 30, 30, 4000.5, 300.5, 300.5, 50, 0.9, 0.8, 0.75)
+
+    def gerar(self, caminho):
+        """Cria o banco do zero em `caminho` e devolve {tabela: linhas}."""
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        conn = sqlite3.connect(caminho)
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        contagem = {}
+        for tabela, colunas in ESQUEMAS.items():
+            conn.execute(f'CREATE TABLE "{tabela}" ({", ".join(f"{chr(34)}{c}{chr(34)}" for c in colunas)})')
+            total, feitas, inicio = max(int(self.linhas * PROPORCOES[tabela]), 1), 0, time.perf_counter()
+            produzir = getattr(self, f"_linhas_{tabela.lower()}")
+            sql = f'INSERT INTO "{tabela}" VALUES ({", ".join("?" * len(colunas))})'
+            while feitas < total:
+                n = min(self.lote, total - feitas)
+                conn.executemany(sql, produzir(n, feitas))
+                feitas += n
+            conn.commit()
+            contagem[tabela] = total
+            print(f"   {tabela}: {total:,} linhas em {time.perf_counter() - inicio:.1f}s")
+
+        conn.execute(f'CREATE TABLE METAS_INDICADORES ({", ".join(f"{chr(34)}{c}{chr(34)}" for c in COLUNAS_METAS)})')
+        metas = list(self._metas())
+        conn.executemany(f'INSERT INTO METAS_INDICADORES VALUES ({", ".join("?" * len(COLUNAS_METAS))})', metas)
+        conn.commit()
+        contagem["METAS_INDICADORES"] = len(metas)
+        conn.close()
+        return contagem
+
+def gerar_db(caminho, linhas=100_000, indices=False, **kwargs):
+    print(f"{Fore.CYAN}🏗️ Gerando '{caminho}' com ~{linhas:,} linhas...{Style.RESET_ALL}")
+    inicio = time.perf_counter()
+    contagem = Gerador(linhas, **kwargs).gerar(caminho)
+    if indices:
+        import indices as indices_kpi
+        from conexao import criar_engine
+        engine = criar_engine(caminho)
+        with engine.connect() as conn:
+            faltantes = indices_kpi.indices_faltantes(conn)
+        engine.dispose()
+        indices_kpi.criar_indices(caminho, faltantes)
+    print(f"{Fore.GREEN}✅ Banco sintético pronto em {time.perf_counter() - inicio:.1f}s "
+          f"({os.path.getsize(caminho) / 1024 / 1024:,.1f} MB).{Style.RESET_ALL}")
+    return contagem
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera um db_raybot sintético.")
+    parser.add_argument("caminho", nargs="?", default="db_sintetico")
+    parser.add_argument("--linhas", type=int, default=100_000, help="Total aproximado de linhas (10 mil a 10 milhões)")
+    parser.add_argument("--inicio", default="2023-01-01", help="Primeira data (AAAA-MM-DD)")
+    parser.add_argument("--dias", type=int, default=730, help="Quantidade de dias cobertos a partir do início")
+    parser.add_argument("--onibus-por-empresa", type=int, default=40)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--indices", action="store_true", help="Cria os índices recomendados (indices.py) ao final")
+    args = parser.parse_args()
+    if not 1_000 <= args.linhas <= 50_000_000:
+        print(f"{Fore.RED}--linhas fora do intervalo suportado.{Style.RESET_ALL}")
+        sys.exit(1)
+    gerar_db(args.caminho, args.linhas, args.indices, inicio=args.inicio, dias=args.dias,
+             onibus_por_empresa=args.onibus_por_empresa, semente=args.semente)
@@ -0,0 +1,221 @@
+import os
+import re
+import sys
+import json
+import argparse
+from sqlalchemy import text
+
+import tools
+from tools import Fore, Style, MAPA_DATAS, normalizar_texto
+from conexao import criar_engine
+from backends import expressao_data_sql, registrar_funcoes_sqlite, BackendSQLite, CASOS_CONFORMIDADE, _q
+
+# ====================================================
+# ASSISTENTE DE ÍNDICES
+# ====================================================
+# Uso:
+#   python indices.py [--db db_raybot] [--consultas log.jsonl|consultas.sql]   -> relatório (não altera o banco)
+#   python indices.py --criar                                                -> cria os índices que faltam + ANALYZE
+#
+# O relatório roda EXPLAIN QUERY PLAN nas consultas geradas pelo BackendSQLite
+# para os casos de conformidade e em consultas típicas do agente, marcando as
+# que varrem a tabela inteira (SCAN sem índice).
+
+# Colunas de dimensão usadas em filtros, GROUP BY e contagens distintas
+TERMOS_DIMENSAO = ["onibus", "codigoempresa", "oiddocumento"]
+
+# Consultas no estilo das geradas pelo agente (sql_db_query) para o relatório.
+# {data} é a coluna de data da tabela e {onibus} a coluna de ônibus.
+CONSULTAS_AGENTE_EXEMPLO = [
+    'SELECT count(*) FROM {tabela} WHERE {data} BETWEEN \'2024-01-01\' AND \'2024-01-31\'',
+    'SELECT {onibus}, count(*) FROM {tabela} WHERE {data} >= \'2024-01-01\' GROUP BY {onibus} ORDER BY 2 DESC LIMIT 10',
+    'SELECT * FROM {tabela} WHERE {onibus} = \'1010\' LIMIT 20',
+]
+
+def _tabelas(conn):
+    return [r[0] for r in conn.execute(text("SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%'"))]
+
+def _colunas(conn, tabela):
+    return [r[1] for r in conn.execute(text(f"PRAGMA table_info({_q(tabela)})"))]
+
+def _coluna_data(tabela, colunas):
+    for chave, coluna in MAPA_DATAS.items():
+        if chave.lower() in tabela.lower():
+            alvo = normalizar_texto(coluna)
+            return next((c for c in colunas if normalizar_texto(c) == alvo), None)
+    return None
+
+def _nome_indice(tabela, coluna, sufixo=""):
+    base = re.sub(r"[^0-9a-z]+", "_", normalizar_texto(f"{tabela}_{coluna}")).strip("_")
+    return f"ix_raybot_{base}{sufixo}"
+
+def indices_existentes(conn):
+    """{tabela: {nome_indice: sql}} dos índices já presentes no banco."""
+    existentes = {}
+    for nome, tabela, sql in conn.execute(text("SELECT name, tbl_name, sql FROM sqlite_master WHERE type='index'")):
+        existentes.setdefault(tabela, {})[nome] = sql or ""
+    return existentes
+
+def indices_recomendados(conn):
+    """
+    Lista (tabela, nome, ddl) com os índices recomendados para o schema atual:
+    coluna de data do MAPA_DATAS (índice simples e pela expressão normalizada usada
+    pelos backends SQL) e colunas de dimensão (Ônibus, CodigoEmpresa, OIDDocumento).
+    """
+    recomendados = []
+    for tabela in _tabelas(conn):
+        colunas = _colunas(conn, tabela)
+        col_data = _coluna_data(tabela, colunas)
+        if col_data:
+            recomendados.append((tabela, _nome_indice(tabela, col_data),
+                                 f"CREATE INDEX IF NOT EXISTS {_nome_indice(tabela, col_data)} ON {_q(tabela)}({_q(col_data)})"))
+            # Mesma expressão do WHERE do BackendSQLite/BackendStreaming: só assim o planner usa o índice
+            recomendados.append((tabela, _nome_indice(tabela, col_data, "_iso"),
+                                 f"CREATE INDEX IF NOT EXISTS {_nome_indice(tabela, col_data, '_iso')} "
+                                 f"ON {_q(tabela)}({expressao_data_sql(col_data)})"))
+        for termo in TERMOS_DIMENSAO:
+            coluna = next((c for c in colunas if normalizar_texto(c) == termo), None)
+            if coluna:
+                recomendados.append((tabela, _nome_indice(tabela, coluna),
+                                     f"CREATE INDEX IF NOT EXISTS {_nome_indice(tabela, coluna)} ON {_q(tabela)}({_q(coluna)})"))
+    return recomendados
+
+def indices_faltantes(conn):
+    existentes = indices_existentes(conn)
+    return [(t, n, ddl) for t, n, ddl in indices_recomendados(conn) if n not in existentes.get(t, {})]
+
+def _consultas_kpi(engine):
+    """Gera as consultas do BackendSQLite para os casos de conformidade (sem depender do cache em memória)."""
+    from kpi_plano import DEFINICOES_KPI, montar_plano, executar_plano
+
+    tools.set_db_engine(engine)
+    backend = BackendSQLite(engine)
+    plano = montar_plano(list(DEFINICOES_KPI))
+    for caso in CASOS_CONFORMIDADE:
+        try:
+            executar_plano(plano, backend=backend, **caso)
+        except Exception as e:
+            print(f"{Fore.YELLOW}[WARN] Caso {caso} falhou ao gerar SQL: {e}{Style.RESET_ALL}")
+    vistos, consultas = set(), []
+    for sql, params in backend.ultimas_consultas:
+        if sql not in vistos:
+            vistos.add(sql)
+            consultas.append(("kpi", sql, params))
+    return consultas
+
+def _consultas_agente(conn):
+    consultas = []
+    for tabela in _tabelas(conn):
+        colunas = _colunas(conn, tabela)
+        col_data = _coluna_data(tabela, colunas)
+        onibus = next((c for c in colunas if normalizar_texto(c) == "onibus"), None)
+        if not (col_data and onibus):
+            continue
+        for modelo in CONSULTAS_AGENTE_EXEMPLO:
+            consultas.append(("agente", modelo.format(tabela=_q(tabela), data=_q(col_data), onibus=_q(onibus)), {}))
+    return consultas
+
+def ler_consultas(caminho):
+    """Lê consultas de um arquivo .sql (separadas por ';') ou .jsonl (campo 'sql', como o log do sql_db_query)."""
+    with open(caminho, encoding="utf-8") as f:
+        conteudo = f.read()
+    if caminho.endswith(".jsonl"):
+        registros = [json.loads(l) for l in conteudo.splitlines() if l.strip()]
+        sqls = [r.get("sql") for r in registros if r.get("sql")]
+    else:
+        sqls = [s.strip() for s in conteudo.split(";") if s.strip()]
+    return [("arquivo", sql, {}) for sql in dict.fromkeys(sqls)]
+
+def explicar(conn, sql, params=None):
+    """Linhas do EXPLAIN QUERY PLAN e as tabelas varridas por inteiro (SCAN sem índice)."""
+    plano = [r[3] for r in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}", params or {})]
+    varreduras = [p for p in plano if p.startswith("SCAN") and "USING" not in p and "CONSTANT ROW" not in p]
+    return plano, varreduras
+
+def relatorio(engine, consultas_extras=()):
+    """Roda EXPLAIN QUERY PLAN nas consultas de KPI, do agente e extras. Retorna a lista de resultados."""
+    with engine.connect() as conn:
+        consultas = _consultas_agente(conn) + list(consultas_extras)
+    consultas = _consultas_kpi(engine) + consultas
+
+    resultados = []
+    with engine.connect() as conn:
+        registrar_funcoes_sqlite(conn)
+        for origem, sql, params in consultas:
+            # exec_driver_sql usa o paramstyle do sqlite3 (:nome), igual ao text() do SQLAlchemy
+            try:
+                plano, varreduras = explicar(conn, sql, params)
+            except Exception as e:
+                resultados.append({"origem": origem, "sql": sql, "erro": str(e)})
+                continue
+            resultados.append({"origem": origem, "sql": sql, "plano": plano, "varreduras": varreduras})
+    return resultados
+
+def criar_indices(caminho, faltantes):
+    """Cria os índices faltantes numa engine com escrita e atualiza as estatísticas do planner."""
+    engine = criar_engine(caminho, somente_leitura=False)
+    with engine.begin() as conn:
+        for tabela, nome, ddl in faltantes:
+            print(f"{Fore.CYAN}🔧 Criando {nome} em {tabela}...{Style.RESET_ALL}")
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+def _sem_filtro(sql):
+    """Consultas sem restrição no WHERE (período/filtro vazios) leem a tabela toda de qualquer forma."""
+    return re.search(r"\bWHERE 1\s*(GROUP\b|LIMIT\b|$)", sql) is not None
+
+def _imprimir_relatorio(resultados):
+    com_scan = [r for r in resultados if r.get("varreduras") and not _sem_filtro(r["sql"])]
+    for r in resultados:
+        if "erro" in r:
+            print(f"{Fore.YELLOW}⚠️ [{r['origem']}] não foi possível explicar: {r['erro']}{Style.RESET_ALL}")
+    for r in com_scan:
+        sql = " ".join(r["sql"].split())
+        print(f"{Fore.RED}🐢 [{r['origem']}] {'; '.join(r['varreduras'])}{Style.RESET_ALL}")
+        print(f"   {sql[:160]}{'...' if len(sql) > 160 else ''}")
+    esperadas = sum(1 for r in resultados if r.get("varreduras") and _sem_filtro(r["sql"]))
+    print(f"\n📊 {len(com_scan)} de {len(resultados)} consultas com varredura completa "
+          f"(+{esperadas} sem filtro, varredura esperada).")
+
+def main():
+    parser = argparse.ArgumentParser(description="Relatório de planos de consulta e criação dos índices recomendados.")
+    parser.add_argument("--db", default=os.getenv("RAYBOT_DB_CAMINHO", "db_raybot"))
+    parser.add_argument("--consultas", default=None, help="Arquivo .sql ou .jsonl com consultas adicionais do agente")
+    parser.add_argument("--criar", action="store_true", help="Cria os índices faltantes (abre o banco com escrita)")
+    parser.add_argument("--saida", default=None, help="Arquivo JSON para salvar o relatório")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Banco '{args.db}' não encontrado.")
+        sys.exit(1)
+
+    engine = criar_engine(args.db, somente_leitura=True)
+    with engine.connect() as conn:
+        faltantes = indices_faltantes(conn)
+
+    print(f"\n📋 Índices recomendados ausentes: {len(faltantes)}")
+    for tabela, nome, ddl in faltantes:
+        print(f"   {ddl if len(ddl) < 140 else ddl[:137] + '...'};")
+
+    extras = ler_consultas(args.consultas) if args.consultas else []
+    print(f"\n🔎 Planos antes dos índices:")
+    antes = relatorio(engine, extras)
+    _imprimir_relatorio(antes)
+    engine.dispose()
+
+    depois = None
+    if args.criar and faltantes:
+        criar_indices(args.db, faltantes)
+        engine = criar_engine(args.db, somente_leitura=True)
+        print(f"\n🔎 Planos depois dos índices:")
+        depois = relatorio(engine, extras)
+        _imprimir_relatorio(depois)
+        engine.dispose()
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"db": args.db, "faltantes": faltantes, "antes": antes, "depois": depois}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
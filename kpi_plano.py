@@ -0,0 +1,439 @@
+import numpy as np
+import pandas as pd
+from langchain.tools import tool
+from typing import Optional, List
+from pydantic import BaseModel, Field
+
+from tools import InputCalculoKPI, MESES_ABREV, informar_filtro_resolvido
+from backends import escolher_backend
+from rastreamento import span, rastrear, anotar
+from logs import LOG, campos
+
+# ====================================================
+# KPIs DECLARATIVOS
+# ====================================================
+# Cada KPI é descrito como DADO: quais medidas (numerador/denominador) usa,
+# como combiná-las (fórmula) e a direção de melhoria. Cada medida diz de qual
+# tabela vem, qual agregação aplica e quais predicados de linha filtra.
+# O planejador junta os KPIs pedidos e executa cada tabela, filtro e máscara UMA vez.
+
+STATUS_PENDENTES = ("aguardando liberacao", "parado", "liberado", "em execucao")
+
+# Predicados de linha: (operador, coluna, argumento). A coluna é um termo buscado no
+# nome normalizado (ou uma tupla de termos alternativos, ou 'situacao', que tem regra própria).
+#   contem       -> regex sobre o texto normalizado (sem acento, minúsculo)
+#   igual        -> texto em MAIÚSCULO sem espaços nas pontas igual ao argumento
+#   prefixo      -> primeiros N caracteres (MAIÚSCULO) iguais à sigla: (N, sigla)
+#   ou           -> (ou, predicado_a, predicado_b); coluna ausente conta como False
+P_CORRETIVA = ("contem", "tipomanutencao", "corretiva")
+P_PREVENTIVA = ("contem", "tipomanutencao", "preventiva|inspecao")
+P_PENDENTE = ("contem", "situacao", "|".join(STATUS_PENDENTES))
+P_LIQUIDADO = ("contem", "situacao", "liquidado")
+P_QUEBRA = ("contem", ("detalhesservico", "tipo"), "quebra")
+P_GARAGEM = ("contem", ("detalhesservico", "tipo"), "garagem")
+P_TERMINAL = ("contem", ("detalhesservico", "tipo"), "terminal")
+
+def _p_simbolo(sigla):
+    return ("igual", "simbolo", sigla)
+
+def _p_descricao(sigla, chars):
+    return ("prefixo", "descricao", (chars, sigla))
+
+def _p_simbolo_ou_descricao(sigla, chars):
+    return ("ou", _p_simbolo(sigla), _p_descricao(sigla, chars))
+
+def _manual(*predicados):
+    return {"tabela": "INDMANTMANUAL", "agregacao": "soma", "coluna": "valor", "predicados": predicados}
+
+MEDIDAS = {
+    "custo": {"tabela": "CTM", "agregacao": "soma", "coluna": "valorgasto", "predicados": ()},
+    "km": {"tabela": "IND003", "agregacao": "soma", "coluna": "kmrodado", "predicados": ()},
+    "saidas": {"tabela": "MANT004", "agregacao": "distintos", "coluna": "oidfcvprogramada", "predicados": ()},
+    "ocorrencias": {"tabela": "MANT001", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": ()},
+    "quebras": {"tabela": "MANT001", "agregacao": "linhas", "coluna": None, "predicados": (P_QUEBRA,)},
+    "trocas_garagem": {"tabela": "MANT001", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_GARAGEM,)},
+    "trocas_terminal": {"tabela": "MANT001", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_TERMINAL,)},
+    "os_preventivas": {"tabela": "MANT002", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_PREVENTIVA,)},
+    "os_corretivas": {"tabela": "MANT002", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_CORRETIVA,)},
+    "corretivas_pendentes": {"tabela": "MANT002", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_CORRETIVA, P_PENDENTE)},
+    "preventivas_pendentes": {"tabela": "MANT002", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_PREVENTIVA, P_PENDENTE)},
+    "preventivas_liquidadas": {"tabela": "MANT002", "agregacao": "distintos", "coluna": "oiddocumento", "predicados": (P_PREVENTIVA, P_LIQUIDADO)},
+    # INDMANTMANUAL: CDTDM usa só o Símbolo; os índices acumulados usam só o prefixo da Descrição;
+    # IAVLIT, PCV e IOALO aceitam Símbolo exato OU prefixo da Descrição.
+    "cdtdml": _manual(_p_simbolo("CDTDML")),
+    "desc_caiefo": _manual(_p_descricao("CAIEFO", 6)),
+    "desc_qva": _manual(_p_descricao("QVA", 3)),
+    "desc_qvv": _manual(_p_descricao("QVV", 3)),
+    "desc_tic": _manual(_p_descricao("TIC", 3)),
+    "desc_to": _manual(_p_descricao("TO", 2)),
+    "desc_topp": _manual(_p_descricao("TOPP", 4)),
+    "desc_tia": _manual(_p_descricao("TIA", 3)),
+    "qva": _manual(_p_simbolo_ou_descricao("QVA", 3)),
+    "qvv": _manual(_p_simbolo_ou_descricao("QVV", 3)),
+    "tic": _manual(_p_simbolo_ou_descricao("TIC", 3)),
+    "tia": _manual(_p_simbolo_ou_descricao("TIA", 3)),
+    "caiemf": _manual(_p_simbolo_ou_descricao("CAIEMF", 6)),
+    "caiefo": _manual(_p_simbolo_ou_descricao("CAIEFO", 6)),
+}
+
+# Fórmulas:
+#   valor       -> numerador
+#   razao       -> numerador / denominador (indefinido se denominador = 0)
+#   complemento -> (denominador - numerador) / denominador
+#   proporcao   -> numerador / (numerador + denominador)
+#   iavlit      -> razão, mas vale 1 quando ambos são zero
+#   pcv         -> min(numerador / (66% do denominador), 1), 100% se a base for zero
+DEFINICOES_KPI = {
+    "ICMQ": {"formula": "razao", "numerador": "custo", "denominador": "km", "melhor": "MIN", "formato": "R$ {:,.4f}/Km"},
+    "IDF": {"formula": "complemento", "numerador": "ocorrencias", "denominador": "saidas", "melhor": "MAX", "formato": "{:.2%}"},
+    "IMP": {"formula": "proporcao", "numerador": "os_preventivas", "denominador": "os_corretivas", "melhor": "MAX", "formato": "{:.2%}"},
+    "OEMCP": {"formula": "valor", "numerador": "corretivas_pendentes", "melhor": "MIN", "formato": "{:,.0f} ordens"},
+    "OEMPP": {"formula": "valor", "numerador": "preventivas_pendentes", "melhor": "MIN", "formato": "{:,.0f} ordens"},
+    "PREVENTIVAS LIQUIDADAS": {"formula": "valor", "numerador": "preventivas_liquidadas", "melhor": "MAX", "formato": "{:,.0f} ordens"},
+    "KMFALHAS": {"formula": "razao", "numerador": "km", "denominador": "quebras", "melhor": "MAX", "formato": "{:,.2f} Km/Quebra"},
+    "QETG": {"formula": "razao", "numerador": "km", "denominador": "trocas_garagem", "melhor": "MAX", "formato": "{:,.2f} Km/Troca"},
+    "QETT": {"formula": "razao", "numerador": "km", "denominador": "trocas_terminal", "melhor": "MAX", "formato": "{:,.2f} Km/Troca"},
+    "CDTDM": {"formula": "valor", "numerador": "cdtdml", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "CAIEFO": {"formula": "valor", "numerador": "desc_caiefo", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "QVA": {"formula": "valor", "numerador": "desc_qva", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "QVV": {"formula": "valor", "numerador": "desc_qvv", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "TIC": {"formula": "valor", "numerador": "desc_tic", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "TO": {"formula": "valor", "numerador": "desc_to", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "TOPP": {"formula": "valor", "numerador": "desc_topp", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "TIA": {"formula": "valor", "numerador": "desc_tia", "melhor": "MIN", "formato": "{:,.2f} pontos"},
+    "IAVLIT": {"formula": "iavlit", "numerador": "qva", "denominador": "qvv", "melhor": "MAX", "formato": "{:,.4f}"},
+    "PCV": {"formula": "pcv", "numerador": "tic", "denominador": "tia", "melhor": "MAX", "formato": "{:.2%}"},
+    "IOALO": {"formula": "razao", "numerador": "caiemf", "denominador": "caiefo", "melhor": "MAX", "formato": "{:.2%}"},
+}
+
+def resolver_indicador(nome):
+    """Acha a definição pelo nome exato ou por aproximação (mesma regra de CONFIG_KPI)."""
+    nome_kpi = nome.upper().strip()
+    if nome_kpi in DEFINICOES_KPI: return nome_kpi
+    for k in DEFINICOES_KPI:
+        if k in nome_kpi or nome_kpi in k:
+            return k
+    return None
+
+# ====================================================
+# Planejador
+# ====================================================
+
+def montar_plano(indicadores):
+    """
+    Junta os KPIs pedidos num único plano: medidas sem repetição e, por tabela,
+    o conjunto de predicados. Ex: ICMQ, KmFalhas, QETG e QETT compartilham a mesma
+    soma de Km do IND003; OEMCP e IMP compartilham a máscara de 'corretiva' do MANT002.
+    """
+    kpis = []
+    for nome in indicadores:
+        kpi = resolver_indicador(nome)
+        if kpi and kpi not in kpis: kpis.append(kpi)
+
+    medidas = []
+    for kpi in kpis:
+        definicao = DEFINICOES_KPI[kpi]
+        for papel in ("numerador", "denominador"):
+            medida = definicao.get(papel)
+            if medida and medida not in medidas: medidas.append(medida)
+
+    tabelas = {}
+    for medida in medidas:
+        spec = MEDIDAS[medida]
+        tabelas.setdefault(spec["tabela"], set()).update(spec["predicados"])
+
+    return {"kpis": kpis, "medidas": medidas, "tabelas": tabelas, "specs": {m: MEDIDAS[m] for m in medidas}}
+
+# ====================================================
+# Execução
+# ====================================================
+
+def executar_plano(plano, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=(), backend=None):
+    """
+    Executa o plano no backend escolhido (ver backends.escolher_backend): cada tabela é
+    lida/filtrada uma vez, cada máscara é calculada uma vez e cada medida é agregada uma vez.
+    Retorna um DataFrame de medidas indexado pelos grupos (ou por um único grupo '__todos'
+    quando não há agrupamento). Medidas impossíveis (tabela/coluna ausente) ficam como NaN.
+    """
+    agrupar_por = tuple(agrupar_por)
+    backend = backend or escolher_backend(plano)
+    with span("plano.executar", backend=backend.nome, tabelas=len(plano["tabelas"]), medidas=len(plano["medidas"]),
+              agrupar_por=",".join(agrupar_por) or None):
+        series = backend.agregar(plano, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por)
+    return _montar_grade(series, plano["medidas"], [f"__{c}" for c in agrupar_por] or ["__todos"])
+
+def _montar_grade(series, medidas, chaves):
+    """Alinha as medidas no mesmo índice de grupos (grupo sem linhas = 0; medida impossível = NaN)."""
+    if series:
+        grade = pd.concat(series, axis=1).fillna(0)
+    elif len(chaves) > 1:
+        # Nenhuma linha (ex: valor de filtro inexistente): índice vazio, mas com os níveis dos grupos
+        grade = pd.DataFrame(index=pd.MultiIndex.from_arrays([[]] * len(chaves), names=chaves))
+    else:
+        grade = pd.DataFrame()
+    if chaves == ["__todos"] and grade.empty:
+        grade = pd.DataFrame(0, index=pd.Index([True], name="__todos"), columns=list(series))
+    for medida in medidas:
+        if medida not in grade:
+            grade[medida] = float("nan")
+    grade.index.names = chaves
+    return grade[medidas].sort_index()
+
+def _dividir(num, den):
+    return (num / den.where(den != 0)).astype(float)
+
+@rastrear("plano.formulas", entrada=lambda plano, grade: {"kpis": len(plano["kpis"]), "grupos": len(grade)})
+def aplicar_formulas(plano, grade):
+    """Combina as medidas da grade nos valores de cada KPI (funciona para total ou agrupado)."""
+    kpis = pd.DataFrame(index=grade.index)
+    for kpi in plano["kpis"]:
+        d = DEFINICOES_KPI[kpi]
+        num = grade[d["numerador"]].astype(float)
+        den = grade[d["denominador"]].astype(float) if d.get("denominador") else None
+        formula = d["formula"]
+
+        if formula == "valor":
+            kpis[kpi] = num
+        elif formula == "razao":
+            kpis[kpi] = _dividir(num, den)
+        elif formula == "complemento":
+            kpis[kpi] = _dividir(den - num, den)
+        elif formula == "proporcao":
+            kpis[kpi] = _dividir(num, num + den)
+        elif formula == "iavlit":
+            kpis[kpi] = _dividir(num, den).mask((num == 0) & (den == 0), 1.0)
+        elif formula == "pcv":
+            alvo = den * 0.66
+            kpis[kpi] = _dividir(num, alvo).clip(upper=1.0).mask(alvo == 0, 1.0)
+    return kpis
+
+def calcular_kpis(indicadores, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None, agrupar_por=(), com_medidas=False, grupos=None):
+    """
+    Atalho: monta e executa o plano. Sem agrupamento retorna {KPI: valor ou None};
+    com agrupamento retorna o DataFrame de KPIs indexado pelos grupos.
+    com_medidas=True (sem agrupamento) devolve também {medida: valor ou None}, usado nos textos das tools.
+    grupos (com agrupamento): índice completo esperado (ex: os 12 meses do ano); grupos sem linhas
+    entram com medidas 0, como um período sem linhas sem agrupamento. Se nada casar, a grade segue vazia.
+    """
+    plano = montar_plano(indicadores)
+    grade = executar_plano(plano, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por)
+    if agrupar_por and grupos is not None and len(grade):
+        grade = grade.reindex(grupos, fill_value=0)
+    kpis = aplicar_formulas(plano, grade)
+    if agrupar_por:
+        return kpis
+    linha = kpis.iloc[0] if len(kpis) else pd.Series(dtype=float)
+    valores = {k: (None if pd.isna(linha.get(k)) else float(linha[k])) for k in plano["kpis"]}
+    if not com_medidas:
+        return valores
+    linha = grade.iloc[0] if len(grade) else pd.Series(dtype=float)
+    return valores, {m: (None if pd.isna(linha.get(m)) else float(linha[m])) for m in plano["medidas"]}
+
+def formatar_kpi(kpi, valor):
+    if valor is None or pd.isna(valor):
+        return "Indefinido"
+    return DEFINICOES_KPI[kpi]["formato"].format(valor)
+
+# ====================================================
+# Tool: Painel de KPIs num único plano
+# ====================================================
+
+class InputPainelKPI(InputCalculoKPI):
+    indicadores: Optional[List[str]] = Field(default=None, description="Siglas dos indicadores (ex: ['ICMQ', 'IDF', 'IMP']). Vazio = todos.")
+
+@tool(args_schema=InputPainelKPI)
+@informar_filtro_resolvido
+def calcular_painel_kpis(indicadores: Optional[List[str]] = None, filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
+    """
+    Calcula VÁRIOS indicadores de uma vez para o mesmo período/filtro (painel/dashboard).
+    Use quando a pergunta pedir 2 ou mais indicadores juntos (ex: "ICMQ, IDF e IMP de março")
+    ou um "resumo geral dos indicadores". Para INDOA inclua 'INDOA' na lista.
+    """
+    pedidos = indicadores or list(DEFINICOES_KPI)
+    LOG.info("🛠️ tool chamada", extra=campos(tool="PAINEL", indicadores=pedidos, data_inicial=data_inicial, data_final=data_final,
+                                             filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
+    try:
+        from tools import INDICADORES_INDOA, calcular_indoa_valores
+
+        quer_indoa = any(p.upper().strip() == "INDOA" for p in pedidos)
+        pedidos_plano = [p for p in pedidos if p.upper().strip() != "INDOA"]
+        if quer_indoa:
+            pedidos_plano += list(INDICADORES_INDOA)
+
+        plano = montar_plano(pedidos_plano)
+        if not plano["kpis"] and not quer_indoa:
+            return f"Erro: Nenhum indicador reconhecido em {pedidos}."
+
+        grade = executar_plano(plano, filtro_coluna, filtro_valor, data_inicial, data_final)
+        valores = aplicar_formulas(plano, grade).iloc[0]
+
+        linhas = [f"📊 Painel de indicadores ({data_inicial or 'início'} a {data_final or 'hoje'}):"]
+        for kpi in plano["kpis"]:
+            if kpi in INDICADORES_INDOA and not any(resolver_indicador(p) == kpi for p in pedidos if p.upper().strip() != "INDOA"):
+                continue
+            direcao = "Quanto MENOR, MELHOR" if DEFINICOES_KPI[kpi]["melhor"] == "MIN" else "Quanto MAIOR, MELHOR"
+            linhas.append(f"• {kpi}: {formatar_kpi(kpi, valores.get(kpi))} ({direcao})")
+
+        if quer_indoa:
+            componentes = {k: (None if pd.isna(valores.get(k)) else float(valores[k])) for k in INDICADORES_INDOA}
+            linhas.append("• " + calcular_indoa_valores(componentes, filtro_coluna, filtro_valor, data_inicial).replace("\n", "\n  "))
+        return "\n".join(linhas)
+    except Exception as e:
+        LOG.exception("falha na tool", extra=campos(tool="PAINEL"))
+        return f"Erro Painel: {str(e)}"
+
+# ====================================================
+# Tool: Ônibus fora do padrão (grade ônibus × mês)
+# ====================================================
+# Um único plano agrupado por (ônibus, mês) traz as medidas de ICMQ, KmFalhas, QETG, QETT e IDF da
+# frota inteira. Cada KPI é pontuado pelo log da sua razão de base (custo/km, km/quebras, km/trocas,
+# ocorrências/saídas): razões de custos e contagens são assimétricas e no log um desvio para cima ou
+# para baixo pesa igual. z robusto = (x - mediana) / (1,4826 · MAD), com sinal orientado (positivo = pior):
+#   frota      razão do ônibus no período (medidas somadas nos meses) contra os demais ônibus
+#   histórico  pior mês do ônibus contra a mediana dos meses dele, na escala (MAD) de toda a frota: os
+#              ~12-36 meses de um ônibus sozinhos dão um MAD instável. Exige MIN_MESES_HISTORICO meses;
+#              meses com denominador abaixo de VOLUME_MINIMO_MES × a mediana mensal do ônibus ficam de
+#              fora (mês parcial ou com poucas saídas vira razão extrema sem ser desvio de verdade)
+# O ônibus é ranqueado pelo maior z; os componentes com z >= LIMIAR_ANOMALIA explicam o desvio.
+
+KPIS_ANOMALIA = ("ICMQ", "KMFALHAS", "QETG", "QETT", "IDF")
+LIMIAR_ANOMALIA = 3.5
+MIN_MESES_HISTORICO = 6
+VOLUME_MINIMO_MES = 0.5
+FORMATO_MEDIDAS = {
+    "custo": "custo R$ {:,.2f}", "km": "{:,.0f} km", "quebras": "{:,.0f} quebras",
+    "trocas_garagem": "{:,.0f} trocas na garagem", "trocas_terminal": "{:,.0f} trocas no terminal",
+    "ocorrencias": "{:,.0f} ocorrências", "saidas": "{:,.0f} saídas",
+}
+
+def z_robusto(valores, grupos=None, escala_comum=False):
+    """
+    (x - mediana) / (1,4826 · MAD) no todo ou por grupo; com escala_comum a mediana é do grupo e o MAD
+    é de todos os desvios juntos. MAD zero (metade ou mais igual à mediana) cai para 1,2533 · desvio
+    absoluto médio; sem dispersão nenhuma o z é 0. NaN continua NaN.
+    """
+    todos = pd.Series(0, index=valores.index)
+    grupos = grupos if grupos is not None else todos
+    mediana = valores.groupby(grupos).transform("median")
+    desvio = (valores - mediana).abs()
+    grupos_escala = todos if escala_comum else grupos
+    escala = 1.4826 * desvio.groupby(grupos_escala).transform("median")
+    escala = escala.where(escala > 0, 1.2533 * desvio.groupby(grupos_escala).transform("mean"))
+    z = (valores - mediana) / escala.where(escala > 0)
+    return z.where(escala > 0, 0.0).where(valores.notna())
+
+def _log_razao(medidas, kpi):
+    """log(numerador / denominador) do KPI e o sinal que deixa 'pior' positivo (razão <= 0, infinita ou indefinida -> NaN)."""
+    definicao = DEFINICOES_KPI[kpi]
+    razao = medidas[definicao["numerador"]] / medidas[definicao["denominador"]]
+    sinal = 1 if definicao["melhor"] == "MIN" else -1
+    if definicao["formula"] == "complemento":
+        sinal = -sinal  # IDF = 1 - ocorrências/saídas: a razão sobe quando o KPI piora
+    return np.log(razao.where((razao > 0) & np.isfinite(razao))), sinal
+
+@rastrear("anomalias.frota", entrada=lambda indicadores=KPIS_ANOMALIA, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None: {
+    "kpis": len(indicadores), "data_inicial": data_inicial, "data_final": data_final})
+def varrer_anomalias_frota(indicadores=KPIS_ANOMALIA, filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None):
+    """
+    (plano, grade, por_onibus): grade = medidas por (ônibus, mês); por_onibus = KPI do período, z_frota_<KPI>,
+    z_hist_<KPI> / mes_hist_<KPI> / valor_hist_<KPI> do pior mês e 'score' (maior z), do mais fora do padrão
+    para o menos. Indicadores fora de KPIS_ANOMALIA são ignorados; sem nenhum, plano["kpis"] fica vazio.
+    """
+    kpis = [k for k in dict.fromkeys(resolver_indicador(i) for i in indicadores) if k in KPIS_ANOMALIA]
+    plano = montar_plano(kpis)
+    if not kpis:
+        return plano, pd.DataFrame(), pd.DataFrame(columns=["score"])
+    grade = executar_plano(plano, filtro_coluna, filtro_valor, data_inicial, data_final, agrupar_por=("onibus", "mes"))
+    totais = grade.groupby(level="__onibus").sum(min_count=1)
+    por_mes = aplicar_formulas(plano, grade)
+    por_onibus = aplicar_formulas(plano, totais)
+    if grade.empty:
+        return plano, grade, por_onibus.assign(score=pd.Series(dtype=float))
+
+    onibus = grade.index.get_level_values("__onibus")
+    colunas_z = []
+    for kpi in plano["kpis"]:
+        log_total, sinal = _log_razao(totais, kpi)
+        por_onibus[f"z_frota_{kpi}"] = sinal * z_robusto(log_total)
+
+        log_mes, _ = _log_razao(grade, kpi)
+        volume = grade[DEFINICOES_KPI[kpi]["denominador"]]
+        log_mes = log_mes.where(volume >= VOLUME_MINIMO_MES * volume.groupby(onibus).transform("median"))
+        meses_validos = log_mes.notna().groupby(onibus).transform("sum")
+        z_hist = (sinal * z_robusto(log_mes, onibus, escala_comum=True)).where(meses_validos >= MIN_MESES_HISTORICO).dropna()
+        pior = z_hist[z_hist.groupby(level="__onibus").rank(method="first", ascending=False) == 1]
+        por_onibus[f"z_hist_{kpi}"] = pior.droplevel("__mes")
+        por_onibus[f"mes_hist_{kpi}"] = pd.Series(pior.index.get_level_values("__mes"), index=pior.index.get_level_values("__onibus"))
+        por_onibus[f"valor_hist_{kpi}"] = por_mes[kpi].reindex(pior.index).droplevel("__mes")
+        por_onibus[f"mediana_hist_{kpi}"] = por_mes[kpi].where(log_mes.notna()).groupby(onibus).median()
+        colunas_z += [f"z_frota_{kpi}", f"z_hist_{kpi}"]
+
+    por_onibus["score"] = por_onibus[colunas_z].max(axis=1)
+    anotar(onibus=len(por_onibus), celulas=len(grade))
+    return plano, grade, por_onibus.sort_values("score", ascending=False, na_position="last")
+
+def _componentes(kpi, medidas):
+    """Numerador e denominador do KPI formatados (ex: 'custo R$ 1,234.00, 5,678 km')."""
+    definicao = DEFINICOES_KPI[kpi]
+    partes = [FORMATO_MEDIDAS[m].format(medidas[m]) for m in (definicao["numerador"], definicao.get("denominador")) if m and not pd.isna(medidas.get(m))]
+    return ", ".join(partes)
+
+def _rotulo_mes(periodo):
+    """Period('2024-03') -> 'Mar/2024'."""
+    return f"{MESES_ABREV[periodo.month]}/{periodo.year}"
+
+class InputAnomaliasFrota(InputCalculoKPI):
+    indicadores: Optional[List[str]] = Field(default=None, description="Siglas entre ICMQ, KmFalhas, QETG, QETT e IDF. Vazio = todas.")
+    limite: int = Field(default=10, description="Quantos ônibus fora do padrão listar (máximo 50)")
+
+@tool(args_schema=InputAnomaliasFrota)
+@informar_filtro_resolvido
+def analisar_anomalias_frota(indicadores: Optional[List[str]] = None, limite: int = 10, filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
+    """
+    Lista os ônibus FORA DO PADRÃO de custo/falhas (ICMQ, KmFalhas, QETG, QETT, IDF) na frota inteira,
+    comparando cada ônibus com a frota e com o próprio histórico mês a mês, e diz qual componente pesou.
+    Use para "quais ônibus estão fora do padrão", "ônibus problemáticos", "ônibus com custo/falhas anormais".
+    NÃO chame as tools de KPI ônibus por ônibus. Para um ano inteiro use 01/01 a 31/12.
+    """
+    pedidos = indicadores or list(KPIS_ANOMALIA)
+    limite = max(1, min(limite, 50))
+    LOG.info("🛠️ tool chamada", extra=campos(tool="ANOMALIAS_FROTA", indicadores=pedidos, data_inicial=data_inicial, data_final=data_final,
+                                             filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
+    try:
+        plano, grade, por_onibus = varrer_anomalias_frota(pedidos, filtro_coluna, filtro_valor, data_inicial, data_final)
+        if not plano["kpis"]:
+            return f"Erro: Nenhum indicador entre {', '.join(KPIS_ANOMALIA)} reconhecido em {pedidos}."
+        if grade.empty and filtro_coluna and filtro_valor:
+            return f"Não foram encontrados registros com {filtro_coluna} = '{filtro_valor}' (valor do filtro inexistente nas tabelas)."
+        if grade.empty or por_onibus["score"].isna().all():
+            return f"Não foram encontrados dados por ônibus entre {data_inicial or 'o início'} e {data_final or 'hoje'}."
+
+        fora = por_onibus[por_onibus["score"] >= LIMIAR_ANOMALIA]
+        periodo = f"{data_inicial or 'início'} a {data_final or 'hoje'}"
+        if fora.empty:
+            onibus, linha = next(iter(por_onibus.iterrows()))
+            return (f"✅ Nenhum ônibus fora do padrão ({periodo}) entre {len(por_onibus)} ônibus analisados. "
+                    f"Maior desvio: {onibus} (z {linha['score']:+.2f}, limiar {LIMIAR_ANOMALIA}).")
+
+        medidas_onibus = grade.groupby(level="__onibus").sum(min_count=1)
+        mediana_frota = {kpi: por_onibus[kpi].median() for kpi in plano["kpis"]}
+        linhas = [f"🚨 Ônibus fora do padrão ({periodo}): {len(fora)} de {len(por_onibus)} ônibus com z robusto >= {LIMIAR_ANOMALIA}"]
+        for posicao, (onibus, linha) in enumerate(fora.head(limite).iterrows(), 1):
+            linhas.append(f"\n{posicao}. Ônibus {onibus} (z {linha['score']:+.2f})")
+            for kpi in plano["kpis"]:
+                z_frota, z_hist = linha[f"z_frota_{kpi}"], linha[f"z_hist_{kpi}"]
+                if not pd.isna(z_frota) and z_frota >= LIMIAR_ANOMALIA:
+                    linhas.append(f"   • {kpi} no período: {formatar_kpi(kpi, linha[kpi])} x mediana da frota "
+                                  f"{formatar_kpi(kpi, mediana_frota[kpi])} (z {z_frota:+.2f}) | {_componentes(kpi, medidas_onibus.loc[onibus])}")
+                if not pd.isna(z_hist) and z_hist >= LIMIAR_ANOMALIA:
+                    mes = linha[f"mes_hist_{kpi}"]
+                    linhas.append(f"   • {kpi} em {_rotulo_mes(mes)}: {formatar_kpi(kpi, linha[f'valor_hist_{kpi}'])} x mediana do próprio ônibus "
+                                  f"{formatar_kpi(kpi, linha[f'mediana_hist_{kpi}'])} (z {z_hist:+.2f}) | {_componentes(kpi, grade.loc[(onibus, mes)])}")
+        if len(fora) > limite:
+            linhas.append(f"\n... e mais {len(fora) - limite} ônibus acima do limiar.")
+        linhas.append("\n(z robusto = (valor - mediana) / (1,4826 · MAD) no log da razão do KPI; positivo = pior. Frota: ônibus contra "
+                      "os demais no período; histórico: pior mês contra os outros meses do mesmo ônibus.)")
+        return "\n".join(linhas)
+    except Exception as e:
+        LOG.exception("falha na tool", extra=campos(tool="ANOMALIAS_FROTA"))
+        return f"Erro Anomalias: {str(e)}"
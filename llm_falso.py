@@ -0,0 +1,106 @@
+import re
+import json
+import time
+import uuid
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# ====================================================
+# LLMs falsos para testes locais (servidor, carga, latência do agente) sem chamar a OpenAI
+# ====================================================
+# LLMFalso: texto fixo, nunca chama tools. LLMRoteiro: chama as tools de um roteiro por pergunta.
+
+class LLMFalso(BaseChatModel):
+    """Responde sempre com um texto fixo após `atraso` segundos, sem chamar tools (em streaming, palavra a palavra)."""
+    atraso: float = 0.0
+    resposta: str = "Resposta de teste para: {pergunta}"
+
+    @property
+    def _llm_type(self) -> str:
+        return "raybot-falso"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self
+
+    def _mensagem(self, messages: List[BaseMessage]) -> ChatResult:
+        pergunta = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        texto = self.resposta.format(pergunta=pergunta)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=texto))])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.atraso)
+        return self._mensagem(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.atraso)
+        return self._mensagem(messages)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        texto = self._mensagem(messages).generations[0].message.content
+        partes = [p for p in re.split(r"(\s+)", texto) if p]
+        for parte in partes:
+            await asyncio.sleep(self.atraso / len(partes))
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=parte))
+            if run_manager:
+                await run_manager.on_llm_new_token(parte, chunk=chunk)
+            yield chunk
+
+def _normalizar(pergunta):
+    return " ".join(str(pergunta).lower().split()).rstrip("?!. ")
+
+class LLMRoteiro(BaseChatModel):
+    """
+    Segue um roteiro por pergunta: {pergunta: [passo, passo, ...]}, cada passo sendo a lista de
+    tools pedidas naquela chamada ao modelo ([{"nome": "calcular_icmq", "args": {...}}]; mais de uma
+    = chamadas em paralelo). Esgotados os passos, responde com a 1ª linha de cada saída de tool do turno.
+    Pergunta fora do roteiro usa o roteiro "*" (se houver) ou responde direto, sem tools.
+    Cada chamada espera `atraso` segundos: é a latência simulada do modelo.
+    """
+    roteiros: Dict[str, List[List[Dict[str, Any]]]] = {}
+    atraso: float = 0.0
+
+    @classmethod
+    def de_arquivo(cls, caminho, **kwargs):
+        """Roteiro em JSON no mesmo formato de `roteiros`."""
+        with open(caminho, encoding="utf-8") as f:
+            return cls(roteiros=json.load(f), **kwargs)
+
+    @property
+    def _llm_type(self) -> str:
+        return "raybot-roteiro"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self
+
+    def _passos(self, pergunta):
+        alvo = _normalizar(pergunta)
+        for chave, passos in self.roteiros.items():
+            if _normalizar(chave) == alvo:
+                return passos
+        return self.roteiros.get("*", [])
+
+    def _mensagem(self, messages: List[BaseMessage]) -> ChatResult:
+        inicio_turno = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+        turno = messages[inicio_turno:]
+        feitos = sum(1 for m in turno if isinstance(m, AIMessage))
+        passos = self._passos(turno[0].content if turno else "")
+
+        if feitos < len(passos):
+            chamadas = [{"name": c["nome"], "args": c.get("args", {}), "id": f"roteiro_{uuid.uuid4().hex[:8]}"}
+                        for c in passos[feitos]]
+            mensagem = AIMessage(content="", tool_calls=chamadas)
+        else:
+            saidas = [str(m.content).strip().splitlines()[0] for m in turno if isinstance(m, ToolMessage) and str(m.content).strip()]
+            mensagem = AIMessage(content="\n".join(saidas) or "Resposta de teste (roteiro sem tools).")
+        return ChatResult(generations=[ChatGeneration(message=mensagem)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.atraso)
+        return self._mensagem(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.atraso)
+        return self._mensagem(messages)
@@ -0,0 +1,122 @@
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+
+import rastreamento
+
+# ====================================================
+# LOGS (níveis, id do turno e campos estruturados, escrita fora da thread das tools)
+# ====================================================
+# O código chama LOG.debug/info/warning/error com extra=campos(tabela=..., linhas_antes=...).
+# O QueueHandler só carimba o turno (rastreamento) e enfileira o registro; a formatação e a escrita
+# ficam na thread do QueueListener, então várias perguntas em paralelo não disputam o stdout.
+# Abaixo do nível configurado a chamada para em LOG.isEnabledFor, sem formatar nada.
+#
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_LOG_NIVEL (INFO)      DEBUG inclui filtros de data, colunas candidatas e parciais dos KPIs
+#   RAYBOT_LOG_FORMATO (texto)   texto | json (uma linha JSON por registro, com os campos soltos)
+#   RAYBOT_LOG_ARQUIVO ()        grava neste arquivo em vez do stderr
+
+NIVEL = os.getenv("RAYBOT_LOG_NIVEL", "INFO").strip().upper()
+FORMATO = os.getenv("RAYBOT_LOG_FORMATO", "texto").strip().lower()
+ARQUIVO = os.getenv("RAYBOT_LOG_ARQUIVO", "")
+
+LOG = logging.getLogger("raybot")
+
+NOMES_NIVEL = {logging.DEBUG: "DEBUG", logging.INFO: "INFO", logging.WARNING: "WARN", logging.ERROR: "ERRO",
+               logging.CRITICAL: "ERRO"}
+
+try:
+    from colorama import Fore, Style
+    CORES = {logging.WARNING: Fore.YELLOW, logging.ERROR: Fore.RED, logging.CRITICAL: Fore.RED}
+    RESET = Style.RESET_ALL
+except Exception:
+    CORES, RESET = {}, ""
+
+def campos(**valores):
+    """extra=campos(tabela="CTM", linhas_antes=10, linhas_depois=2) -> campos estruturados do registro."""
+    return {"campos": valores}
+
+class _CarimboTurno(logging.Filter):
+    """Roda na thread que loga (antes de enfileirar): guarda o turno atual e o nome da thread."""
+
+    def filter(self, record):
+        record.turno = rastreamento.turno_atual()
+        return True
+
+class _Enfileirar(logging.handlers.QueueHandler):
+    """
+    O QueueHandler padrão formata o registro (traceback incluso) em prepare(), na thread que loga,
+    para poder mandá-lo a outro processo. Aqui a fila é do próprio processo: o registro vai inteiro
+    e a formatação fica com o QueueListener.
+    """
+
+    def prepare(self, record):
+        return record
+
+class FormatoTexto(logging.Formatter):
+    """'12:00:01 [INFO] turno=ab12 🛠️ tool chamada tool=ICMQ data_inicial=2024-03-01'"""
+
+    def __init__(self, cores=False):
+        super().__init__()
+        self.cores = cores
+
+    def format(self, record):
+        partes = [self.formatTime(record, "%H:%M:%S"), f"[{NOMES_NIVEL.get(record.levelno, record.levelname)}]"]
+        if getattr(record, "turno", None):
+            partes.append(f"turno={record.turno}")
+        partes.append(record.getMessage())
+        partes += [f"{k}={v}" for k, v in getattr(record, "campos", {}).items() if v is not None]
+        linha = " ".join(partes)
+        if record.exc_text or record.exc_info:
+            linha += "\n" + (record.exc_text or self.formatException(record.exc_info))
+        cor = CORES.get(record.levelno) if self.cores else None
+        return f"{cor}{linha}{RESET}" if cor else linha
+
+class FormatoJSON(logging.Formatter):
+    def format(self, record):
+        registro = {"ts": round(record.created, 3), "nivel": NOMES_NIVEL.get(record.levelno, record.levelname),
+                    "logger": record.name, "turno": getattr(record, "turno", None), "thread": record.threadName,
+                    "mensagem": record.getMessage(), **getattr(record, "campos", {})}
+        if record.exc_text or record.exc_info:
+            registro["excecao"] = record.exc_text or self.formatException(record.exc_info)
+        return json.dumps(registro, ensure_ascii=False, default=str)
+
+_LISTENER = None
+
+def configurar(nivel=None, formato=None, arquivo=None):
+    """(Re)monta o pipeline: LOG -> QueueHandler -> fila -> QueueListener -> stderr ou arquivo."""
+    global _LISTENER
+    parar()
+    arquivo = ARQUIVO if arquivo is None else arquivo
+    destino = logging.FileHandler(arquivo, encoding="utf-8") if arquivo else logging.StreamHandler(sys.stderr)
+    json_ = (formato or FORMATO) == "json"
+    destino.setFormatter(FormatoJSON() if json_ else FormatoTexto(cores=not arquivo and sys.stderr.isatty()))
+
+    fila = queue.SimpleQueue()
+    enfileirar = _Enfileirar(fila)
+    enfileirar.addFilter(_CarimboTurno())
+    for handler in list(LOG.handlers):
+        LOG.removeHandler(handler)
+    LOG.addHandler(enfileirar)
+    LOG.setLevel(nivel or NIVEL)
+    LOG.propagate = False
+
+    _LISTENER = logging.handlers.QueueListener(fila, destino)
+    _LISTENER.start()
+
+def parar():
+    """Esvazia a fila e encerra a thread de escrita (chamado também na saída do processo)."""
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        for handler in _LISTENER.handlers:
+            handler.close()
+        _LISTENER = None
+
+configurar()
+atexit.register(parar)
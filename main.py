@@ -1,43 +1,55 @@
 import os
 import sys
+import json
+import time
 import asyncio
+import argparse
+import statistics
 from dotenv import load_dotenv
 load_dotenv()
-from langchain_openai import ChatOpenAI
-from langchain_community.utilities import SQLDatabase
-from langchain_community.agent_toolkits import SQLDatabaseToolkit
-from langgraph.prebuilt import create_react_agent
-from sqlalchemy import create_engine
-from langchain_core.messages import SystemMessage, HumanMessage
+# langchain_openai, o toolkit SQL do langchain_community e o create_react_agent são importados só
+# onde são usados (criar_llm / configurar_banco / construir_agente): na CLI isso roda em segundo plano
+# enquanto o prompt já está na tela (ver main). Tempo de cada import: python benchmark_inicio.py
+from langchain_core.messages import HumanMessage, AIMessage
 import datetime
-from langgraph.checkpoint.memory import MemorySaver
+import uuid
 import tools as kpi_tools
-from prompt import SYSTEM_PROMPT_TEXT
+from conexao import criar_engine
+import kpi_plano
+import backends
+import consulta_sql
+import roteador
+from prompt import SYSTEM_PROMPT_TEXT, montar_prompt, selecionar_tabelas, contar_tokens
+from memoria import MemoriaSessoes, EstadoRaybot, compactar_historico
+import cache_respostas
+import rastreamento
+import turno_ferramentas
+from logs import LOG, campos
 
-# 1. Configuração do Banco de Dados
-DB_PATH = "sqlite:///db_raybot"
-engine = create_engine(DB_PATH)
+# 1. Configuração (via .env)
+DB_PATH = os.getenv("RAYBOT_DB_CAMINHO", "db_raybot")
+# Tempo máximo de espera por resposta do agente (em segundos)
+TEMPO_MAXIMO_SEGUNDOS = float(os.getenv("RAYBOT_TEMPO_MAXIMO", "45"))
+USAR_ROTEADOR = os.getenv("RAYBOT_ROTEADOR", "1").strip().lower() in ("1", "true", "sim", "yes")
+# Lote: python main.py --lote perguntas.txt --saida respostas.jsonl (RAYBOT_LOTE_CONCORRENCIA perguntas ao mesmo tempo, padrão 4)
+# Perfil de um turno: python main.py --perfil "ICMQ de março" (cProfile + spans do turno; ver rastreamento.py)
+# Modelo: RAYBOT_MODELO = openai (padrão; RAYBOT_MODELO_NOME, padrão gpt-4o-mini) | falso | roteiro
+# (roteiro: RAYBOT_MODELO_ROTEIRO = JSON no formato de llm_falso.LLMRoteiro). Ver FABRICAS_LLM.
+MODELO = os.getenv("RAYBOT_MODELO", "openai").strip().lower()
+# Prompt só com o dicionário das tabelas relacionadas à pergunta (0 = prompt completo)
+PROMPT_ENXUTO = os.getenv("RAYBOT_PROMPT_ENXUTO", "1").strip().lower() in ("1", "true", "sim", "yes")
 
-# Configura a engine globalmente no tools.py
-kpi_tools.set_db_engine(engine)
+MENSAGEM_TEMPO_ESGOTADO = ("Puxa, essa consulta está demorando mais do que o esperado ({tempo:g} segundos). "
+                           "Você poderia tentar simplificar a pergunta ou reduzir o período analisado?")
+MENSAGEM_ERRO = "Infelizmente, não foi possível responder à pergunta neste momento."
 
-db = SQLDatabase(engine)
+# Histórico por sessão (limites em memoria.py); perguntas sem sessão não guardam histórico
+MEMORIA = MemoriaSessoes()
+# Respostas de perguntas repetidas no mesmo dia e com os mesmos dados (ver cache_respostas.py)
+CACHE_RESPOSTAS = cache_respostas.CacheRespostas() if cache_respostas.ATIVO else None
 
-# 2. Configuração do Modelo
-if not os.getenv("OPENAI_API_KEY"):
-    print("❌ ERRO: A chave OPENAI_API_KEY não foi encontrada no arquivo .env")
-    sys.exit(1)
-
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-
-# 3. Preparação das Ferramentas
-
-# A: Ferramentas de SQL
-sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-sql_tools = sql_toolkit.get_tools()
-
-# B: Suas Ferramentas de KPI
-custom_tools = [
+# Ferramentas de KPI
+CUSTOM_TOOLS = [
     kpi_tools.calcular_icmq,
     kpi_tools.calcular_idf,
     kpi_tools.calcular_imp,
@@ -59,57 +71,412 @@ custom_tools = [
     kpi_tools.calcular_pcv,
     kpi_tools.calcular_ioalo,
     kpi_tools.calcular_indoa,
+    kpi_tools.calcular_indoa_matriz,
     kpi_tools.analisar_evolucao_kpi,
     kpi_tools.consultar_meta_indicador,
-    kpi_tools.calcular_kpi_por_mes
+    kpi_tools.calcular_kpi_por_mes,
+    kpi_plano.calcular_painel_kpis,
+    kpi_plano.analisar_anomalias_frota
 ]
 
-all_tools = custom_tools + sql_tools
+def configurar_banco(caminho=None):
+    """
+    Engine somente leitura (WAL, mmap e pool; ver conexao.py) compartilhada com o tools.py.
+    O esquema de cada tabela só é refletido quando as tools SQL pedem (sql_db_schema), não na inicialização.
+    """
+    from langchain_community.utilities import SQLDatabase
+    engine = criar_engine(caminho or DB_PATH)
+    kpi_tools.set_db_engine(engine)
+    return SQLDatabase(engine, lazy_table_reflection=True)
+
+def _exigir_chave_openai():
+    if not os.getenv("OPENAI_API_KEY"):
+        print("❌ ERRO: A chave OPENAI_API_KEY não foi encontrada no arquivo .env")
+        sys.exit(1)
+
+def _llm_openai(nome=None):
+    _exigir_chave_openai()
+    from langchain_openai import ChatOpenAI  # o import mais caro da inicialização (openai, langsmith, aiohttp)
+    # stream_usage: usage_metadata também no modo streaming (contagem de tokens por turno)
+    return ChatOpenAI(model=nome or os.getenv("RAYBOT_MODELO_NOME", "gpt-4o-mini"), temperature=0, stream_usage=True)
+
+def _llm_falso(atraso=0.0):
+    from llm_falso import LLMFalso
+    return LLMFalso(atraso=atraso)
+
+def _llm_roteiro(atraso=0.0, roteiros=None, arquivo=None):
+    from llm_falso import LLMRoteiro
+    arquivo = arquivo or os.getenv("RAYBOT_MODELO_ROTEIRO")
+    if roteiros is None and arquivo:
+        return LLMRoteiro.de_arquivo(arquivo, atraso=atraso)
+    return LLMRoteiro(roteiros=roteiros or {}, atraso=atraso)
+
+# Fábricas de modelo por nome (RAYBOT_MODELO ou criar_llm(tipo)); outros provedores entram aqui
+FABRICAS_LLM = {"openai": _llm_openai, "falso": _llm_falso, "roteiro": _llm_roteiro}
+
+def criar_llm(tipo=None, **opcoes):
+    """Modelo do agente: criar_llm() usa RAYBOT_MODELO; criar_llm("roteiro", roteiros={...}, atraso=0.5) para testes."""
+    tipo = tipo or MODELO
+    if tipo not in FABRICAS_LLM:
+        print(f"❌ ERRO: modelo '{tipo}' desconhecido (opções: {', '.join(FABRICAS_LLM)})")
+        sys.exit(1)
+    return FABRICAS_LLM[tipo](**opcoes)
+
+def montar_ferramentas(db, llm):
+    from langchain_community.agent_toolkits import SQLDatabaseToolkit
+    # SQL do toolkit, com sql_db_query trocado pela versão com limite de linhas e de tempo
+    sql_toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+    sql_tools = [consulta_sql.sql_db_query if t.name == "sql_db_query" else t for t in sql_toolkit.get_tools()]
+    # Cada chamada de tool vira um span 'ferramenta' ligado ao turno (ver rastreamento.py); chamadas
+    # idênticas em paralelo são coalescidas e os recortes filtrados ficam no rascunho do turno (ver turno_ferramentas.py)
+    return [rastreamento.envolver_ferramenta(turno_ferramentas.envolver_ferramenta(t)) for t in CUSTOM_TOOLS + sql_tools]
+
+def construir_agente(llm=None, db=None):
+    """
+    Grafo ReAct com as tools de KPI e de SQL. Um único agente atende a CLI ou todas as requisições do servidor;
+    o histórico de cada sessão fica no checkpointer de MEMORIA e é compactado antes de cada chamada ao modelo.
+    """
+    from langgraph.prebuilt import create_react_agent
+    llm = llm or criar_llm()
+    db = db or configurar_banco()
+    return create_react_agent(llm, tools=montar_ferramentas(db, llm), state_schema=EstadoRaybot,
+                              pre_model_hook=compactar_historico, checkpointer=MEMORIA.checkpointer)
+
+def hoje_prompt():
+    """Data injetada no {hoje} do prompt (também faz parte da chave do cache de respostas)."""
+    return datetime.datetime.now().strftime("%d/%m/%Y")
+
+def montar_prompt_sistema(pergunta, perguntas_anteriores=(), hoje_atualizado=None):
+    """Prompt do sistema do turno; em sessões, as perguntas anteriores também contam na escolha das tabelas."""
+    hoje_atualizado = hoje_atualizado or hoje_prompt()
+    if PROMPT_ENXUTO:
+        tabelas_prompt = selecionar_tabelas(" ".join([*perguntas_anteriores, pergunta]))
+        prompt_formatado = montar_prompt(pergunta, hoje_atualizado, tabelas_prompt)
+    else:
+        tabelas_prompt = "todas"
+        prompt_formatado = SYSTEM_PROMPT_TEXT.replace("{hoje}", hoje_atualizado)
+    tokens_prompt = contar_tokens(prompt_formatado)
+    LOG.info("📏 prompt do sistema", extra=campos(tokens=tokens_prompt, tabelas=tabelas_prompt or "nenhuma"))
+    return prompt_formatado, tokens_prompt
+
+# Texto de progresso mostrado enquanto cada tool roda
+DESCRICAO_FERRAMENTAS = {
+    "sql_db_query": "consultando o banco de dados…",
+    "sql_db_schema": "lendo a estrutura das tabelas…",
+    "sql_db_list_tables": "listando as tabelas…",
+    "sql_db_query_checker": "revisando a consulta SQL…",
+    "analisar_evolucao_kpi": "comparando os períodos…",
+    "consultar_meta_indicador": "buscando a meta…",
+    "calcular_painel_kpis": "calculando o painel de indicadores…",
+    "calcular_kpi_por_mes": "calculando mês a mês…",
+}
+
+def descrever_ferramenta(nome):
+    if nome in DESCRICAO_FERRAMENTAS:
+        return DESCRICAO_FERRAMENTAS[nome]
+    if nome.startswith("calcular_"):
+        return f"calculando {nome[len('calcular_'):].replace('_', ' ').upper()}…"
+    return f"executando {nome}…"
+
+async def _eventos_agente(agente, entrada, config, resultado, tempo_maximo, turno_id=None, perfil=False):
+    """
+    Roda agente.astream numa tarefa separada (fila entre as duas) para que o tempo máximo
+    e o cancelamento valham mesmo se quem consome os eventos for lento ou desistir.
+    """
+    fila = asyncio.Queue()
+    config = {**config, "callbacks": [rastreamento.RastreadorLLM()]}
+
+    async def produzir():
+        try:
+            # Spans das tools (threads copiadas deste contexto) e do LLM herdam o turno e o rascunho dele
+            with rastreamento.turno(turno_id, perfil=perfil), turno_ferramentas.turno():
+                async for item in agente.astream(entrada, config, stream_mode=["messages", "updates"]):
+                    await fila.put(item)
+            await fila.put(None)
+        except Exception as e:
+            await fila.put(e)
 
-hoje = datetime.datetime.now().strftime("%d/%m/%Y")
+    loop = asyncio.get_running_loop()
+    limite = loop.time() + tempo_maximo
+    tarefa = asyncio.create_task(produzir())
+    ultima_resposta, texto_em_fluxo, uso = None, "", []
+    try:
+        while True:
+            item = await asyncio.wait_for(fila.get(), max(limite - loop.time(), 0))
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            modo, dado = item
 
-# 4. Criação do Agente
-agent_executor = create_react_agent(llm, tools=all_tools)
+            if modo == "messages":
+                # Só tokens do nó do agente (o sql_db_query_checker também chama o LLM, dentro do nó de tools)
+                chunk, meta = dado
+                if meta.get("langgraph_node") == "agent" and isinstance(chunk.content, str) and chunk.content:
+                    texto_em_fluxo += chunk.content
+                    yield {"tipo": "token", "texto": chunk.content}
+                continue
 
-# 5. Execução
-async def main():
+            for no, atualizacao in dado.items():
+                for msg in (atualizacao or {}).get("messages", []):
+                    if no == "agent":
+                        if getattr(msg, "usage_metadata", None):
+                            uso.append(msg.usage_metadata)
+                        for chamada in getattr(msg, "tool_calls", None) or []:
+                            yield {"tipo": "ferramenta", "nome": chamada["name"], "args": chamada["args"],
+                                   "texto": descrever_ferramenta(chamada["name"])}
+                        if not msg.tool_calls:
+                            ultima_resposta = msg
+                            # Modelo sem streaming de tokens: entrega a resposta inteira de uma vez
+                            if not texto_em_fluxo and msg.content:
+                                yield {"tipo": "token", "texto": msg.content}
+                        texto_em_fluxo = ""
+                    elif no == "tools":
+                        yield {"tipo": "ferramenta_fim", "nome": getattr(msg, "name", None),
+                               "status": getattr(msg, "status", "success")}
+    finally:
+        if not tarefa.done():
+            tarefa.cancel()
+
+    resultado["resposta"] = ultima_resposta.content if ultima_resposta else ""
+    if uso:
+        resultado["uso"] = {
+            "chamadas": len(uso),
+            "tokens_entrada": sum(u.get("input_tokens", 0) for u in uso),
+            "tokens_saida": sum(u.get("output_tokens", 0) for u in uso),
+        }
+        LOG.info("📏 uso do modelo no turno", extra=campos(**resultado["uso"]))
+
+async def _consultar_cache(pergunta, hoje, sessao):
+    """
+    (chave, resposta guardada ou None). Só a primeira pergunta de uma conversa usa o cache:
+    a resposta de um follow-up depende do histórico da sessão. Falha no cache nunca derruba a pergunta.
+    """
+    if CACHE_RESPOSTAS is None or (sessao and MEMORIA.perguntas_recentes(sessao)):
+        return None, None
+    try:
+        chave = (pergunta, hoje, await asyncio.to_thread(cache_respostas.versao_dados))
+        return chave, await asyncio.to_thread(CACHE_RESPOSTAS.buscar, *chave)
+    except Exception as e:
+        LOG.warning("cache de respostas indisponível: %s", e)
+        return None, None
+
+async def responder_em_fluxo(agente, pergunta, tempo_maximo=None, sessao=None, perfil=False):
+    """
+    Gera eventos enquanto responde: {'tipo': 'ferramenta'|'ferramenta_fim'|'token', ...} e por último
+    {'tipo': 'fim', 'resultado': {...}} com resposta, rota ('cache', 'rapida' ou 'agente'),
+    erro (None, 'tempo_esgotado' ou 'falha'), duracao_s e turno (id dos spans em rastreamento.py).
+    Com `sessao`, a pergunta continua a conversa anterior dessa sessão (ver memoria.py).
+    Com `perfil`, o turno roda sob cProfile (ver rastreamento.turno).
+    """
+    tempo_maximo = TEMPO_MAXIMO_SEGUNDOS if tempo_maximo is None else tempo_maximo
+    inicio = time.perf_counter()
+    turno_id = uuid.uuid4().hex[:12]
+    resultado = {"pergunta": pergunta, "rota": "agente", "erro": None, "turno": turno_id}
+    # Sem sessão: thread descartável, apagada ao fim do turno
+    thread_id = sessao or f"avulsa-{uuid.uuid4().hex}"
+    config = MEMORIA.config(thread_id)
+    hoje = hoje_prompt()
+    try:
+        chave_cache, guardada = await _consultar_cache(pergunta, hoje, sessao)
+        resposta_direta = None
+        if guardada:
+            resposta_direta, rota = guardada["resposta"], "cache"
+        elif USAR_ROTEADOR:
+            # Perguntas simples de KPI ("ICMQ de março do ônibus X") são respondidas sem LLM
+            resposta_direta = await asyncio.to_thread(rastreamento.executar_no_turno, turno_id, roteador.responder_rapido,
+                                                      pergunta, perfil=perfil)
+            rota = "rapida"
+        if resposta_direta:
+            resultado.update(resposta=resposta_direta, rota=rota)
+            if sessao:
+                # Registra o par pergunta/resposta para que a próxima pergunta possa se referir a ele
+                await agente.aupdate_state(config, {"messages": [HumanMessage(content=pergunta), AIMessage(content=resposta_direta)]},
+                                           as_node="agent")
+            yield {"tipo": "token", "texto": resposta_direta}
+        else:
+            anteriores = MEMORIA.perguntas_recentes(sessao) if sessao else ()
+            prompt_sistema, resultado["tokens_prompt"] = montar_prompt_sistema(pergunta, anteriores, hoje)
+            entrada = {"messages": [HumanMessage(content=pergunta)], "prompt_sistema": prompt_sistema}
+            async for evento in _eventos_agente(agente, entrada, config, resultado, tempo_maximo, turno_id, perfil):
+                yield evento
+        if chave_cache and resultado["rota"] != "cache" and resultado.get("resposta"):
+            await asyncio.to_thread(CACHE_RESPOSTAS.gravar, *chave_cache, resultado["resposta"], resultado["rota"])
+    except asyncio.TimeoutError:
+        resultado.update(resposta=MENSAGEM_TEMPO_ESGOTADO.format(tempo=tempo_maximo), erro="tempo_esgotado")
+    except Exception as e:
+        # Para o usuário mantemos a mensagem amigável; o detalhe vai para o log
+        LOG.exception("falha ao responder", extra=campos(pergunta=pergunta[:80]))
+        resultado.update(resposta=MENSAGEM_ERRO, erro="falha")
+    finally:
+        if sessao:
+            MEMORIA.registrar_pergunta(sessao, pergunta)
+            MEMORIA.finalizar_turno(sessao)
+        else:
+            MEMORIA.encerrar(thread_id)
+    resultado["duracao_s"] = round(time.perf_counter() - inicio, 3)
+    rastreamento.registrar("turno", resultado["duracao_s"], turno=turno_id, rota=resultado["rota"], erro=resultado["erro"])
+    yield {"tipo": "fim", "resultado": resultado}
+
+async def responder(agente, pergunta, tempo_maximo=None, sessao=None, perfil=False):
+    """Mesma coisa que responder_em_fluxo, devolvendo só o resultado final."""
+    async for evento in responder_em_fluxo(agente, pergunta, tempo_maximo, sessao, perfil):
+        if evento["tipo"] == "fim":
+            return evento["resultado"]
+
+async def responder_com_rastro(agente, pergunta, tempo_maximo=None, sessao=None):
+    """Resultado final + 'ferramentas': lista com nome, args, status, início e duração (s) de cada tool chamada."""
+    inicio, ferramentas, abertas = time.perf_counter(), [], {}
+    async for evento in responder_em_fluxo(agente, pergunta, tempo_maximo, sessao):
+        agora = round(time.perf_counter() - inicio, 3)
+        if evento["tipo"] == "ferramenta":
+            rastro = {"nome": evento["nome"], "args": evento["args"], "inicio_s": agora}
+            ferramentas.append(rastro)
+            abertas.setdefault(evento["nome"], []).append(rastro)
+        elif evento["tipo"] == "ferramenta_fim" and abertas.get(evento["nome"]):
+            rastro = abertas[evento["nome"]].pop(0)
+            rastro.update(status=evento["status"], duracao_s=round(agora - rastro["inicio_s"], 3))
+        elif evento["tipo"] == "fim":
+            return {**evento["resultado"], "ferramentas": ferramentas}
+
+def ler_perguntas(caminho):
+    """
+    .txt: uma pergunta por linha (linhas vazias e começando com # são ignoradas).
+    .jsonl: um objeto por linha com "pergunta" e, opcionalmente, "id" e "sessao".
+    """
+    perguntas = []
+    with open(caminho, encoding="utf-8") as f:
+        for n, linha in enumerate(f, 1):
+            linha = linha.strip()
+            if not linha or linha.startswith("#"):
+                continue
+            if caminho.endswith(".jsonl"):
+                item = json.loads(linha)
+                perguntas.append({"id": item.get("id", n), "pergunta": item["pergunta"], "sessao": item.get("sessao")})
+            else:
+                perguntas.append({"id": n, "pergunta": linha, "sessao": None})
+    return perguntas
+
+async def executar_lote(agente, perguntas, saida, concorrencia=4, tempo_maximo=None):
+    """
+    Roda as perguntas no agente com no máximo `concorrencia` ao mesmo tempo (todas compartilham o
+    cache de tabelas já aquecido) e grava uma linha JSONL por pergunta, na ordem em que terminam.
+    Perguntas da mesma sessão rodam em sequência, na ordem do arquivo. Devolve os resultados na ordem de entrada.
+    """
+    semaforo = asyncio.Semaphore(concorrencia)
+    por_sessao = {}
+    for item in perguntas:
+        por_sessao.setdefault(item["sessao"] or f"__{item['id']}", []).append(item)
+    resultados = {}
+
+    with open(saida, "w", encoding="utf-8") as arquivo:
+        async def rodar(itens):
+            for item in itens:
+                async with semaforo:
+                    resultado = await responder_com_rastro(agente, item["pergunta"], tempo_maximo, item["sessao"])
+                resultado = {"id": item["id"], "sessao": item["sessao"], **resultado}
+                resultados[item["id"]] = resultado
+                arquivo.write(json.dumps(resultado, ensure_ascii=False, default=str) + "\n")
+                arquivo.flush()
+                status = "✅" if not resultado["erro"] else "⚠️"
+                print(f"{status} [{len(resultados)}/{len(perguntas)}] {resultado['duracao_s']:.2f}s {resultado['rota']} | {item['pergunta'][:70]}")
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*(rodar(itens) for itens in por_sessao.values()))
+        total = time.perf_counter() - inicio
+
+    duracoes = sorted(r["duracao_s"] for r in resultados.values())
+    if duracoes:
+        p95 = duracoes[min(int(len(duracoes) * 0.95), len(duracoes) - 1)]
+        erros = sum(1 for r in resultados.values() if r["erro"])
+        print(f"\n📊 Lote: {len(duracoes)} pergunta(s) em {total:.1f}s ({len(duracoes) / total:.2f}/s), "
+              f"{erros} com erro | p50 {statistics.median(duracoes):.2f}s, p95 {p95:.2f}s -> {saida}")
+        rastreamento.imprimir_resumo()
+    return [resultados[item["id"]] for item in perguntas]
+
+def _modelo_da_linha_de_comando(args):
+    tipo = "falso" if args.llm_falso else (args.modelo or MODELO)
+    return tipo, ({"atraso": args.atraso_falso} if tipo in ("falso", "roteiro") else {})
+
+def _agente_da_linha_de_comando(args, db=None):
+    tipo, opcoes = _modelo_da_linha_de_comando(args)
+    return construir_agente(llm=criar_llm(tipo, **opcoes), db=db)
+
+async def preparar(args, aquecer=True):
+    """
+    Monta o agente e aquece o cache de tabelas ao mesmo tempo, em duas threads: os imports do modelo
+    e do LangGraph não esperam a leitura das tabelas, nem o contrário. A engine é criada antes
+    (rápido, sem refletir o esquema) porque o aquecimento já lê por ela.
+    """
+    db = configurar_banco()
+    tarefas = [asyncio.to_thread(_agente_da_linha_de_comando, args, db)]
+    if aquecer:
+        tarefas.append(asyncio.to_thread(backends.aquecer_cache_do_backend))
+    agente, *_ = await asyncio.gather(*tarefas)
+    return agente
+
+async def main_lote(args):
+    perguntas = ler_perguntas(args.lote)
+    print(f"🔥 Aquecendo cache de tabelas para {len(perguntas)} pergunta(s)...")
+    agente = await preparar(args)
+    await executar_lote(agente, perguntas, args.saida, args.concorrencia, args.tempo_maximo)
+
+async def main_perfil(args):
+    """Uma pergunta só, com cProfile em todas as threads do turno e o resumo dos spans no final."""
+    agente = await preparar(args)
+    resultado = await responder(agente, args.perfil, args.tempo_maximo, perfil=True)
+    print(f"\n📢 Raybot ({resultado['rota']}, {resultado['duracao_s']:.2f}s): {resultado['resposta']}")
+    rastreamento.imprimir_resumo(resultado["turno"])
+
+# Execução (modo terminal)
+async def main(args):
+    if _modelo_da_linha_de_comando(args)[0] == "openai":
+        _exigir_chave_openai()  # falta de chave aparece já, não só na primeira pergunta
+    # O prompt aparece logo; agente e cache de tabelas ficam prontos em segundo plano enquanto o
+    # usuário digita, e a primeira pergunta só espera o que ainda faltar
+    preparo = asyncio.create_task(preparar(args))
+    agente = None
     print("🤖 Raybot Iniciado. Digite 'sair' para encerrar.")
-    
-    # Defina o tempo máximo de espera (em segundos). Ajuste conforme necessário.
-    TEMPO_MAXIMO_SEGUNDOS = 45
 
     while True:
-        user_input = input("\nPergunte: ")
+        # input() numa thread para não travar o event loop
+        user_input = await asyncio.to_thread(input, "\nPergunte: ")
         if user_input.lower() in ["sair", "exit", "quit"]:
             break
-        
-        try:
-            hoje_atualizado = datetime.datetime.now().strftime("%d/%m/%Y")
-            prompt_formatado = SYSTEM_PROMPT_TEXT.replace("{hoje}", hoje_atualizado)
-            messages = [
-                SystemMessage(content=prompt_formatado),
-                HumanMessage(content=user_input)
-            ]
-            
-            inputs = {"messages": messages}
-            
-            # Executa a chamada ao agente dentro de um executor de thread
-            try:
-                # O wait_for corta a execução de verdade se passar do tempo
-                result = await asyncio.wait_for(
-                    agent_executor.ainvoke(inputs), 
-                    timeout=TEMPO_MAXIMO_SEGUNDOS
-                )
-                
-                resposta_final = result["messages"][-1].content
-                print(f"\n📢 Raybot: {resposta_final}")
-                
-            except asyncio.TimeoutError:
-                print(f"\n📢 Raybot: Puxa, essa consulta está demorando mais do que o esperado ({TEMPO_MAXIMO_SEGUNDOS} segundos). Você poderia tentar simplificar a pergunta ou reduzir o período analisado?")
-            
-        except Exception as e:
-            # O ideal é logar o erro 'e' em um arquivo, mas para o usuário mantemos amigável
-            print(f"\n📢 Raybot: Infelizmente, não foi possível responder à pergunta neste momento.")
+        if agente is None:
+            if not preparo.done():
+                print("   ⏳ preparando o agente…", flush=True)
+            agente = await preparo
+
+        # Progresso das tools e tokens da resposta aparecem conforme chegam
+        escrevendo = False
+        async for evento in responder_em_fluxo(agente, user_input, sessao="cli"):
+            if evento["tipo"] == "ferramenta":
+                print(f"{chr(10) if escrevendo else ''}   ⏳ {evento['texto']}", flush=True)
+                escrevendo = False
+            elif evento["tipo"] == "token":
+                if not escrevendo:
+                    print("\n📢 Raybot: ", end="", flush=True)
+                    escrevendo = True
+                print(evento["texto"], end="", flush=True)
+            elif evento["tipo"] == "fim":
+                if evento["resultado"]["erro"]:
+                    print(f"\n📢 Raybot: {evento['resultado']['resposta']}")
+                elif escrevendo:
+                    print()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Raybot: modo interativo (padrão) ou lote de perguntas.")
+    parser.add_argument("--lote", default=None, help="Arquivo .txt (uma pergunta por linha) ou .jsonl (campo 'pergunta')")
+    parser.add_argument("--saida", default="respostas_lote.jsonl", help="JSONL com resposta, rota, tempos e tools de cada pergunta")
+    parser.add_argument("--concorrencia", type=int, default=int(os.getenv("RAYBOT_LOTE_CONCORRENCIA", "4")))
+    parser.add_argument("--tempo-maximo", type=float, default=None, help="Segundos por pergunta (padrão RAYBOT_TEMPO_MAXIMO)")
+    parser.add_argument("--modelo", default=None, choices=sorted(FABRICAS_LLM), help="Modelo do agente (padrão RAYBOT_MODELO)")
+    parser.add_argument("--llm-falso", action="store_true", help="Usa um LLM falso (sem OpenAI) para testes locais (= --modelo falso)")
+    parser.add_argument("--atraso-falso", type=float, default=0.0, help="Atraso em segundos de cada resposta do LLM falso/roteiro")
+    parser.add_argument("--perfil", default=None, metavar="PERGUNTA", help="Responde só esta pergunta sob cProfile e mostra os spans do turno")
+    args = parser.parse_args()
+    if args.perfil:
+        asyncio.run(main_perfil(args))
+    else:
+        asyncio.run(main_lote(args) if args.lote else main(args))
@@ -0,0 +1,175 @@
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import NotRequired
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage, RemoveMessage
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+from langgraph.prebuilt.chat_agent_executor import AgentState
+
+from logs import LOG, campos
+from prompt import contar_tokens
+
+# ====================================================
+# MEMÓRIA DE CONVERSA POR SESSÃO (checkpoint + histórico limitado)
+# ====================================================
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_MEMORIA_MAX_TURNOS (6)             turnos (pergunta + resposta) guardados por sessão
+#   RAYBOT_MEMORIA_ORCAMENTO_TOKENS (6000)    tokens de histórico enviados ao modelo (turno atual sempre vai inteiro)
+#   RAYBOT_MEMORIA_MAX_CARACTERES_TOOL (600)  saída de tool de turnos anteriores é cortada neste tamanho
+#   RAYBOT_MEMORIA_MAX_SESSOES (200)          sessões em memória; acima disso sai a usada há mais tempo
+#   RAYBOT_MEMORIA_OCIOSIDADE (1800)          segundos sem uso até a sessão ser descartada
+
+MAX_TURNOS = int(os.getenv("RAYBOT_MEMORIA_MAX_TURNOS", "6"))
+ORCAMENTO_TOKENS = int(os.getenv("RAYBOT_MEMORIA_ORCAMENTO_TOKENS", "6000"))
+MAX_CARACTERES_TOOL = int(os.getenv("RAYBOT_MEMORIA_MAX_CARACTERES_TOOL", "600"))
+MAX_SESSOES = int(os.getenv("RAYBOT_MEMORIA_MAX_SESSOES", "200"))
+OCIOSIDADE_SEGUNDOS = float(os.getenv("RAYBOT_MEMORIA_OCIOSIDADE", "1800"))
+
+class EstadoRaybot(AgentState):
+    # Prompt do sistema do turno atual: entra na chamada ao modelo, mas não no histórico salvo
+    prompt_sistema: NotRequired[str]
+
+class MemorySaverPodavel(InMemorySaver):
+    """InMemorySaver com prune('keep_latest'): o grafo ReAct não usa DeltaChannel, então basta o último checkpoint."""
+
+    def prune(self, thread_ids, *, strategy="keep_latest"):
+        for thread_id in thread_ids:
+            if strategy == "delete":
+                self.delete_thread(thread_id)
+                continue
+            for ns, checkpoints in list(self.storage.get(thread_id, {}).items()):
+                if len(checkpoints) <= 1:
+                    continue
+                ultimo = max(checkpoints)
+                checkpoint = self.serde.loads_typed(checkpoints[ultimo][0])
+                versoes = checkpoint["channel_versions"]
+                for checkpoint_id in [c for c in checkpoints if c != ultimo]:
+                    del checkpoints[checkpoint_id]
+                    self.writes.pop((thread_id, ns, checkpoint_id), None)
+                for chave in [k for k in self.blobs if k[0] == thread_id and k[1] == ns]:
+                    if versoes.get(chave[2]) != chave[3]:
+                        del self.blobs[chave]
+
+def _turnos(messages):
+    """Agrupa o histórico em turnos, cada um começando numa HumanMessage."""
+    turnos = []
+    for msg in messages:
+        if isinstance(msg, HumanMessage) or not turnos:
+            turnos.append([])
+        turnos[-1].append(msg)
+    return turnos
+
+def _compactar_turno(turno):
+    """
+    Turno já encerrado: corta saídas longas de tools e remove chamadas de tool sem resposta
+    (turno interrompido por tempo esgotado), que a API do modelo rejeitaria.
+    """
+    respondidas = {m.tool_call_id for m in turno if isinstance(m, ToolMessage)}
+    compactado, mudou = [], False
+    for msg in turno:
+        if isinstance(msg, AIMessage) and msg.tool_calls and not all(c["id"] in respondidas for c in msg.tool_calls):
+            mudou = True
+            continue
+        if isinstance(msg, ToolMessage) and isinstance(msg.content, str) and len(msg.content) > MAX_CARACTERES_TOOL:
+            msg = msg.model_copy(update={"content": msg.content[:MAX_CARACTERES_TOOL] + " …[saída resumida]"})
+            mudou = True
+        compactado.append(msg)
+    chamadas_validas = {c["id"] for m in compactado if isinstance(m, AIMessage) for c in m.tool_calls}
+    sem_orfas = [m for m in compactado if not isinstance(m, ToolMessage) or m.tool_call_id in chamadas_validas]
+    return sem_orfas, mudou or len(sem_orfas) != len(compactado)
+
+def _tokens(mensagens):
+    return sum(contar_tokens(m.content if isinstance(m.content, str) else str(m.content)) for m in mensagens)
+
+def compactar_historico(state):
+    """
+    pre_model_hook do agente. No estado salvo ficam só os últimos MAX_TURNOS turnos, com as
+    saídas de tools antigas cortadas. Para o modelo vai o prompt do sistema + os turnos mais
+    recentes que cabem em ORCAMENTO_TOKENS (o turno atual vai sempre inteiro).
+    """
+    turnos = _turnos(state["messages"])
+    atual, anteriores = turnos[-1], turnos[:-1]
+    descartados = max(len(anteriores) - (MAX_TURNOS - 1), 0)
+    anteriores = anteriores[descartados:]
+
+    mudou = descartados > 0
+    compactados = []
+    for turno in anteriores:
+        turno, alterado = _compactar_turno(turno)
+        compactados.append(turno)
+        mudou = mudou or alterado
+
+    # Orçamento: turnos antigos saem primeiro
+    enviados, gasto = [], _tokens(atual)
+    for turno in reversed(compactados):
+        custo = _tokens(turno)
+        if gasto + custo > ORCAMENTO_TOKENS:
+            break
+        enviados.insert(0, turno)
+        gasto += custo
+
+    historico = [m for turno in compactados + [atual] for m in turno]
+    entrada = [m for turno in enviados + [atual] for m in turno]
+    if state.get("prompt_sistema"):
+        entrada = [SystemMessage(content=state["prompt_sistema"])] + entrada
+
+    atualizacao = {"llm_input_messages": entrada}
+    if mudou:
+        atualizacao["messages"] = [RemoveMessage(id=REMOVE_ALL_MESSAGES)] + historico
+    return atualizacao
+
+class MemoriaSessoes:
+    """Checkpointer compartilhado + controle de uso por sessão (LRU e expiração por ociosidade)."""
+
+    def __init__(self, max_sessoes=None, ociosidade_segundos=None):
+        self.checkpointer = MemorySaverPodavel()
+        self.max_sessoes = max_sessoes or MAX_SESSOES
+        self.ociosidade_segundos = ociosidade_segundos or OCIOSIDADE_SEGUNDOS
+        self._ultimo_uso = OrderedDict()
+        self._perguntas = {}
+        self._lock = threading.Lock()
+
+    def config(self, sessao):
+        with self._lock:
+            self._ultimo_uso[sessao] = time.monotonic()
+            self._ultimo_uso.move_to_end(sessao)
+        return {"configurable": {"thread_id": sessao}}
+
+    def registrar_pergunta(self, sessao, pergunta):
+        with self._lock:
+            self._perguntas.setdefault(sessao, deque(maxlen=3)).append(pergunta)
+
+    def perguntas_recentes(self, sessao):
+        with self._lock:
+            return list(self._perguntas.get(sessao, ()))
+
+    def finalizar_turno(self, sessao):
+        """Mantém só o último checkpoint da sessão e aplica os limites de sessões."""
+        self.checkpointer.prune([sessao])
+        self.expirar()
+
+    def encerrar(self, sessao):
+        with self._lock:
+            self._ultimo_uso.pop(sessao, None)
+            self._perguntas.pop(sessao, None)
+        self.checkpointer.delete_thread(sessao)
+
+    def expirar(self):
+        agora = time.monotonic()
+        with self._lock:
+            ociosas = [s for s, t in self._ultimo_uso.items() if agora - t > self.ociosidade_segundos]
+            excedentes = list(self._ultimo_uso)[:max(len(self._ultimo_uso) - len(ociosas) - self.max_sessoes, 0)]
+        for sessao in dict.fromkeys(ociosas + excedentes):
+            self.encerrar(sessao)
+        if ociosas or excedentes:
+            LOG.info("memória: sessões descartadas", extra=campos(ociosas=len(ociosas), excedentes=len(excedentes)))
+
+    def estatisticas(self):
+        with self._lock:
+            sessoes = len(self._ultimo_uso)
+        blobs = list(self.checkpointer.blobs.values())
+        return {"sessoes": sessoes,
+                "checkpoints": sum(len(c) for ns in self.checkpointer.storage.values() for c in ns.values()),
+                "bytes_aprox": sum(len(b[1]) for b in blobs if isinstance(b, tuple) and isinstance(b[1], (bytes, bytearray)))}
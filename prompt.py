@@ -1,4 +1,14 @@
-SYSTEM_PROMPT_TEXT = """
+import re
+import unicodedata
+
+# ====================================================
+# PROMPT DO SISTEMA: núcleo + dicionário de dados por tabela
+# ====================================================
+# SYSTEM_PROMPT_TEXT continua sendo o prompt completo (todas as tabelas).
+# montar_prompt(pergunta, hoje) anexa só os blocos das tabelas que a pergunta
+# provavelmente usa (seletor por palavras-chave, sem embeddings).
+
+PROMPT_INICIO = """
 Você é um analista de dados sênior especializado em análise tabular.
 
 DATA DE HOJE: {hoje}
@@ -15,9 +25,16 @@ DIRETRIZES:
     - Quanto MAIOR, MELHOR: IDF, IMP, KmFalhas, QETG, QETT, Preventivas Liquidadas, IAVLIT, PCV, IOALO.
     - Quanto MENOR, MELHOR: ICMQ (Custo), CDTDM (Pontos), OEMCP (Pendências), OEMPP (Pendências), TO, TOPP, CAIEFO, QVA, QVV, TIC, TIA.
 - ANÁLISE ANUAL / MÊS A MÊS: Se a pergunta for sobre "todos os meses do ano", "valores mensais em 2024", "qual o melhor/pior mês de um ano" ou "valores por mês": USE OBRIGATORIAMENTE A TOOL 'calcular_kpi_por_mes'. NÃO tente chamar ferramentas 12 vezes repetidas e NÃO use SQL para isso.
+- VÁRIOS INDICADORES NO MESMO PERÍODO: Se a pergunta pedir 2 ou mais indicadores para o mesmo período/filtro (ex: "ICMQ, IDF e IMP de março", "resumo dos indicadores"): USE A TOOL 'calcular_painel_kpis' com a lista de siglas, em vez de chamar uma tool por indicador.
+- INDOA POR EMPRESA E MÊS: Se a pergunta pedir o INDOA de várias empresas e/ou de vários meses (ex: "INDOA de todas as empresas em 2024", "relatório de INDOA mês a mês"): USE A TOOL 'calcular_indoa_matriz'. NÃO chame 'calcular_indoa' repetidas vezes.
+- ÔNIBUS FORA DO PADRÃO: Se a pergunta for sobre quais ônibus estão fora do padrão, anômalos, com desempenho atípico ou "o que chama atenção na frota" (ex: "algum ônibus com custo ou quebras fora do normal em 2024?"): USE A TOOL 'analisar_anomalias_frota' (uma chamada cobre a frota inteira). NÃO calcule KPI ônibus a ônibus.
 - Sempre que o usuário perguntar sobre "meta", "objetivo" ou "desempenho vs esperado", consulte o DataFrame correspondente às metas (METAS_INDICADORES).
 2. **Banco de Dados:** Para perguntas gerais, identifique qual ou quais tabelas/colunas deve usar com base no mapeamento abaixo:
-- CTM = Dados financeiro de custo/gasto com manutenções dos ônibus e peças trocadas.
+"""
+
+# Dicionário de dados de cada tabela (texto anexado ao item 2 do prompt)
+BLOCOS_TABELAS = {
+    "CTM": """- CTM = Dados financeiro de custo/gasto com manutenções dos ônibus e peças trocadas.
     - CTM[CodigoEmpresa] (String): Código da empresa proprietária do ônibus.
     - CTM[CodigoContabil] (String): Código contábil - Classificação hierárquica da despesa.
     - CTM[Descricao] (String): Nome da Peça/Serviço. Detalhe do item comprado (ex: "Lona de Freio").
@@ -35,7 +52,8 @@ DIRETRIZES:
     - CTM[OIDDocumento] (String): Código do documento da operação feita.
     - CTM[TipoDocumento] (String): Origem administrativa ou fiscal do movimento.
     - CTM[NomePessoaResposável] (String): Usuário do sistema que gerou o registro.
-- MANT001 = Detalhes sobre a abertura de chamado e sobre o serviço realizado na manutenção.
+""",
+    "MANT001": """- MANT001 = Detalhes sobre a abertura de chamado e sobre o serviço realizado na manutenção.
     - MANT001[Dtemissao] (Data): Data de registro da manutenção do sistema.
     - MANT001[DetalhesServiço] (String): Informações relacionadas ao motivo ou ao local da manutenção/troca. Quando iniciar com “na Garagem”, significa que a manutenção/troca ocorreu na garagem; Quando iniciar com “no Terminal”, significa que a manutenção/troca ocorreu no terminal; Quando iniciar com “no Trajeto”, significa que a manutenção/troca ocorreu no trajeto do ônibus; Quando iniciar com “Quebra”, significa que o motivo da manutenção/troca foi uma quebra.
     - MANT001[OIDDocumento] (String):Identificador interno único da ocorrência.
@@ -56,7 +74,8 @@ DIRETRIZES:
     - MANT001[HoraInicio] (Hora): Horário efetivo de início da ocorrência.
     - MANT001[Ônibus] (String): Identificação do Ônibus que sofreu a ocorrência.
     - MANT001[Motorista] (String): Nome do motorista que opera/dirige os ônibus.
-- MANT002 = Detalhes técnicos da ordem de serviço (OS) do trabalho realizado, como tipo, categoria, classe, defeito/problema corrigido, turno, tempo de duração e colaborador responsável pela manutenção.
+""",
+    "MANT002": """- MANT002 = Detalhes técnicos da ordem de serviço (OS) do trabalho realizado, como tipo, categoria, classe, defeito/problema corrigido, turno, tempo de duração e colaborador responsável pela manutenção.
     - MANT002[Dtemissao] (Data): Data em que a Ordem de Serviço foi emitida no sistema.
     - MANT002[Numero] (String): Número identificador da Ordem de Serviço (OS).
     - MANT002[CodigoEmpresa] (String): Código numérico da empresa ou filial responsável pela execução da manutenção.
@@ -79,7 +98,8 @@ DIRETRIZES:
     - MANT002[Classe] (String): Classe operacional / DEFEITO da manutenção. Representa o defeito que o ônibus deu.
         - Para descobrir a reincidência do defeito do ônibus/equipamento, observe a Classe e a DtManutencao.
     - MANT002[Categoria] (String): Categoria operacional da manutenção (ex: "Borracharia", "Mecânica", "Elétrica"). Use para "Qual categoria foi mais frequente".
-- MANT004 = Detalhes sobre a saída dos ônibus, sua data, turno.
+""",
+    "MANT004": """- MANT004 = Detalhes sobre a saída dos ônibus, sua data, turno.
     - MANT004[CodigoEmpresa] (String): Código da empresa/filial que controla a operação registrada.
     - MANT004[DtSaida] (Data): Data oficial que o ônibus saiu de fato. 
     - MANT004[OIDFcvProgramada] (String): Chave interna que identifica a saída.
@@ -95,7 +115,8 @@ DIRETRIZES:
     - MANT004[Turno] (String): Turno em que a movimentação foi realizada.
     - MANT004[NomeEmpresa] (String): Nome da empresa responsável pelo registro.
     - MANT004[Ônibus] (String): Identificação do Ônibus que saiu.
-- IND003 = Detalhes sobre o ônibus, como KM rodado, linha, centro de custo, ano de fabricação e tempo de vida.
+""",
+    "IND003": """- IND003 = Detalhes sobre o ônibus, como KM rodado, linha, centro de custo, ano de fabricação e tempo de vida.
     - IND003[DtOperacao] (Data): Data em que o registro de quilometragem e operação do Ônibus foi realizado.
     - IND003[CodigoEmpresa] (String): Código da empresa responsável pelo Ônibus.
     - IND003[Estabelecimento] (String): Código do estabelecimento onde o Ônibus está alocado.
@@ -110,7 +131,10 @@ DIRETRIZES:
     - IND003[AnoFabricação] (String): Ano de fabricação do Ônibus.
     - IND003[Meses Rodando] (String): Quantidade de meses que o Ônibus está em operação desde sua fabricação.
     - IND003[NomeEmpresa] (String): Nome da empresa.
-3. **Buscas de Texto (Case Insensitive):** O banco de dados faz distinção entre maiúsculas e minúsculas, e entre singular e plural. Portanto, ao gerar queries SQL para filtrar textos (como Centro de Custo, Descrição, NomeEmpresa, Categoria, etc.), SEMPRE ignore a capitalização e o plural.
+""",
+}
+
+PROMPT_FIM = """3. **Buscas de Texto (Case Insensitive):** O banco de dados faz distinção entre maiúsculas e minúsculas, e entre singular e plural. Portanto, ao gerar queries SQL para filtrar textos (como Centro de Custo, Descrição, NomeEmpresa, Categoria, etc.), SEMPRE ignore a capitalização e o plural.
 - Use a função `LOWER()` em ambos os lados da comparação. E em casos de palavras no plural, no banco ou na pergunta, transforme em singular.
 - Alternativa CORRETA: `WHERE campo LIKE 'valor'`
 - NUNCA use igualdade simples (`=`) direta para strings fornecidas pelo usuário sem tratar a capitalização.
@@ -125,4 +149,74 @@ DIRETRIZES DE ESTILO E FORMATAÇÃO:
 5. **Empatia com os Dados:** Se um KPI estiver ruim ou um dado não for encontrado, explique de forma gentil e sugira o que pode ser verificado em seguida.
 
 IMPORTANTE: Sempre verifique `sql_db_schema` antes de criar queries SQL para não inventar colunas.
-"""
\ No newline at end of file
+"""
+
+SYSTEM_PROMPT_TEXT = PROMPT_INICIO + "".join(BLOCOS_TABELAS.values()) + PROMPT_FIM
+
+# Palavras (prefixos, texto sem acento) que indicam cada tabela
+PALAVRAS_CHAVE_TABELAS = {
+    "CTM": ["custo", "gasto", "gastou", "gastar", "valor gasto", "dinheiro", "reais", "r$", "peca", "despesa",
+            "contab", "estorno", "credito", "historico", "requisic", "financ", "compra", "caro", "cara"],
+    "MANT001": ["ocorrencia", "chamado", "troca", "garagem", "terminal", "trajeto", "quebra", "quebrou",
+                "motorista", "socorro", "incidente", "recolh"],
+    "MANT002": ["ordem de servico", "ordens de servico", "corretiva", "preventiva", "inspec", "mecanic",
+                "tempo gasto", "tempo de manutencao", "categoria", "classe", "defeito", "reincid", "borrachar",
+                "eletric", "servico", "manutenc"],
+    "MANT004": ["saida", "saiu", "sairam", "programad", "viagem", "viagens"],
+    "IND003": ["km", "quilometr", "rodad", "rodou", "linha", "centro de custo", "fabricac", "idade", "frota",
+               "estabelecimento", "meses rodando", "velho", "novo"],
+}
+
+# Siglas respondidas pelas tools de KPI (não precisam do dicionário de dados)
+PADRAO_SIGLAS = re.compile(
+    r"\b(icmq|idf|imp|oemcp|oempp|km ?falhas?|qetg|qett|cdtdm|caiefo|caiemf|qva|qvv|tic|to|topp|tia|pcv|"
+    r"ioalo|iavlit|indoa|preventivas? liquidadas?)\b"
+)
+
+def _normalizar(texto):
+    return unicodedata.normalize("NFKD", texto).encode("ASCII", "ignore").decode("ASCII").lower()
+
+def selecionar_tabelas(pergunta):
+    """
+    Tabelas cujo dicionário deve ir no prompt. Nome da tabela ou palavra-chave na pergunta
+    seleciona a tabela; pergunta só de sigla de KPI não precisa de nenhuma; sem pista
+    nenhuma, vão todas (na dúvida o agente precisa do schema completo).
+    """
+    texto = _normalizar(pergunta)
+    selecionadas = []
+    for tabela, palavras in PALAVRAS_CHAVE_TABELAS.items():
+        if re.search(rf"\b{tabela.lower()}\b", texto) or any(
+                re.search(rf"(?<![a-z0-9]){re.escape(p)}", texto) for p in palavras):
+            selecionadas.append(tabela)
+    # "OS" (ordem de serviço) só em maiúsculas: "os" minúsculo é artigo
+    if re.search(r"\bOSs?\b", pergunta) and "MANT002" not in selecionadas:
+        selecionadas.append("MANT002")
+    if selecionadas or PADRAO_SIGLAS.search(texto):
+        return selecionadas
+    return list(BLOCOS_TABELAS)
+
+def montar_prompt(pergunta, hoje, tabelas=None):
+    """Prompt do sistema com só as tabelas selecionadas (ou as informadas em `tabelas`)."""
+    tabelas = selecionar_tabelas(pergunta) if tabelas is None else tabelas
+    omitidas = [t for t in BLOCOS_TABELAS if t not in tabelas]
+    blocos = "".join(BLOCOS_TABELAS[t] for t in BLOCOS_TABELAS if t in tabelas)
+    if omitidas:
+        blocos += (f"- Dicionário omitido para: {', '.join(omitidas)}. Se precisar delas, consulte "
+                   f"`sql_db_schema` antes de escrever a query.\n")
+    return (PROMPT_INICIO + blocos + PROMPT_FIM).replace("{hoje}", hoje)
+
+# Contagem de tokens: tiktoken é opcional (e pode precisar baixar o vocabulário);
+# sem ele, estimativa de ~4 caracteres por token.
+_CODIFICADOR = None
+
+def contar_tokens(texto):
+    global _CODIFICADOR
+    if _CODIFICADOR is None:
+        try:
+            import tiktoken
+            _CODIFICADOR = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _CODIFICADOR = False
+    if _CODIFICADOR:
+        return len(_CODIFICADOR.encode(texto))
+    return len(texto) // 4
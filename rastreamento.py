@@ -0,0 +1,263 @@
+import os
+import io
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import deque, defaultdict
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ====================================================
+# RASTREAMENTO (spans por turno, ferramenta e etapa interna)
+# ====================================================
+# Cada span guarda nome, duração, turno do agente, span pai e atributos (tabela, linhas de
+# entrada/saída, cache acerto/falta...). O turno e o span pai seguem por contextvars, então as
+# etapas rodando nas threads das tools ficam ligadas ao turno certo mesmo com perguntas em paralelo.
+#
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_RASTRO (1)                ativa os spans (0 = custo zero nas etapas)
+#   RAYBOT_RASTRO_ARQUIVO ()         exporta cada span como uma linha JSON neste arquivo
+#   RAYBOT_RASTRO_MAX (20000)        spans guardados em memória para o resumo p50/p95
+#   RAYBOT_RASTRO_PERFIL_DIR (.)     onde salvar o .prof de turnos perfilados (ver turno(perfil=True))
+
+ATIVO = os.getenv("RAYBOT_RASTRO", "1").strip().lower() in ("1", "true", "sim", "yes")
+ARQUIVO = os.getenv("RAYBOT_RASTRO_ARQUIVO", "")
+MAX_SPANS = int(os.getenv("RAYBOT_RASTRO_MAX", "20000"))
+PERFIL_DIR = os.getenv("RAYBOT_RASTRO_PERFIL_DIR", ".")
+
+_turno = contextvars.ContextVar("raybot_turno", default=None)
+_span_pai = contextvars.ContextVar("raybot_span_pai", default=None)
+_perfil = contextvars.ContextVar("raybot_perfil", default=None)
+_local = threading.local()
+
+SPANS = deque(maxlen=MAX_SPANS)
+_LOCK = threading.Lock()
+_arquivo = None
+
+class Span:
+    __slots__ = ("nome", "id", "pai", "turno", "inicio", "duracao_s", "atributos")
+
+    def __init__(self, nome, atributos):
+        self.nome = nome
+        self.id = uuid.uuid4().hex[:12]
+        self.pai = _span_pai.get()
+        self.turno = _turno.get()
+        self.inicio = time.time()
+        self.duracao_s = None
+        self.atributos = atributos
+
+    def definir(self, **atributos):
+        self.atributos.update(atributos)
+
+    def como_dict(self):
+        return {"turno": self.turno, "id": self.id, "pai": self.pai, "nome": self.nome, "inicio": round(self.inicio, 6),
+                "duracao_ms": round(self.duracao_s * 1000, 3), "thread": threading.current_thread().name, **self.atributos}
+
+class _SpanNulo:
+    def definir(self, **atributos):
+        pass
+
+SPAN_NULO = _SpanNulo()
+
+def _exportar(registro):
+    global _arquivo
+    with _LOCK:
+        SPANS.append(registro)
+        if ARQUIVO:
+            if _arquivo is None:
+                _arquivo = open(ARQUIVO, "a", encoding="utf-8", buffering=1)
+            _arquivo.write(json.dumps(registro, ensure_ascii=False, default=str) + "\n")
+
+class _ColetorPerfil:
+    """Junta os perfis de todas as threads que trabalharam no turno (cProfile é por thread)."""
+
+    def __init__(self):
+        self.stats = None
+        self._lock = threading.Lock()
+
+    def adicionar(self, perfil):
+        with self._lock:
+            if self.stats is None:
+                self.stats = pstats.Stats(perfil)
+            else:
+                self.stats.add(perfil)
+
+@contextlib.contextmanager
+def _perfilar_thread():
+    """Liga o cProfile nesta thread se o turno pediu perfil e ela ainda não está sendo perfilada."""
+    coletor = _perfil.get()
+    if coletor is None or getattr(_local, "perfilando", False):
+        yield
+        return
+    perfil = cProfile.Profile()
+    _local.perfilando = True
+    perfil.enable()
+    try:
+        yield
+    finally:
+        perfil.disable()
+        _local.perfilando = False
+        coletor.adicionar(perfil)
+
+@contextlib.contextmanager
+def span(nome, **atributos):
+    """with span("filtro.periodo", tabela="CTM") as s: ...; s.definir(linhas_saida=n)"""
+    if not ATIVO:
+        yield SPAN_NULO
+        return
+    s = Span(nome, atributos)
+    token = _span_pai.set(s.id)
+    pilha = _local.__dict__.setdefault("pilha", [])
+    pilha.append(s)
+    inicio = time.perf_counter()
+    try:
+        with _perfilar_thread():
+            yield s
+    except Exception as e:
+        s.atributos["erro"] = type(e).__name__
+        raise
+    finally:
+        s.duracao_s = time.perf_counter() - inicio
+        pilha.pop()
+        _span_pai.reset(token)
+        _exportar(s.como_dict())
+
+def anotar(**atributos):
+    """Acrescenta atributos ao span aberto mais interno desta thread (código síncrono, ex.: funções com @rastrear)."""
+    pilha = getattr(_local, "pilha", None)
+    if pilha:
+        pilha[-1].definir(**atributos)
+
+def rastrear(nome, entrada=None):
+    """
+    Decorator: span em volta da função. `entrada(*args, **kwargs)` devolve atributos iniciais;
+    dentro da função, anotar(...) completa o span (linhas de saída, acerto de cache...).
+    """
+    def decorar(func):
+        @functools.wraps(func)
+        def envolvida(*args, **kwargs):
+            if not ATIVO:
+                return func(*args, **kwargs)
+            with span(nome, **(entrada(*args, **kwargs) if entrada else {})):
+                return func(*args, **kwargs)
+        return envolvida
+    return decorar
+
+def registrar(nome, duracao_s, turno=None, **atributos):
+    """Span já medido por fora (ex.: o turno inteiro, medido pelo main.py)."""
+    if not ATIVO:
+        return
+    s = Span(nome, atributos)
+    s.turno = turno or s.turno
+    s.inicio = time.time() - duracao_s
+    s.duracao_s = duracao_s
+    _exportar(s.como_dict())
+
+def envolver_ferramenta(ferramenta):
+    """Cópia da tool (StructuredTool) com um span 'ferramenta' rodando na mesma thread da função."""
+    func = getattr(ferramenta, "func", None)
+    if func is None:
+        return ferramenta
+
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        with span("ferramenta", ferramenta=ferramenta.name):
+            return func(*args, **kwargs)
+    return ferramenta.model_copy(update={"func": envolvida})
+
+@contextlib.contextmanager
+def turno(turno_id=None, perfil=False):
+    """
+    Marca o turno atual (spans abertos dentro dele, inclusive em threads copiadas deste contexto,
+    herdam o id). Com perfil=True junta o cProfile de todas as threads, salva em
+    PERFIL_DIR/turno_<id>.prof e imprime as funções mais caras.
+    """
+    turno_id = turno_id or uuid.uuid4().hex[:12]
+    token = _turno.set(turno_id)
+    coletor = _ColetorPerfil() if perfil else None
+    token_perfil = _perfil.set(coletor)
+    try:
+        if coletor:
+            with _perfilar_thread():
+                yield turno_id
+        else:
+            yield turno_id
+    finally:
+        _perfil.reset(token_perfil)
+        _turno.reset(token)
+        if coletor and coletor.stats:
+            caminho = os.path.join(PERFIL_DIR, f"turno_{turno_id}.prof")
+            coletor.stats.dump_stats(caminho)
+            texto = io.StringIO()
+            coletor.stats.stream = texto
+            coletor.stats.sort_stats("cumulative").print_stats(20)
+            print(texto.getvalue())
+            print(f"💾 Perfil do turno salvo em {caminho} (abra com: python -m pstats {caminho})")
+
+def turno_atual():
+    """Id do turno em andamento neste contexto (None fora de um turno)."""
+    return _turno.get()
+
+def executar_no_turno(turno_id, func, *args, perfil=False):
+    """Para asyncio.to_thread: roda func com o turno marcado na thread."""
+    with turno(turno_id, perfil=perfil):
+        return func(*args)
+
+class RastreadorLLM(BaseCallbackHandler):
+    """Callback: um span 'llm' por chamada ao modelo, com tokens de entrada/saída."""
+    run_inline = True
+
+    def __init__(self):
+        self._inicio = {}
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._inicio[run_id] = (time.perf_counter(), sum(len(m) for m in messages))
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        inicio, mensagens = self._inicio.pop(run_id, (None, 0))
+        if inicio is None:
+            return
+        uso = {}
+        for geracoes in response.generations:
+            for g in geracoes:
+                uso = getattr(getattr(g, "message", None), "usage_metadata", None) or uso
+        registrar("llm", time.perf_counter() - inicio, mensagens=mensagens,
+                  tokens_entrada=uso.get("input_tokens"), tokens_saida=uso.get("output_tokens"))
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        inicio, _ = self._inicio.pop(run_id, (None, 0))
+        if inicio is not None:
+            registrar("llm", time.perf_counter() - inicio, erro=type(error).__name__)
+
+def _percentil(valores, p):
+    return valores[min(int(len(valores) * p), len(valores) - 1)]
+
+def resumo(turno_id=None):
+    """{nome (ou 'ferramenta:<nome>'): {n, p50_ms, p95_ms, max_ms, total_ms}} dos spans em memória."""
+    with _LOCK:
+        registros = [r for r in SPANS if turno_id is None or r["turno"] == turno_id]
+    grupos = defaultdict(list)
+    for r in registros:
+        chave = f"ferramenta:{r['ferramenta']}" if r["nome"] == "ferramenta" else r["nome"]
+        grupos[chave].append(r["duracao_ms"])
+    saida = {}
+    for chave, duracoes in sorted(grupos.items()):
+        duracoes.sort()
+        saida[chave] = {"n": len(duracoes), "p50_ms": round(_percentil(duracoes, 0.5), 2),
+                        "p95_ms": round(_percentil(duracoes, 0.95), 2), "max_ms": round(duracoes[-1], 2),
+                        "total_ms": round(sum(duracoes), 2)}
+    return saida
+
+def imprimir_resumo(turno_id=None):
+    dados = resumo(turno_id)
+    if not dados:
+        return
+    print(f"\n⏱️ Spans{f' do turno {turno_id}' if turno_id else ''} (ms)")
+    print(f"{'etapa':<40}{'n':>6}{'p50':>10}{'p95':>10}{'max':>10}{'total':>12}")
+    for chave, d in sorted(dados.items(), key=lambda kv: -kv[1]["total_ms"]):
+        print(f"{chave:<40}{d['n']:>6}{d['p50_ms']:>10.2f}{d['p95_ms']:>10.2f}{d['max_ms']:>10.2f}{d['total_ms']:>12.2f}")
@@ -0,0 +1,309 @@
+import re
+import sys
+import calendar
+import datetime
+import unicodedata
+
+from tools import Fore, Style, CONFIG_KPI, calcular_kpi_por_mes
+from rastreamento import span
+from logs import LOG, campos
+
+# ====================================================
+# ROTEADOR RÁPIDO (sem LLM) PARA PERGUNTAS SIMPLES DE KPI
+# ====================================================
+# Reconhece perguntas do tipo "<SIGLA> de <mês/ano> [do ônibus X | da empresa Y]"
+# e chama a tool do indicador direto. Qualquer coisa fora do padrão (comparação,
+# meta, ranking, palavra não reconhecida, dois períodos...) devolve None e a
+# pergunta segue para o agente.
+#
+# Uso: python roteador.py                 -> confere o corpus de exemplos (CORPUS_ROTEADOR)
+#      python roteador.py "ICMQ de março"  -> mostra a rota reconhecida
+
+MESES = {
+    "janeiro": 1, "fevereiro": 2, "marco": 3, "abril": 4, "maio": 5, "junho": 6,
+    "julho": 7, "agosto": 8, "setembro": 9, "outubro": 10, "novembro": 11, "dezembro": 12,
+}
+# Abreviações só valem coladas a um ano ("mar/24", "set 2023"): sozinhas são palavras comuns
+MESES_ABREVIADOS = {nome[:3]: num for nome, num in MESES.items()}
+
+# Sinônimos (texto normalizado) -> chave do CONFIG_KPI
+ALIASES_KPI = {k.lower(): k for k in CONFIG_KPI}
+ALIASES_KPI.update({
+    "km falhas": "KMFALHAS", "km falha": "KMFALHAS", "km entre falhas": "KMFALHAS", "km/falha": "KMFALHAS",
+    "preventivas liquidadas": "PREVENTIVAS LIQUIDADAS", "preventiva liquidada": "PREVENTIVAS LIQUIDADAS",
+})
+# Siglas que também são palavras comuns: só contam se escritas em maiúsculas na pergunta
+SIGLAS_AMBIGUAS = {"TO", "TIA", "TIC"}
+
+# Perguntas que pedem raciocínio do agente (comparação, meta, ranking, explicação)
+PADRAO_FORA_DO_ESCOPO = re.compile(
+    r"melhor|pior|compar|evolu|em relacao|versus|\bvs\b|cresc|caiu|subiu|aument|diminu|tendenc|"
+    r"meta|objetivo|ranking|\btop\b|maior|menor|\bquais\b|qual onibus|qual empresa|por onibus|por empresa|"
+    r"cada empresa|todas as empresas|por que|porque|explique|motivo|sql|tabela|\bmedia\b"
+)
+PADRAO_POR_MES = re.compile(r"mes a mes|por mes|mensal(?:mente)?|cada mes|todos os meses")
+
+# Palavras que podem sobrar na pergunta sem mudar o pedido
+PALAVRAS_NEUTRAS = set("""
+qual e o a os as foi de do da dos das em no na nos nas para pra me diga mostre mostra calcule calcula calcular
+informe informa valor valores indicador indicadores quanto ficou esta ta como resultado um uma ao por favor
+kpi kpis durante periodo mes ano ate entre referente relativo geral total oi ola raybot preciso saber gostaria
+queria quero ver dados sobre fale traga trazer e ai poderia pode voce sera
+""".split())
+
+def _normalizar_com_mapa(texto):
+    """Texto minúsculo sem acentos + posição original de cada caractere (para recuperar valores de filtro)."""
+    normal, mapa = [], []
+    for i, c in enumerate(texto):
+        for n in unicodedata.normalize("NFKD", c).encode("ASCII", "ignore").decode("ASCII").lower():
+            normal.append(n)
+            mapa.append(i)
+    return "".join(normal), mapa
+
+def _ultimo_dia(ano, mes):
+    return datetime.date(ano, mes, calendar.monthrange(ano, mes)[1])
+
+def _periodo_mes(ano, mes):
+    return datetime.date(ano, mes, 1), _ultimo_dia(ano, mes)
+
+def _ano(texto_ano):
+    ano = int(texto_ano)
+    return ano + 2000 if ano < 100 else ano
+
+def _extrair_periodos(t, hoje):
+    """Lista de (inicio, fim, (ini_span, fim_span), granularidade) achados no texto normalizado."""
+    achados = []
+    nomes = "|".join(MESES)
+    abrevs = "|".join(MESES_ABREVIADOS)
+
+    def livre(a, b):
+        return all(b <= s or a >= e for _, _, (s, e), _ in achados)
+
+    def add(inicio, fim, m, granularidade):
+        if livre(m.start(), m.end()):
+            achados.append((inicio, fim, (m.start(), m.end()), granularidade))
+
+    # Intervalo de meses: "de janeiro a março de 2024", "entre janeiro e março de 2024".
+    # "e" só liga um intervalo depois de "entre": "janeiro e março" são dois meses soltos
+    for m in re.finditer(rf"\b(?:de |(?P<entre>entre ))?(?P<mes_ini>{nomes})(?:\s*(?:de|/)\s*(?P<ano_ini>\d{{4}}))?"
+                         rf"\s+(?P<ligacao>a|ate|e)\s+(?P<mes_fim>{nomes})(?:\s*(?:de|/)\s*(?P<ano_fim>\d{{4}}))?\b", t):
+        if m["ligacao"] == "e" and not m["entre"]:
+            continue
+        ano_fim = _ano(m["ano_fim"]) if m["ano_fim"] else hoje.year
+        ano_ini = _ano(m["ano_ini"]) if m["ano_ini"] else ano_fim
+        inicio, fim = datetime.date(ano_ini, MESES[m["mes_ini"]], 1), _ultimo_dia(ano_fim, MESES[m["mes_fim"]])
+        if inicio <= fim:
+            add(inicio, fim, m, "intervalo")
+
+    for m in re.finditer(r"\b(\d{1,2})/(\d{1,2})/(\d{4})\b", t):
+        try:
+            dia = datetime.date(int(m.group(3)), int(m.group(2)), int(m.group(1)))
+            add(dia, dia, m, "dia")
+        except ValueError:
+            pass
+    for m in re.finditer(r"\b(\d{4})-(\d{2})-(\d{2})\b", t):
+        try:
+            dia = datetime.date(int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            add(dia, dia, m, "dia")
+        except ValueError:
+            pass
+    for m in re.finditer(r"\b(\d{1,2})/(\d{4})\b", t):
+        if 1 <= int(m.group(1)) <= 12:
+            add(*_periodo_mes(int(m.group(2)), int(m.group(1))), m, "mes")
+
+    for m in re.finditer(rf"\b({nomes})(?:\s*(?:de|/|-)?\s*(\d{{4}}))\b", t):
+        add(*_periodo_mes(int(m.group(2)), MESES[m.group(1)]), m, "mes")
+    for m in re.finditer(rf"\b({abrevs})(?:\s*/\s*(\d{{2}}|\d{{4}})|\s+(\d{{4}}))\b", t):
+        add(*_periodo_mes(_ano(m.group(2) or m.group(3)), MESES_ABREVIADOS[m.group(1)]), m, "mes")
+    for m in re.finditer(rf"\b({nomes})\b", t):
+        # Sem ano: ano atual (mesma regra do SYSTEM_PROMPT_TEXT)
+        add(*_periodo_mes(hoje.year, MESES[m.group(1)]), m, "mes")
+
+    mes_passado = hoje.replace(day=1) - datetime.timedelta(days=1)
+    relativos = [
+        (r"\b(?:mes passado|ultimo mes|mes anterior)\b", _periodo_mes(mes_passado.year, mes_passado.month), "mes"),
+        (r"\b(?:este|esse|neste|nesse) mes\b|\bmes atual\b", _periodo_mes(hoje.year, hoje.month), "mes"),
+        (r"\b(?:ano passado|ultimo ano|ano anterior)\b", (datetime.date(hoje.year - 1, 1, 1), datetime.date(hoje.year - 1, 12, 31)), "ano"),
+        (r"\b(?:este|esse|neste|nesse) ano\b|\bano atual\b", (datetime.date(hoje.year, 1, 1), datetime.date(hoje.year, 12, 31)), "ano"),
+    ]
+    for padrao, (inicio, fim), granularidade in relativos:
+        for m in re.finditer(padrao, t):
+            add(inicio, fim, m, granularidade)
+
+    for m in re.finditer(r"\b(20\d{2})\b", t):
+        ano = int(m.group(1))
+        add(datetime.date(ano, 1, 1), datetime.date(ano, 12, 31), m, "ano")
+    return achados
+
+def _extrair_filtros(t, pergunta, mapa):
+    """Lista de (coluna, valor_original, span). Valor vem da pergunta original (com acentos)."""
+    filtros = []
+    for m in re.finditer(r"\b(?:onibus|carro|veiculo|prefixo)\s+(?:n[o.]?\s*)?([a-z]{0,2}\s?-?\d+)\b", t):
+        valor = pergunta[mapa[m.start(1)]:mapa[m.end(1) - 1] + 1].strip()
+        filtros.append(("onibus", valor, (m.start(), m.end())))
+    fim_nome = r"(?=\s+(?:em|no|na|de|do|da|para|entre|ate|nos|nas)\b|\s*[?.!,]|\s*$)"
+    for m in re.finditer(rf"\bempresa\s+([a-z0-9][a-z0-9 ]*?){fim_nome}", t):
+        valor = pergunta[mapa[m.start(1)]:mapa[m.end(1) - 1] + 1].strip()
+        filtros.append(("empresa", valor, (m.start(), m.end())))
+    return filtros
+
+def _extrair_siglas(t, pergunta):
+    siglas = []
+    for alias in sorted(ALIASES_KPI, key=len, reverse=True):
+        for m in re.finditer(rf"(?<![a-z0-9]){re.escape(alias)}(?![a-z0-9])", t):
+            chave = ALIASES_KPI[alias]
+            if chave in SIGLAS_AMBIGUAS and not re.search(rf"\b{chave}\b", pergunta):
+                continue
+            if any(not (m.end() <= s or m.start() >= e) for _, (s, e) in siglas):
+                continue
+            siglas.append((chave, (m.start(), m.end())))
+    siglas.sort(key=lambda x: x[1][0])
+    return siglas
+
+def rotear(pergunta, hoje=None):
+    """
+    Tenta entender a pergunta sem LLM. Retorna dict com acao ('kpi', 'painel' ou 'por_mes'),
+    indicadores, datas (AAAA-MM-DD), ano e filtro; ou None quando houver qualquer dúvida.
+    """
+    hoje = hoje or datetime.date.today()
+    t, mapa = _normalizar_com_mapa(pergunta)
+
+    if PADRAO_FORA_DO_ESCOPO.search(t):
+        return None
+
+    siglas = _extrair_siglas(t, pergunta)
+    if not siglas:
+        return None
+    indicadores = list(dict.fromkeys(s for s, _ in siglas))
+
+    periodos = _extrair_periodos(t, hoje)
+    filtros = _extrair_filtros(t, pergunta, mapa)
+    por_mes = list(PADRAO_POR_MES.finditer(t))
+    if len(periodos) != 1 or len(filtros) > 1:
+        return None
+
+    # Tudo o que não foi reconhecido precisa ser palavra neutra
+    spans = [sp for _, sp in siglas] + [periodos[0][2]] + [f[2] for f in filtros] + [(m.start(), m.end()) for m in por_mes]
+    resto = "".join(" " if any(s <= i < e for s, e in spans) else c for i, c in enumerate(t))
+    sobra = [p for p in re.split(r"[^a-z0-9]+", resto) if p and p not in PALAVRAS_NEUTRAS]
+    if sobra:
+        return None
+
+    inicio, fim, _, granularidade = periodos[0]
+    rota = {
+        "acao": "kpi" if len(indicadores) == 1 else "painel",
+        "indicadores": indicadores,
+        "data_inicial": inicio.isoformat(),
+        "data_final": fim.isoformat(),
+        "filtro_coluna": filtros[0][0] if filtros else None,
+        "filtro_valor": filtros[0][1] if filtros else None,
+    }
+    if por_mes:
+        if granularidade != "ano" or len(indicadores) != 1:
+            return None
+        rota.update(acao="por_mes", ano=inicio.year, data_inicial=None, data_final=None)
+    return rota
+
+def executar_rota(rota):
+    """Chama a função da tool (sem o wrapper do LangChain) para a rota reconhecida."""
+    filtro = {"filtro_coluna": rota["filtro_coluna"], "filtro_valor": rota["filtro_valor"]}
+    if rota["acao"] == "por_mes":
+        return calcular_kpi_por_mes.func(indicador=rota["indicadores"][0], ano=rota["ano"], **filtro)
+    periodo = {"data_inicial": rota["data_inicial"], "data_final": rota["data_final"]}
+    if rota["acao"] == "painel":
+        from kpi_plano import calcular_painel_kpis
+        return calcular_painel_kpis.func(indicadores=rota["indicadores"], **filtro, **periodo)
+    return CONFIG_KPI[rota["indicadores"][0]]["func"].func(**filtro, **periodo)
+
+def _descrever(rota):
+    if rota["acao"] == "por_mes":
+        periodo = f"ano de {rota['ano']}, mês a mês"
+    else:
+        ini = datetime.date.fromisoformat(rota["data_inicial"]).strftime("%d/%m/%Y")
+        fim = datetime.date.fromisoformat(rota["data_final"]).strftime("%d/%m/%Y")
+        periodo = ini if ini == fim else f"{ini} a {fim}"
+    filtro = f" | {rota['filtro_coluna']}: {rota['filtro_valor']}" if rota["filtro_coluna"] else ""
+    return f"📅 Período: {periodo}{filtro}"
+
+def responder_rapido(pergunta, hoje=None):
+    """Resposta direta da tool quando a rota é reconhecida; None para seguir com o agente (inclusive se a tool der erro)."""
+    rota = rotear(pergunta, hoje)
+    if not rota:
+        return None
+    LOG.info("⚡ rota rápida", extra=campos(acao=rota["acao"], indicadores=rota["indicadores"]))
+    try:
+        with span("rota_rapida", acao=rota["acao"], indicadores=",".join(rota["indicadores"])):
+            resultado = executar_rota(rota)
+    except Exception as e:
+        LOG.warning("rota rápida falhou, seguindo com o agente: %s", e, extra=campos(acao=rota["acao"]))
+        return None
+    if not resultado or str(resultado).startswith("Erro"):
+        return None
+    return f"{_descrever(rota)}\n{resultado}"
+
+# ====================================================
+# Corpus de exemplos (conferido com hoje = 15/06/2025)
+# ====================================================
+HOJE_CORPUS = datetime.date(2025, 6, 15)
+
+def _r(acao, indicadores, ini=None, fim=None, coluna=None, valor=None, ano=None):
+    rota = {"acao": acao, "indicadores": indicadores, "data_inicial": ini, "data_final": fim,
+            "filtro_coluna": coluna, "filtro_valor": valor}
+    if ano:
+        rota["ano"] = ano
+    return rota
+
+CORPUS_ROTEADOR = [
+    ("Qual o ICMQ de março de 2024?", _r("kpi", ["ICMQ"], "2024-03-01", "2024-03-31")),
+    ("icmq março", _r("kpi", ["ICMQ"], "2025-03-01", "2025-03-31")),
+    ("IDF de fevereiro/2024", _r("kpi", ["IDF"], "2024-02-01", "2024-02-29")),
+    ("IMP 11/2023", _r("kpi", ["IMP"], "2023-11-01", "2023-11-30")),
+    ("OEMCP em 2024", _r("kpi", ["OEMCP"], "2024-01-01", "2024-12-31")),
+    ("Qual foi o OEMPP do ônibus B 1010 em janeiro de 2024?", _r("kpi", ["OEMPP"], "2024-01-01", "2024-01-31", "onibus", "B 1010")),
+    ("KmFalhas da empresa Leblon em maio 2024", _r("kpi", ["KMFALHAS"], "2024-05-01", "2024-05-31", "empresa", "Leblon")),
+    ("km entre falhas da empresa São Bento no mês passado", _r("kpi", ["KMFALHAS"], "2025-05-01", "2025-05-31", "empresa", "São Bento")),
+    ("QETG de 15/03/2024", _r("kpi", ["QETG"], "2024-03-15", "2024-03-15")),
+    ("qett set/24", _r("kpi", ["QETT"], "2024-09-01", "2024-09-30")),
+    ("CDTDM este ano", _r("kpi", ["CDTDM"], "2025-01-01", "2025-12-31")),
+    ("Preventivas liquidadas de abril de 2024", _r("kpi", ["PREVENTIVAS LIQUIDADAS"], "2024-04-01", "2024-04-30")),
+    ("Me diga o TO de junho de 2024", _r("kpi", ["TO"], "2024-06-01", "2024-06-30")),
+    ("TOPP de junho de 2024", _r("kpi", ["TOPP"], "2024-06-01", "2024-06-30")),
+    ("INDOA de outubro de 2024 da empresa Leblon", _r("kpi", ["INDOA"], "2024-10-01", "2024-10-31", "empresa", "Leblon")),
+    ("ICMQ, IDF e IMP de março de 2024", _r("painel", ["ICMQ", "IDF", "IMP"], "2024-03-01", "2024-03-31")),
+    ("IAVLIT e PCV de janeiro a março de 2024", _r("painel", ["IAVLIT", "PCV"], "2024-01-01", "2024-03-31")),
+    ("ICMQ entre janeiro e março de 2024", _r("kpi", ["ICMQ"], "2024-01-01", "2024-03-31")),
+    ("ICMQ mês a mês em 2024", _r("por_mes", ["ICMQ"], ano=2024)),
+    ("IDF por mês de 2023 do ônibus 1010", _r("por_mes", ["IDF"], ano=2023, coluna="onibus", valor="1010")),
+    ("QVA ano passado", _r("kpi", ["QVA"], "2024-01-01", "2024-12-31")),
+    ("CAIEFO de 2024-02-10", _r("kpi", ["CAIEFO"], "2024-02-10", "2024-02-10")),
+    # Casos que devem ir para o agente
+    ("O ICMQ melhorou em relação ao mês passado?", None),
+    ("Qual o melhor mês de IDF em 2024?", None),
+    ("Qual ônibus teve o maior ICMQ em março?", None),
+    ("ICMQ de março e de abril de 2024", None),
+    ("ICMQ de janeiro e março de 2024", None),
+    ("ICMQ de março e abril de 2024", None),
+    ("Qual o ICMQ?", None),
+    ("Quantas ordens de serviço corretivas tivemos em março?", None),
+    ("ICMQ de março de 2024 considerando só peças de freio", None),
+    ("Qual a meta de IDF da Leblon em 2024?", None),
+    ("ICMQ do ônibus 1010 da empresa Leblon em 2024", None),
+    ("minha tia foi ao terminal em 2024", None),
+    ("o que foi feito to do em março", None),
+    ("ICMQ por mês de março de 2024", None),
+]
+
+def conferir_corpus(corpus=None, hoje=HOJE_CORPUS):
+    """Retorna a lista de (pergunta, esperado, obtido) que divergem."""
+    return [(p, esperado, obtido) for p, esperado in (corpus or CORPUS_ROTEADOR)
+            if (obtido := rotear(p, hoje)) != esperado]
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        print(rotear(" ".join(sys.argv[1:])))
+        sys.exit(0)
+    falhas = conferir_corpus()
+    for pergunta, esperado, obtido in falhas:
+        print(f"{Fore.RED}❌ {pergunta}\n   esperado: {esperado}\n   obtido:   {obtido}{Style.RESET_ALL}")
+    print(f"Roteador: {len(CORPUS_ROTEADOR) - len(falhas)}/{len(CORPUS_ROTEADOR)} casos do corpus conferem.")
+    sys.exit(1 if falhas else 0)
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import asyncio
+import argparse
+import contextlib
+from urllib.parse import urlsplit
+
+import main as raybot
+import tools as kpi_tools
+import backends
+import rastreamento
+from tools import Fore, Style
+from logs import LOG, campos
+
+# ====================================================
+# SERVIDOR HTTP ASSÍNCRONO (asyncio puro, sem dependências extras)
+# ====================================================
+# Um processo, um cache de tabelas e um grafo do agente para todas as requisições.
+#   POST /perguntar        {"pergunta": "...", "sessao": "..."}  -> {"resposta", "rota", "erro", "duracao_s"}
+#   POST /perguntar/fluxo  {"pergunta": "...", "sessao": "..."}  -> text/event-stream com eventos ferramenta/token/fim
+#   GET  /saude                                                  -> estado da fila, dos caches e da memória
+#   GET  /rastro                                                 -> p50/p95 por etapa e por tool (ver rastreamento.py)
+# "sessao" é opcional: com ela a pergunta continua a conversa anterior (limites em memoria.py).
+# Perguntas da mesma sessão são atendidas uma de cada vez (o turno inteiro usa o mesmo thread do
+# checkpointer e fecha o turno na MEMORIA); as de sessões diferentes seguem em paralelo.
+#
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_SERVIDOR_HOST (127.0.0.1) / RAYBOT_SERVIDOR_PORTA (8080)
+#   RAYBOT_SERVIDOR_CONCORRENCIA (8)   perguntas processadas ao mesmo tempo
+#   RAYBOT_SERVIDOR_FILA (32)          perguntas aguardando vaga; acima disso responde 503
+#   RAYBOT_TEMPO_MAXIMO (45)           segundos por pergunta (ver main.py)
+#
+# Uso: python servidor.py [--llm-falso] [--atraso-falso 0.5] [--sem-aquecer]
+
+MAX_CORPO_BYTES = 64 * 1024
+TEMPO_LEITURA_SEGUNDOS = 10
+# Intervalo da varredura que descarta sessões ociosas
+INTERVALO_EXPIRACAO_SEGUNDOS = 60
+
+STATUS_HTTP = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+               408: "Request Timeout", 413: "Payload Too Large", 503: "Service Unavailable",
+               504: "Gateway Timeout"}
+
+class FilaCheia(Exception):
+    pass
+
+class ServidorRaybot:
+    def __init__(self, agente, concorrencia=None, fila=None, tempo_maximo=None):
+        self.agente = agente
+        self.concorrencia = concorrencia or int(os.getenv("RAYBOT_SERVIDOR_CONCORRENCIA", "8"))
+        self.max_fila = int(os.getenv("RAYBOT_SERVIDOR_FILA", "32")) if fila is None else fila
+        self.tempo_maximo = tempo_maximo or raybot.TEMPO_MAXIMO_SEGUNDOS
+        self.semaforo = asyncio.Semaphore(self.concorrencia)
+        self.em_andamento = 0
+        self.aguardando = 0
+        self.contadores = {"respondidas": 0, "rejeitadas": 0, "tempo_esgotado": 0, "falhas": 0}
+        # sessao -> [asyncio.Lock, turnos usando a trava]; a entrada sai quando ninguém mais a usa
+        self.travas_sessao = {}
+
+    @contextlib.asynccontextmanager
+    async def turno_da_sessao(self, sessao):
+        """Um turno por vez em cada sessão: o segundo pedido da mesma sessão espera o primeiro terminar."""
+        if sessao is None:
+            yield
+            return
+        entrada = self.travas_sessao.setdefault(sessao, [asyncio.Lock(), 0])
+        entrada[1] += 1
+        try:
+            async with entrada[0]:
+                yield
+        finally:
+            entrada[1] -= 1
+            if not entrada[1]:
+                self.travas_sessao.pop(sessao, None)
+
+    @contextlib.asynccontextmanager
+    async def vaga(self):
+        """Ocupa uma das vagas de processamento; com a fila cheia levanta FilaCheia na hora (contrapressão)."""
+        if self.aguardando >= self.max_fila:
+            self.contadores["rejeitadas"] += 1
+            raise FilaCheia()
+        self.aguardando += 1
+        try:
+            await self.semaforo.acquire()
+        finally:
+            self.aguardando -= 1
+        self.em_andamento += 1
+        try:
+            yield
+        finally:
+            self.em_andamento -= 1
+            self.semaforo.release()
+
+    def _contabilizar(self, resultado):
+        if resultado["erro"] == "tempo_esgotado":
+            self.contadores["tempo_esgotado"] += 1
+        elif resultado["erro"]:
+            self.contadores["falhas"] += 1
+        else:
+            self.contadores["respondidas"] += 1
+
+    @staticmethod
+    def _ler_pergunta(corpo):
+        try:
+            dados = json.loads(corpo or b"{}")
+            pergunta = str(dados.get("pergunta", "")).strip()
+            sessao = str(dados.get("sessao") or "").strip()[:128] or None
+        except (ValueError, AttributeError):
+            return None, None, {"erro": "JSON inválido."}
+        if not pergunta:
+            return None, None, {"erro": "Campo 'pergunta' é obrigatório."}
+        return pergunta, sessao, None
+
+    async def tratar_pergunta(self, corpo):
+        pergunta, sessao, erro = self._ler_pergunta(corpo)
+        if erro:
+            return 400, erro
+        try:
+            async with self.turno_da_sessao(sessao), self.vaga():
+                resultado = await raybot.responder(self.agente, pergunta, self.tempo_maximo, sessao)
+        except FilaCheia:
+            return 503, {"erro": "Servidor ocupado, tente novamente em instantes."}
+
+        self._contabilizar(resultado)
+        return (504 if resultado["erro"] == "tempo_esgotado" else 200), resultado
+
+    async def tratar_pergunta_fluxo(self, corpo, writer):
+        """Server-Sent Events: cada evento de responder_em_fluxo vira 'event: <tipo>' + 'data: <json>'."""
+        pergunta, sessao, erro = self._ler_pergunta(corpo)
+        if erro:
+            await self._responder_http(writer, 400, erro)
+            return 400
+        try:
+            async with self.turno_da_sessao(sessao), self.vaga():
+                writer.write(("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream; charset=utf-8\r\n"
+                              "Cache-Control: no-cache\r\nConnection: close\r\n\r\n").encode("latin-1"))
+                fluxo = raybot.responder_em_fluxo(self.agente, pergunta, self.tempo_maximo, sessao)
+                try:
+                    async for evento in fluxo:
+                        if evento["tipo"] == "fim":
+                            self._contabilizar(evento["resultado"])
+                        writer.write(f"event: {evento['tipo']}\ndata: {json.dumps(evento, ensure_ascii=False, default=str)}\n\n".encode("utf-8"))
+                        await writer.drain()
+                finally:
+                    # Cliente desconectou no meio: fecha o gerador, que cancela o agente
+                    await fluxo.aclose()
+        except FilaCheia:
+            await self._responder_http(writer, 503, {"erro": "Servidor ocupado, tente novamente em instantes."}, {"Retry-After": "2"})
+            return 503
+        return 200
+
+    def saude(self):
+        with kpi_tools._CACHE_LOCK:
+            tabelas = {nome: meta.get("linhas") for nome, meta in kpi_tools._CACHE_META.items()}
+        return {"ok": True, "em_andamento": self.em_andamento, "aguardando": self.aguardando,
+                "concorrencia": self.concorrencia, "max_fila": self.max_fila,
+                "contadores": self.contadores, "cache": tabelas, "memoria": raybot.MEMORIA.estatisticas(),
+                "cache_respostas": raybot.CACHE_RESPOSTAS.estatisticas() if raybot.CACHE_RESPOSTAS else None}
+
+    async def expirar_sessoes(self):
+        """Tarefa de fundo: descarta sessões ociosas mesmo sem novas perguntas chegando."""
+        while True:
+            await asyncio.sleep(INTERVALO_EXPIRACAO_SEGUNDOS)
+            raybot.MEMORIA.expirar()
+
+    async def _ler_requisicao(self, reader):
+        linha = await reader.readline()
+        if not linha:
+            return None
+        metodo, alvo, _ = linha.decode("latin-1").split(" ", 2)
+        cabecalhos = {}
+        while True:
+            linha = await reader.readline()
+            if linha in (b"\r\n", b"\n", b""):
+                break
+            nome, _, valor = linha.decode("latin-1").partition(":")
+            cabecalhos[nome.strip().lower()] = valor.strip()
+        tamanho = int(cabecalhos.get("content-length", "0") or 0)
+        if tamanho > MAX_CORPO_BYTES:
+            return metodo, urlsplit(alvo).path, cabecalhos, None
+        corpo = await reader.readexactly(tamanho) if tamanho else b""
+        return metodo, urlsplit(alvo).path, cabecalhos, corpo
+
+    async def _responder_http(self, writer, status, dados, extras=None):
+        corpo = json.dumps(dados, ensure_ascii=False, default=str).encode("utf-8")
+        cabecalhos = [f"HTTP/1.1 {status} {STATUS_HTTP.get(status, '')}",
+                      "Content-Type: application/json; charset=utf-8",
+                      f"Content-Length: {len(corpo)}",
+                      "Connection: close"]
+        cabecalhos += [f"{k}: {v}" for k, v in (extras or {}).items()]
+        writer.write(("\r\n".join(cabecalhos) + "\r\n\r\n").encode("latin-1") + corpo)
+        await writer.drain()
+
+    async def tratar_conexao(self, reader, writer):
+        inicio = time.perf_counter()
+        status, caminho = 500, "?"
+        try:
+            try:
+                requisicao = await asyncio.wait_for(self._ler_requisicao(reader), TEMPO_LEITURA_SEGUNDOS)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                status = 408
+                await self._responder_http(writer, status, {"erro": "Requisição incompleta."})
+                return
+            except ValueError:
+                status = 400
+                await self._responder_http(writer, status, {"erro": "Requisição HTTP inválida."})
+                return
+            if requisicao is None:
+                return
+            metodo, caminho, _, corpo = requisicao
+
+            extras = None
+            if corpo is None:
+                status, dados = 413, {"erro": f"Corpo acima de {MAX_CORPO_BYTES} bytes."}
+            elif caminho == "/perguntar/fluxo":
+                if metodo != "POST":
+                    status, dados = 405, {"erro": "Use POST."}
+                else:
+                    status = await self.tratar_pergunta_fluxo(corpo, writer)
+                    return
+            elif caminho == "/perguntar":
+                if metodo != "POST":
+                    status, dados = 405, {"erro": "Use POST."}
+                else:
+                    status, dados = await self.tratar_pergunta(corpo)
+                    if status == 503:
+                        extras = {"Retry-After": "2"}
+            elif caminho == "/saude" and metodo == "GET":
+                status, dados = 200, self.saude()
+            elif caminho == "/rastro" and metodo == "GET":
+                status, dados = 200, rastreamento.resumo()
+            else:
+                status, dados = 404, {"erro": "Rota não encontrada."}
+            await self._responder_http(writer, status, dados, extras)
+        except (ConnectionResetError, BrokenPipeError):
+            status = 499  # cliente desconectou antes do fim
+        finally:
+            writer.close()
+            LOG.info("🌐 http", extra=campos(caminho=caminho, status=status, duracao_s=round(time.perf_counter() - inicio, 3)))
+
+async def iniciar(host=None, porta=None, agente=None, aquecer=True, **kwargs):
+    """Sobe o servidor (aquecendo o cache de tabelas antes) e devolve (server, ServidorRaybot)."""
+    host = host or os.getenv("RAYBOT_SERVIDOR_HOST", "127.0.0.1")
+    porta = int(porta or os.getenv("RAYBOT_SERVIDOR_PORTA", "8080"))
+    if aquecer:
+        print(f"{Fore.CYAN}🔥 Aquecendo cache de tabelas...{Style.RESET_ALL}")
+        await asyncio.to_thread(backends.aquecer_cache_do_backend)
+    app = ServidorRaybot(agente, **kwargs)
+    app.tarefa_expiracao = asyncio.create_task(app.expirar_sessoes())
+    server = await asyncio.start_server(app.tratar_conexao, host, porta, backlog=app.max_fila + app.concorrencia)
+    print(f"🤖 Raybot servindo em http://{host}:{porta} (concorrência {app.concorrencia}, fila {app.max_fila})")
+    return server, app
+
+async def _principal(args):
+    if args.llm_falso:
+        agente = raybot.construir_agente(llm=raybot.criar_llm("falso", atraso=args.atraso_falso))
+    else:
+        agente = raybot.construir_agente()
+    server, _ = await iniciar(args.host, args.porta, agente, aquecer=not args.sem_aquecer)
+    async with server:
+        await server.serve_forever()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor HTTP do Raybot.")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--porta", type=int, default=None)
+    parser.add_argument("--llm-falso", action="store_true", help="Usa um LLM falso (sem OpenAI) para testes locais")
+    parser.add_argument("--atraso-falso", type=float, default=0.0, help="Atraso em segundos de cada resposta do LLM falso")
+    parser.add_argument("--sem-aquecer", action="store_true", help="Não carrega as tabelas no cache ao iniciar")
+    try:
+        asyncio.run(_principal(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -4,10 +4,20 @@ from langchain.tools import tool
 from typing import Optional
 import unicodedata
 from pydantic import BaseModel, Field
-import traceback
 import re 
+import os
+import time
+import threading
+import functools
+import contextlib
+import contextvars
+from collections import defaultdict, OrderedDict
 from sqlalchemy import create_engine, text
 
+from rastreamento import rastrear, anotar, span
+from turno_ferramentas import no_rascunho
+from logs import LOG, campos
+
 # Configuração de cores para logs
 try:
     from colorama import init as colorama_init, Fore, Style
@@ -37,53 +47,208 @@ def set_db_engine(engine):
 
 _DF_CACHE = {}
 
-def get_df_by_name(partial_name):
+# Marca d'água por tabela: {nome_real: {"max_rowid", "linhas", "verificado_em", "versao"}}
+_CACHE_META = {}
+# _CACHE_LOCK só protege os dois dicionários (nunca fica preso durante um SELECT);
+# a trava de cada tabela serializa a carga/verificação dela sem bloquear as demais
+_CACHE_LOCK = threading.RLock()
+_TRAVAS_TABELA = {}
+
+# Intervalo mínimo (s) entre verificações de dados novos no acesso ao cache (0 = todo acesso)
+INTERVALO_VERIFICACAO_CACHE = float(os.getenv("RAYBOT_INTERVALO_VERIFICACAO_CACHE", "30"))
+
+def resolver_nome_tabela(partial_name):
+    """Retorna o nome real da primeira tabela do SQLite que contém o nome parcial."""
+    with GLOBAL_ENGINE.connect() as conn:
+        query_tables = text("SELECT name FROM sqlite_master WHERE type='table';")
+        result = conn.execute(query_tables)
+        tabelas_existentes = [row[0] for row in result]
+
+    partial_name_lower = partial_name.lower()
+    for tabela in tabelas_existentes:
+        if partial_name_lower in tabela.lower():
+            return tabela
+    return None
+
+def _trava_tabela(nome_tabela_real):
+    with _CACHE_LOCK:
+        return _TRAVAS_TABELA.setdefault(nome_tabela_real, threading.Lock())
+
+def _estado_cache(nome_tabela_real):
+    """(DataFrame, meta) da tabela lidos juntos sob o lock; (None, None) se não está em cache."""
+    with _CACHE_LOCK:
+        return _DF_CACHE.get(nome_tabela_real), _CACHE_META.get(nome_tabela_real)
+
+def _normalizar_tabela_lida(df, nome_tabela_real):
+    """Mesma normalização para carga completa e para as linhas novas (incremental)."""
+    df["__origem"] = nome_tabela_real
+    df.columns = df.columns.str.lower()
+    return df
+
+def _marca_dagua(conn, nome_tabela_real):
+    """(max rowid, nº de linhas) da tabela; max rowid é None em tabelas sem rowid."""
+    try:
+        row = conn.execute(text(f'SELECT max(rowid), count(*) FROM "{nome_tabela_real}"')).fetchone()
+        return row[0], row[1]
+    except Exception:
+        row = conn.execute(text(f'SELECT count(*) FROM "{nome_tabela_real}"')).fetchone()
+        return None, row[0]
+
+@rastrear("tabela.sql", entrada=lambda nome_tabela_real: {"tabela": nome_tabela_real})
+def _carregar_tabela(nome_tabela_real):
+    """SELECT * completo + marca d'água, numa mesma conexão."""
+    with GLOBAL_ENGINE.connect() as conn:
+        max_rowid, linhas = _marca_dagua(conn, nome_tabela_real)
+        df = pd.read_sql_query(text(f'SELECT * FROM "{nome_tabela_real}"'), conn)
+
+    df = _normalizar_tabela_lida(df, nome_tabela_real)
+    with _CACHE_LOCK:
+        meta_anterior = _CACHE_META.get(nome_tabela_real, {})
+        _DF_CACHE[nome_tabela_real] = df
+        _CACHE_META[nome_tabela_real] = {"max_rowid": max_rowid, "linhas": linhas, "verificado_em": time.monotonic(),
+                                         "versao": meta_anterior.get("versao", 0) + 1}
+    anotar(linhas=linhas)
+    return df
+
+def atualizar_tabela_cache(nome_tabela_real, forcar=False):
+    """
+    Confere se a tabela em cache mudou no banco e atualiza só o necessário:
+    - mesmo max(rowid) e nº de linhas: nada a fazer;
+    - só linhas novas (rowid acima da marca d'água e contagem batendo): anexa apenas elas;
+    - qualquer outra mudança (linhas apagadas/regravadas): recarga completa.
+    Atualizações "in place" que não mudam rowid nem contagem não são detectáveis
+    por aqui; nesse caso use invalidar_cache() após o ETL.
+    Só uma thread por tabela carrega/verifica; as outras esperam e reaproveitam o resultado.
+    """
+    df, meta = _estado_cache(nome_tabela_real)
+    if not forcar and meta and df is not None and time.monotonic() - meta["verificado_em"] < INTERVALO_VERIFICACAO_CACHE:
+        return df
+
+    with _trava_tabela(nome_tabela_real):
+        # Confere de novo com a trava: quem esperava pode já ter a tabela carregada/verificada
+        df, meta = _estado_cache(nome_tabela_real)
+        if meta is None or df is None:
+            return _carregar_tabela(nome_tabela_real)
+
+        agora = time.monotonic()
+        if not forcar and agora - meta["verificado_em"] < INTERVALO_VERIFICACAO_CACHE:
+            return df
+
+        with GLOBAL_ENGINE.connect() as conn:
+            max_rowid, linhas = _marca_dagua(conn, nome_tabela_real)
+            # O meta é trocado (nunca alterado no lugar): quem já leu um continua com um retrato consistente
+            with _CACHE_LOCK:
+                if nome_tabela_real in _CACHE_META:
+                    _CACHE_META[nome_tabela_real] = {**meta, "verificado_em": agora}
+            if max_rowid == meta["max_rowid"] and linhas == meta["linhas"]:
+                return df
+
+            novas = None
+            if max_rowid is not None and meta["max_rowid"] is not None and max_rowid > meta["max_rowid"] and linhas > meta["linhas"]:
+                novas = pd.read_sql_query(text(f'SELECT * FROM "{nome_tabela_real}" WHERE rowid > :hwm'),
+                                          conn, params={"hwm": meta["max_rowid"]})
+
+        if novas is None or meta["linhas"] + len(novas) != linhas:
+            LOG.info("cache: tabela alterada (não só anexada), recarga completa", extra=campos(tabela=nome_tabela_real))
+            return _carregar_tabela(nome_tabela_real)
+
+        novas = _normalizar_tabela_lida(novas, nome_tabela_real)
+        df = pd.concat([df, novas], ignore_index=True)
+        with _CACHE_LOCK:
+            _DF_CACHE[nome_tabela_real] = df
+            _CACHE_META[nome_tabela_real] = {**meta, "max_rowid": max_rowid, "linhas": linhas,
+                                             "verificado_em": agora, "versao": meta["versao"] + 1}
+        anotar(cache="incremental", linhas_novas=len(novas))
+        LOG.info("cache: linhas novas anexadas", extra=campos(tabela=nome_tabela_real, linhas_novas=len(novas), linhas=linhas))
+        return df
+
+def atualizar_cache(forcar=True):
+    """Verifica todas as tabelas em cache (usado pelo timer e após cargas do ETL)."""
+    for nome_tabela_real in list(_DF_CACHE):
+        try:
+            atualizar_tabela_cache(nome_tabela_real, forcar=forcar)
+        except Exception as e:
+            LOG.error("falha ao atualizar cache: %s", e, extra=campos(tabela=nome_tabela_real))
+
+def aquecer_cache(tabelas=None):
+    """Carrega no cache as tabelas usadas pelos KPIs (ou as informadas) antes da primeira pergunta."""
+    for nome in tabelas or list(MAPA_DATAS) + ["METAS"]:
+        get_df_by_name(nome, copiar=False)
+
+def invalidar_cache(nome_tabela_real=None):
+    """Descarta o cache (de uma tabela ou de todas); a próxima leitura recarrega do banco."""
+    with _CACHE_LOCK:
+        for nome in ([nome_tabela_real] if nome_tabela_real else list(_DF_CACHE)):
+            _DF_CACHE.pop(nome, None)
+            _CACHE_META.pop(nome, None)
+    # A versão recomeça do 1 na recarga: índices de valores antigos não podem ser reaproveitados
+    with _INDICES_LOCK:
+        for chave in [k for k in _INDICES_VALORES if nome_tabela_real in (None, k[0])]:
+            del _INDICES_VALORES[chave]
+    with _PIVOS_LOCK:
+        _PIVOS_MANUAL.clear()
+
+def iniciar_atualizacao_periodica(intervalo_segundos=60):
+    """Dispara atualizar_cache() em segundo plano a cada intervalo (thread daemon)."""
+    def ciclo():
+        while True:
+            time.sleep(intervalo_segundos)
+            atualizar_cache()
+    thread = threading.Thread(target=ciclo, name="raybot-cache", daemon=True)
+    thread.start()
+    return thread
+
+def versao_tabela(partial_name):
+    """Versão do cache da tabela (muda a cada anexo/recarga); None se não está em cache."""
+    with _CACHE_LOCK:
+        metas = list(_CACHE_META.items())
+    for nome, meta in metas:
+        if partial_name.lower() in nome.lower():
+            return meta["versao"]
+    return None
+
+@rastrear("tabela.obter", entrada=lambda partial_name, copiar=True: {"tabela": partial_name})
+def get_df_by_name(partial_name, copiar=True):
     """
     Busca a tabela com cache para evitar múltiplos SELECT * na mesma sessão.
+    Linhas anexadas pelo ETL entram no cache de forma incremental (ver atualizar_tabela_cache).
+    Use copiar=False apenas em código que NÃO altera o DataFrame retornado.
     """
     global GLOBAL_ENGINE, _DF_CACHE
     if GLOBAL_ENGINE is None:
-        print(f"{Fore.RED}[ERRO] Engine de Banco de Dados não configurada em tools.py{Style.RESET_ALL}")
+        LOG.error("engine de banco de dados não configurada em tools.py")
         return None
 
     partial_name_lower = partial_name.lower()
 
-    # 1. Verifica se já está no cache
-    for cached_name, cached_df in _DF_CACHE.items():
-        if partial_name_lower in cached_name.lower():
-            return cached_df.copy() # Retorna uma cópia para segurança
-
     try:
+        # 1. Verifica se já está no cache (e se chegaram linhas novas no banco)
+        with _CACHE_LOCK:
+            em_cache = list(_DF_CACHE)
+        for cached_name in em_cache:
+            if partial_name_lower in cached_name.lower():
+                try:
+                    df = atualizar_tabela_cache(cached_name)
+                except Exception as e:
+                    LOG.warning("não foi possível verificar novidades: %s", e, extra=campos(tabela=cached_name))
+                    df, _ = _estado_cache(cached_name)
+                    if df is None: break
+                anotar(cache="acerto", linhas=len(df))
+                return df.copy() if copiar else df # Retorna uma cópia para segurança
+
         # 2. Listar tabelas se não estiver no cache
-        with GLOBAL_ENGINE.connect() as conn:
-            query_tables = text("SELECT name FROM sqlite_master WHERE type='table';")
-            result = conn.execute(query_tables)
-            tabelas_existentes = [row[0] for row in result]
-
-        nome_tabela_real = None
-        for tabela in tabelas_existentes:
-            if partial_name_lower in tabela.lower():
-                nome_tabela_real = tabela
-                break
-        
+        nome_tabela_real = resolver_nome_tabela(partial_name)
         if not nome_tabela_real:
             return None
 
-        # 3. Faz o SELECT e Salva no Cache
-        with GLOBAL_ENGINE.connect() as conn:
-            query = text(f'SELECT * FROM "{nome_tabela_real}"')
-            df = pd.read_sql_query(query, conn)
-        
-        df["__origem"] = nome_tabela_real
-        df.columns = df.columns.str.lower()
-        
-        # Armazena no cache global
-        _DF_CACHE[nome_tabela_real] = df
-        
-        return df.copy()
+        # 3. Faz o SELECT e Salva no Cache (leituras simultâneas da mesma tabela esperam uma única carga)
+        df = atualizar_tabela_cache(nome_tabela_real)
+        anotar(cache="falta", linhas=len(df))
+
+        return df.copy() if copiar else df
 
     except Exception as e:
-        print(f"{Fore.RED}[ERRO] Falha ao ler tabela '{partial_name}' do DB: {e}{Style.RESET_ALL}")
+        LOG.error("falha ao ler tabela do banco: %s", e, extra=campos(tabela=partial_name))
         return None
 
 def normalizar_texto(texto):
@@ -91,6 +256,198 @@ def normalizar_texto(texto):
         return str(texto)
     return unicodedata.normalize('NFKD', texto).encode('ASCII', 'ignore').decode('ASCII').lower()
 
+# ====================================================
+# Índice de valores dos filtros (ônibus, empresa...)
+# ====================================================
+# O filtro compara str(valor).strip().lower(); quando nada bate, o valor do usuário é resolvido
+# pelos valores distintos da coluna: "b1151", "B-1151" ou "ônibus 1151" -> "b 1151".
+# O índice é montado uma vez por (tabela, coluna, versão do cache) e só quando o exato falha.
+
+# Palavras que o usuário põe antes do identificador e que não fazem parte do valor
+PALAVRAS_IGNORADAS_FILTRO = {"onibus", "carro", "veiculo", "prefixo", "numero", "no", "n", "empresa", "viacao", "garagem"}
+# Similaridade mínima (Jaccard de trigramas) para aceitar um nome com erro de digitação
+SIMILARIDADE_MINIMA_FILTRO = 0.4
+
+def chave_filtro(valor):
+    """Regra de comparação exata dos filtros (a mesma do raybot_chave no SQL)."""
+    return str(valor).strip().lower()
+
+def _tokens_filtro(valor):
+    return re.findall(r"[a-z0-9]+", normalizar_texto(str(valor)))
+
+def _trigramas(texto):
+    texto = f"  {texto} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+class IndiceValores:
+    """
+    Valores distintos de uma coluna indexados por chaves cada vez mais tolerantes:
+    compacta (sem acento, espaço e pontuação), sem palavras de prefixo, só dígitos e trigramas.
+    Trigramas só valem para nomes: um número que não existe não vira "o mais parecido".
+    resolver(valor) -> (chaves exatas dos valores encontrados, modo) ou ([], None). Quando o número
+    ou o erro de digitação batem com mais de um valor diferente o modo é "ambiguo" e as chaves são
+    os candidatos: quem filtra não deve somá-los como se fossem um só.
+    """
+
+    def __init__(self, valores):
+        self.exatas = set()
+        self.originais = {}
+        self.canonica = {}
+        self.por_compacta = defaultdict(set)
+        self.por_digitos = defaultdict(set)
+        self.por_trigrama = defaultdict(set)
+        for valor in valores:
+            exata = chave_filtro(valor)
+            tokens = _tokens_filtro(valor)
+            if not exata or not tokens:
+                continue
+            self.exatas.add(exata)
+            compacta = "".join(tokens)
+            self.originais.setdefault(exata, str(valor).strip())
+            self.canonica[exata] = compacta
+            self.por_compacta[compacta].add(exata)
+            sem_palavras = "".join(t for t in tokens if t not in PALAVRAS_IGNORADAS_FILTRO)
+            if sem_palavras and sem_palavras != compacta:
+                self.por_compacta[sem_palavras].add(exata)
+            digitos = "".join(re.findall(r"\d+", compacta))
+            if digitos:
+                self.por_digitos[digitos].add(exata)
+            for trigrama in _trigramas(compacta):
+                self.por_trigrama[trigrama].add(compacta)
+
+    def resolver(self, valor):
+        exata = chave_filtro(valor)
+        if exata in self.exatas:
+            return [exata], "exato"
+        tokens = _tokens_filtro(valor)
+        compacta = "".join(tokens)
+        if not compacta:
+            return [], None
+        if compacta in self.por_compacta:
+            return sorted(self.por_compacta[compacta]), "normalizado"
+        sem_palavras = "".join(t for t in tokens if t not in PALAVRAS_IGNORADAS_FILTRO)
+        if sem_palavras in self.por_compacta:
+            return sorted(self.por_compacta[sem_palavras]), "sem_prefixo"
+        if sem_palavras.isdigit() and sem_palavras in self.por_digitos:
+            chaves = sorted(self.por_digitos[sem_palavras])
+            return chaves, ("numero" if len({self.canonica[c] for c in chaves}) == 1 else "ambiguo")
+        if any(c.isdigit() for c in compacta):
+            return [], None
+        alvo_texto = sem_palavras or compacta
+        if len(alvo_texto) >= 4:
+            contidas = [c for c in self.por_compacta if alvo_texto in c]
+            if len(contidas) == 1:
+                return sorted(self.por_compacta[contidas[0]]), "contido"
+
+        # Erro de digitação: valor com mais trigramas em comum (Jaccard); empate entre valores diferentes é ambíguo
+        alvo = _trigramas(alvo_texto)
+        contagem = defaultdict(int)
+        for trigrama in alvo:
+            for candidata in self.por_trigrama.get(trigrama, ()):
+                contagem[candidata] += 1
+        melhor, escolhidas = 0.0, []
+        for candidata, comuns in contagem.items():
+            similaridade = comuns / (len(alvo) + len(_trigramas(candidata)) - comuns)
+            if similaridade > melhor:
+                melhor, escolhidas = similaridade, [candidata]
+            elif similaridade == melhor:
+                escolhidas.append(candidata)
+        if melhor < SIMILARIDADE_MINIMA_FILTRO:
+            return [], None
+        chaves = sorted({e for c in escolhidas for e in self.por_compacta[c]})
+        return chaves, ("aproximado" if len(escolhidas) == 1 else "ambiguo")
+
+    def originais_de(self, chaves):
+        """Valores como estão na coluna (com maiúsculas/acentos) para as chaves exatas."""
+        return [self.originais.get(c, c) for c in chaves]
+
+_INDICES_VALORES = {}
+_INDICES_LOCK = threading.Lock()
+
+def indice_valores(tabela, coluna, versao, carregar_valores):
+    """Índice da coluna em cache por (tabela, coluna, versão); carregar_valores() só roda ao construir."""
+    chave = (tabela, coluna, versao)
+    with _INDICES_LOCK:
+        indice = _INDICES_VALORES.get(chave)
+    if indice is None:
+        with span("filtro.indice", tabela=tabela, coluna=coluna) as s:
+            indice = IndiceValores(carregar_valores())
+            s.definir(valores=len(indice.exatas))
+        with _INDICES_LOCK:
+            for antiga in [k for k in _INDICES_VALORES if k[:2] == chave[:2]]:
+                del _INDICES_VALORES[antiga]
+            _INDICES_VALORES[chave] = indice
+    return indice
+
+def indice_da_coluna(df, coluna):
+    """Índice dos valores da coluna na tabela INTEIRA em cache (df pode ser um recorte dela)."""
+    tabela = df["__origem"].iat[0] if "__origem" in df.columns and len(df) else None
+    base, meta = _estado_cache(tabela)
+    if base is None or meta is None or coluna not in base.columns:
+        return IndiceValores(df[coluna].dropna().unique())
+    return indice_valores(tabela, coluna, meta["versao"], lambda: base[coluna].dropna().unique())
+
+# ====================================================
+# Resoluções de filtro (aviso no texto das tools)
+# ====================================================
+# Quando o valor digitado não existe e o índice de valores resolve para outro ("Lebon" -> "Leblon"),
+# a resposta diz qual valor foi usado; se o valor é ambíguo, a tool responde a ambiguidade em vez
+# de calcular. Quem filtra (pandas e backends) chama registrar_resolucao_filtro e o decorador
+# informar_filtro_resolvido junta as resoluções da chamada da tool.
+
+_RESOLUCOES_FILTRO = contextvars.ContextVar("raybot_resolucoes_filtro", default=None)
+
+def registrar_resolucao_filtro(filtro_valor, coluna, valores, modo):
+    """Guarda a resolução (valores como estão na coluna) para a tool em andamento, se alguma coleta."""
+    resolucoes = _RESOLUCOES_FILTRO.get()
+    if resolucoes is not None:
+        resolucoes.append({"filtro_valor": str(filtro_valor), "coluna": coluna, "valores": tuple(valores), "modo": modo})
+
+@contextlib.contextmanager
+def coletar_resolucoes_filtro():
+    resolucoes = []
+    token = _RESOLUCOES_FILTRO.set(resolucoes)
+    try:
+        yield resolucoes
+    finally:
+        _RESOLUCOES_FILTRO.reset(token)
+
+def no_rascunho_com_filtro(chave, calcular):
+    """no_rascunho() que guarda as resoluções de filtro junto do valor e as registra de novo a cada reuso."""
+    def calcular_coletando():
+        with coletar_resolucoes_filtro() as resolucoes:
+            valor = calcular()
+        return valor, list(resolucoes)
+    valor, resolucoes = no_rascunho(chave, calcular_coletando)
+    for resolucao in resolucoes:
+        registrar_resolucao_filtro(**resolucao)
+    return valor
+
+def informar_filtro_resolvido(func):
+    """
+    Decorador das tools com filtro: acrescenta "(filtro resolvido para '...')" quando o valor digitado
+    foi trocado pelo índice de valores e troca a resposta pelo aviso de ambiguidade quando o valor
+    corresponde a mais de um (nada é calculado com os candidatos somados).
+    """
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        with coletar_resolucoes_filtro() as resolucoes:
+            resposta = func(*args, **kwargs)
+        if not resolucoes or not isinstance(resposta, str):
+            return resposta
+        digitado = resolucoes[0]["filtro_valor"]
+        ambiguas = [r for r in resolucoes if r["modo"] == "ambiguo"]
+        if ambiguas:
+            candidatos = {chave_filtro(v): v for r in ambiguas for v in r["valores"]}
+            LOG.info("🔎 filtro ambíguo", extra=campos(valor=digitado, candidatos=list(candidatos.values())))
+            return (f"⚠️ O filtro '{digitado}' é ambíguo: corresponde a "
+                    f"{', '.join(repr(v) for v in candidatos.values())}. Nenhum valor foi calculado; "
+                    f"pergunte ao usuário qual deles usar.")
+        usados = {chave_filtro(v): v for r in resolucoes for v in r["valores"]}
+        return f"{resposta}\n(filtro resolvido para {', '.join(repr(v) for v in usados.values())}; valor digitado: '{digitado}')"
+    return envolvida
+
+@rastrear("filtro.inteligente", entrada=lambda df, termo_busca, valor_busca: {"coluna": termo_busca, "linhas_entrada": len(df)})
 def aplicar_filtro_inteligente(df, termo_busca, valor_busca):
     termo = normalizar_texto(termo_busca)
     val = str(valor_busca).strip().lower()
@@ -104,16 +461,40 @@ def aplicar_filtro_inteligente(df, termo_busca, valor_busca):
     if not colunas_candidatas:
         return None, None
 
-    print(f"   🔎 Colunas candidatas para '{termo_busca}': {colunas_candidatas}")
+    LOG.debug("🔎 filtro: colunas candidatas", extra=campos(filtro_coluna=termo_busca, candidatas=colunas_candidatas))
 
     for col in colunas_candidatas:
         mask = df[col].astype(str).str.strip().str.lower() == val
         df_temp = df[mask]
         
         if len(df_temp) > 0:
-            print(f"   ✅ Sucesso filtrando por: {col}")
+            LOG.debug("✅ filtro aplicado", extra=campos(filtro_coluna=termo_busca, coluna=col, linhas_antes=len(df), linhas_depois=len(df_temp)))
+            anotar(coluna_usada=col, linhas_saida=len(df_temp))
             return df_temp, col
-            
+
+    # Nenhuma coluna tem o valor exato: tenta resolver pelo índice de valores de cada candidata
+    if val:
+        ambigua = None
+        for col in colunas_candidatas:
+            indice = indice_da_coluna(df, col)
+            chaves, modo = indice.resolver(valor_busca)
+            if not chaves or modo == "exato":
+                continue
+            if modo == "ambiguo":
+                ambigua = ambigua or (col, indice.originais_de(chaves))
+                continue
+            df_temp = df[df[col].astype(str).str.strip().str.lower().isin(chaves)]
+            if len(df_temp) > 0:
+                LOG.info("🔎 filtro resolvido pelo índice de valores", extra=campos(
+                    filtro_coluna=termo_busca, valor=valor_busca, coluna=col, valores=chaves, modo=modo,
+                    linhas_antes=len(df), linhas_depois=len(df_temp)))
+                anotar(coluna_usada=col, valor_resolvido=",".join(chaves), modo=modo, linhas_saida=len(df_temp))
+                registrar_resolucao_filtro(valor_busca, col, indice.originais_de(chaves), modo)
+                return df_temp, col
+        if ambigua:
+            registrar_resolucao_filtro(valor_busca, ambigua[0], ambigua[1], "ambiguo")
+
+    anotar(linhas_saida=0)
     return pd.DataFrame(), None
 
 MAPA_DATAS = {
@@ -125,6 +506,20 @@ MAPA_DATAS = {
     "IND003": "DtOperacao"
 }
 
+@rastrear("datas.converter", entrada=lambda series: {"linhas": len(series)})
+def converter_coluna_data(series):
+    """Converte uma coluna de datas em formatos mistos (ISO ou dd/mm/aaaa) para datetime."""
+    series_raw = series.astype(str).str.strip()
+    datas = pd.to_datetime(series_raw, format='mixed', errors='coerce')
+
+    mask_erro = datas.isna()
+    if mask_erro.sum() > 0:
+        recuperado = pd.to_datetime(series_raw[mask_erro], dayfirst=True, format='mixed', errors='coerce')
+        datas.loc[mask_erro] = recuperado
+        anotar(formato_misto=int(mask_erro.sum()))
+    return datas
+
+@rastrear("filtro.periodo", entrada=lambda df, nome_tabela_referencia, data_ini, data_fim: {"tabela": nome_tabela_referencia, "linhas_entrada": len(df)})
 def aplicar_filtro_periodo(df, nome_tabela_referencia, data_ini, data_fim):
     if not data_ini and not data_fim:
         return df, ""
@@ -137,19 +532,12 @@ def aplicar_filtro_periodo(df, nome_tabela_referencia, data_ini, data_fim):
         col_data_nome = encontrar_coluna_flexivel(df, col_data_nome)
 
     if not col_data_nome:
-        print(f"{Fore.YELLOW}[WARN] Coluna de data não encontrada para {nome_tabela_referencia}.{Style.RESET_ALL}")
+        LOG.warning("coluna de data não encontrada", extra=campos(tabela=nome_tabela_referencia))
         return df, " (⚠️ Data ñ encontrada)"
 
     try:
         df_temp = df.copy()
-        series_raw = df_temp[col_data_nome].astype(str).str.strip()
-        
-        df_temp[col_data_nome] = pd.to_datetime(series_raw, format='mixed', errors='coerce')
-        
-        mask_erro = df_temp[col_data_nome].isna()
-        if mask_erro.sum() > 0:
-            recuperado = pd.to_datetime(series_raw[mask_erro], dayfirst=True, format='mixed', errors='coerce')
-            df_temp.loc[mask_erro, col_data_nome] = recuperado
+        df_temp[col_data_nome] = converter_coluna_data(df_temp[col_data_nome])
 
         df_temp = df_temp.dropna(subset=[col_data_nome])
         mask = pd.Series(True, index=df_temp.index)
@@ -168,7 +556,9 @@ def aplicar_filtro_periodo(df, nome_tabela_referencia, data_ini, data_fim):
         indices_validos = df_temp[mask].index
         df_filtrado = df.loc[indices_validos]
 
-        print(f"   📅 Filtro Data ({col_data_nome}): {len(df)} -> {len(df_filtrado)} registros.")
+        LOG.debug("📅 filtro de data", extra=campos(tabela=nome_tabela_referencia, coluna=col_data_nome, linhas_antes=len(df),
+                                                     linhas_depois=len(df_filtrado), data_ini=data_ini, data_fim=data_fim))
+        anotar(coluna=col_data_nome, linhas_saida=len(df_filtrado))
         
         if len(df_filtrado) == 0:
             return df_filtrado, f" (0 registros em {txt_periodo})"
@@ -176,9 +566,31 @@ def aplicar_filtro_periodo(df, nome_tabela_referencia, data_ini, data_fim):
         return df_filtrado, f" (Ref. Data: {txt_periodo})"
 
     except Exception as e:
-        print(f"{Fore.RED}[ERRO] Crash filtro data: {e}{Style.RESET_ALL}")
+        LOG.exception("falha no filtro de data", extra=campos(tabela=nome_tabela_referencia, coluna=col_data_nome))
         return df, " (Erro Data)"
 
+def recorte_periodo(nome_tabela, data_ini, data_fim):
+    """
+    (df, msg_data) da tabela no período via aplicar_filtro_periodo; df None se a tabela não existe.
+    Calculado uma vez por turno e compartilhado entre as tools dele (turno_ferramentas): somente leitura.
+    """
+    df = get_df_by_name(nome_tabela, copiar=False)
+    if df is None: return None, ""
+    chave = ("periodo", nome_tabela, versao_tabela(nome_tabela), data_ini, data_fim)
+    return no_rascunho(chave, lambda: aplicar_filtro_periodo(df, nome_tabela, data_ini, data_fim))
+
+def recorte_tabela(nome_tabela, data_ini, data_fim, filtro_coluna=None, filtro_valor=None):
+    """Recorte do período com o filtro inteligente (filtro sem coluna correspondente é ignorado). Somente leitura."""
+    df, _ = recorte_periodo(nome_tabela, data_ini, data_fim)
+    if df is None or not (filtro_coluna and filtro_valor): return df
+
+    def filtrar():
+        r, _ = aplicar_filtro_inteligente(df, filtro_coluna, filtro_valor)
+        if r is None: return df
+        return r if len(r) else df.iloc[:0]  # valor inexistente: recorte vazio, mas com as colunas
+    chave = ("filtro", nome_tabela, versao_tabela(nome_tabela), data_ini, data_fim, filtro_coluna, filtro_valor)
+    return no_rascunho_com_filtro(chave, filtrar)
+
 def encontrar_coluna_flexivel(df, termo_busca):
     termo = normalizar_texto(termo_busca)
     mapa_colunas = {normalizar_texto(c): c for c in df.columns}
@@ -198,352 +610,226 @@ class InputCalculoKPI(BaseModel):
     data_final: Optional[str] = Field(default=None, description="Data final (AAAA-MM-DD). Para meses inteiros, use o ÚLTIMO dia do mês (28, 30 ou 31).")
 
 # ====================================================
-# TOOLS EXISTENTES (Mantidas originais, apenas importadas)
+# TOOLS DE KPI (valores do plano compartilhado, ver kpi_plano.py)
 # ====================================================
-# Nota: Estou mantendo suas funções originais exatamente como estavam, 
-# para garantir que o cálculo base não mude.
+# As fórmulas ficam só em kpi_plano.DEFINICOES_KPI/MEDIDAS e rodam no backend escolhido
+# (backends.escolher_backend); aqui cada tool só monta o texto a partir do KPI e das suas medidas.
+# backends.verificar_conformidade confere estes textos contra o plano.
+
+def _kpi_pelo_plano(kpi, filtro_coluna, filtro_valor, data_inicial, data_final):
+    """(valor do KPI ou None, {medida: valor ou None}) pelo plano de um único KPI."""
+    from kpi_plano import calcular_kpis
+
+    valores, medidas = calcular_kpis([kpi], filtro_coluna, filtro_valor, data_inicial, data_final, com_medidas=True)
+    return valores[kpi], medidas
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_icmq(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula o ICMQ (Custo / Km).
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL ICMQ CHAMADA:{Style.RESET_ALL} {data_inicial} a {data_final}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="ICMQ", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df_ctm = get_df_by_name("CTM")
-        df_ind = get_df_by_name("IND003")
-        if df_ctm is None or df_ind is None: return "Erro: Tabelas sumiram."
-
-        df_ctm_filt, _ = aplicar_filtro_periodo(df_ctm, "CTM", data_inicial, data_final)
-        df_ind_filt, _ = aplicar_filtro_periodo(df_ind, "IND003", data_inicial, data_final)
-
-        if df_ctm_filt.empty and df_ind_filt.empty: return "ICMQ: Sem dados."
-
-        if filtro_coluna and filtro_valor:
-            r1, _ = aplicar_filtro_inteligente(df_ctm_filt, filtro_coluna, filtro_valor)
-            if r1 is not None: df_ctm_filt = r1
-            r2, _ = aplicar_filtro_inteligente(df_ind_filt, filtro_coluna, filtro_valor)
-            if r2 is not None: df_ind_filt = r2
-
-        _, col_custo = aplicar_filtro_inteligente(df_ctm_filt, "valorgasto", "")
-        if not col_custo: col_custo = next((c for c in df_ctm_filt.columns if "valorgasto" in normalizar_texto(c)), None)
-        col_km = next((c for c in df_ind_filt.columns if "kmrodado" in normalizar_texto(c)), None)
-
-        if not col_custo or not col_km: return "Erro: Colunas não encontradas."
-
-        custo_total = pd.to_numeric(df_ctm_filt[col_custo], errors='coerce').fillna(0).sum()
-        km_total = pd.to_numeric(df_ind_filt[col_km], errors='coerce').fillna(0).sum()
-
-        if km_total == 0: return f"ICMQ: Indefinido (Km=0). Custo: R$ {custo_total:,.2f}"
-        icmq = custo_total / km_total
+        icmq, m = _kpi_pelo_plano("ICMQ", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["custo"] is None or m["km"] is None: return "Erro: Colunas não encontradas."
+        if m["custo"] == 0 and m["km"] == 0: return "ICMQ: Sem dados."
+        if m["km"] == 0: return f"ICMQ: Indefinido (Km=0). Custo: R$ {m['custo']:,.2f}"
         return f"O ICMQ é R$ {icmq:,.4f}/Km (Lembre-se: Quanto MENOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_idf(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula o IDF (Índice de Falhas).
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL IDF CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="IDF", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df_saidas = get_df_by_name("MANT004")
-        df_trocas = get_df_by_name("MANT001")
-        if not df_saidas is not None: return "Erro dados."
-        
-        df_s, _ = aplicar_filtro_periodo(df_saidas.copy(), "MANT004", data_inicial, data_final)
-        df_t, _ = aplicar_filtro_periodo(df_trocas.copy(), "MANT001", data_inicial, data_final)
-        
-        if filtro_coluna and filtro_valor:
-            r1, _ = aplicar_filtro_inteligente(df_s, filtro_coluna, filtro_valor)
-            if r1 is not None: df_s = r1
-            r2, _ = aplicar_filtro_inteligente(df_t, filtro_coluna, filtro_valor)
-            if r2 is not None: df_t = r2
-
-        col_prog = next((c for c in df_s.columns if "oidfcvprogramada" in normalizar_texto(c)), None)
-        col_doc = next((c for c in df_t.columns if "oiddocumento" in normalizar_texto(c)), None)
-
-        qtd_saidas = df_s[col_prog].nunique() if col_prog else 0
-        qtd_trocas = df_t[col_doc].nunique() if col_doc else 0
-
-        if qtd_saidas == 0: return "IDF: Indefinido (0 Saídas)."
-        idf = (qtd_saidas - qtd_trocas) / qtd_saidas
+        idf, m = _kpi_pelo_plano("IDF", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["saidas"] is None or m["ocorrencias"] is None: return "Erro dados."
+        if m["saidas"] == 0: return "IDF: Indefinido (0 Saídas)."
         return f"O IDF é {idf:.2%} (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_imp(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula o IMP.
     Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL IMP CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="IMP", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df = get_df_by_name("MANT002")
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "MANT002", data_inicial, data_final)
-        if filtro_coluna and filtro_valor:
-            r, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if r is not None: df_filt = r
-
-        col_tipo = next((c for c in df_filt.columns if "tipomanutencao" in normalizar_texto(c)), None)
-        col_id = next((c for c in df_filt.columns if "oiddocumento" in normalizar_texto(c)), None)
-
-        series_tipo = df_filt[col_tipo].astype(str).apply(normalizar_texto)
-        mask_prev = series_tipo.str.contains('preventiva|inspecao', case=False)
-        mask_corr = series_tipo.str.contains('corretiva', case=False)
-        
-        qtd_prev = df_filt[mask_prev][col_id].nunique()
-        qtd_corr = df_filt[mask_corr][col_id].nunique()
-        total = qtd_prev + qtd_corr
-        
-        if total == 0: return "IMP: Indefinido."
-        imp = qtd_prev / total
+        imp, m = _kpi_pelo_plano("IMP", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["os_preventivas"] is None or m["os_corretivas"] is None: return "Erro: Colunas (Tipo/OID) não encontradas."
+        if imp is None: return "IMP: Indefinido."
         return f"O IMP é {imp:.2%} (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_oemcp(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula o OEMCP (Ordens Corretivas Pendentes).
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL OEMCP CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="OEMCP", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
 
     try:
-        df_mant = get_df_by_name("MANT002")
-        if df_mant is None: return "Erro: Tabela MANT002 não encontrada."
-
-        df_filt = df_mant.copy()
-        df_filt, msg_data = aplicar_filtro_periodo(df_filt, "MANT002", data_inicial, data_final)
-
-        if df_filt.empty:
-            return f"OEMCP: Sem dados no período solicitado. {msg_data}"
-
-        if filtro_coluna and filtro_valor:
-            res_filt, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if res_filt is not None: df_filt = res_filt
-
-        col_tipo = next((c for c in df_filt.columns if "tipomanutencao" in normalizar_texto(c)), None)
-        col_id = next((c for c in df_filt.columns if "oiddocumento" in normalizar_texto(c)), None)
-        
-        # Tenta 'situacaodocumento', depois 'status', depois 'situacao' (ignorando datas)
-        col_situacao = next((c for c in df_filt.columns if "situacaodocumento" in normalizar_texto(c)), None)
-        if not col_situacao: col_situacao = next((c for c in df_filt.columns if "status" in normalizar_texto(c)), None)
-        if not col_situacao: 
-             col_situacao = next((c for c in df_filt.columns if "situacao" in normalizar_texto(c) and not any(x in normalizar_texto(c) for x in ['dt', 'hr', 'data'])), None)
-
-        if not col_tipo or not col_situacao or not col_id:
+        qtd_docs, _ = _kpi_pelo_plano("OEMCP", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if qtd_docs is None:
             return "Erro: Colunas essenciais (Tipo/Situação/OID) não encontradas."
-
-        series_tipo = df_filt[col_tipo].astype(str).apply(normalizar_texto)
-        series_situacao = df_filt[col_situacao].astype(str).apply(normalizar_texto)
-
-        mask_corr = series_tipo.str.contains('corretiva', case=False, regex=True)
-        status_alvo = ["aguardando liberacao", "parado", "liberado", "em execucao"]
-        mask_status = series_situacao.apply(lambda x: any(s in x for s in status_alvo))
-
-        df_final = df_filt[mask_corr & mask_status]
-        qtd_docs = df_final[col_id].nunique()
-
-        return f"O OEMCP é {qtd_docs} ordens (Lembre-se: Quanto MENOR, MELHOR.)."
+        return f"O OEMCP é {qtd_docs:.0f} ordens (Lembre-se: Quanto MENOR, MELHOR.)."
 
     except Exception as e:
-        traceback.print_exc()
+        LOG.exception("falha na tool", extra=campos(tool="OEMCP"))
         return f"Erro OEMCP: {str(e)}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_oempp(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula o OEMPP (Preventivas Pendentes).
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL OEMPP CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="OEMPP", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
 
     try:
-        df_mant = get_df_by_name("MANT002")
-        if df_mant is None: return "Erro: Tabela MANT002 não encontrada."
-
-        df_filt = df_mant.copy()
-        df_filt, msg_data = aplicar_filtro_periodo(df_filt, "MANT002", data_inicial, data_final)
-
-        if df_filt.empty:
-            return f"OEMPP: Sem dados no período solicitado. {msg_data}"
-
-        if filtro_coluna and filtro_valor:
-            res_filt, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if res_filt is not None: df_filt = res_filt
-
-        col_tipo = next((c for c in df_filt.columns if "tipomanutencao" in normalizar_texto(c)), None)
-        col_id = next((c for c in df_filt.columns if "oiddocumento" in normalizar_texto(c)), None)
-        
-        col_situacao = next((c for c in df_filt.columns if "situacaodocumento" in normalizar_texto(c)), None)
-        if not col_situacao: col_situacao = next((c for c in df_filt.columns if "status" in normalizar_texto(c)), None)
-        if not col_situacao: 
-             col_situacao = next((c for c in df_filt.columns if "situacao" in normalizar_texto(c) and not any(x in normalizar_texto(c) for x in ['dt', 'hr', 'data'])), None)
-
-        if not col_tipo or not col_situacao or not col_id:
+        qtd_docs, _ = _kpi_pelo_plano("OEMPP", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if qtd_docs is None:
             return "Erro: Colunas essenciais não encontradas."
-
-        series_tipo = df_filt[col_tipo].astype(str).apply(normalizar_texto)
-        series_situacao = df_filt[col_situacao].astype(str).apply(normalizar_texto)
-
-        mask_prev = series_tipo.str.contains('preventiva|inspecao', case=False, regex=True)
-        status_alvo = ["aguardando liberacao", "parado", "liberado", "em execucao"]
-        mask_status = series_situacao.apply(lambda x: any(s in x for s in status_alvo))
-
-        df_final = df_filt[mask_prev & mask_status]
-        qtd_docs = df_final[col_id].nunique()
-
-        return f"O OEMPP é {qtd_docs} ordens (Lembre-se: Quanto MENOR, MELHOR.)."
+        return f"O OEMPP é {qtd_docs:.0f} ordens (Lembre-se: Quanto MENOR, MELHOR.)."
 
     except Exception as e:
-        traceback.print_exc()
+        LOG.exception("falha na tool", extra=campos(tool="OEMPP"))
         return f"Erro OEMPP: {str(e)}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_preventivas_liquidadas(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula Preventivas Liquidadas.
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL PREV. LIQUIDADAS CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="PREVENTIVAS_LIQUIDADAS", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
 
     try:
-        df_mant = get_df_by_name("MANT002")
-        if df_mant is None: return "Erro: Tabela MANT002 não encontrada."
-
-        df_filt = df_mant.copy()
-        df_filt, msg_data = aplicar_filtro_periodo(df_filt, "MANT002", data_inicial, data_final)
-
-        if df_filt.empty:
-            return f"Quantidade de Preventivas Liquidadas: 0 (Sem dados). {msg_data}"
-
-        if filtro_coluna and filtro_valor:
-            res_filt, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if res_filt is not None: df_filt = res_filt
-
-        col_tipo = next((c for c in df_filt.columns if "tipomanutencao" in normalizar_texto(c)), None)
-        col_id = next((c for c in df_filt.columns if "oiddocumento" in normalizar_texto(c)), None)
-        
-        col_situacao = next((c for c in df_filt.columns if "situacaodocumento" in normalizar_texto(c)), None)
-        if not col_situacao: col_situacao = next((c for c in df_filt.columns if "status" in normalizar_texto(c)), None)
-        if not col_situacao: 
-             col_situacao = next((c for c in df_filt.columns if "situacao" in normalizar_texto(c) and not any(x in normalizar_texto(c) for x in ['dt', 'hr', 'data'])), None)
-
-        if not col_tipo or not col_situacao or not col_id:
+        qtd_docs, _ = _kpi_pelo_plano("PREVENTIVAS LIQUIDADAS", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if qtd_docs is None:
             return "Erro: Colunas essenciais não encontradas."
-
-        series_tipo = df_filt[col_tipo].astype(str).apply(normalizar_texto)
-        series_situacao = df_filt[col_situacao].astype(str).apply(normalizar_texto)
-
-        mask_prev = series_tipo.str.contains('preventiva|inspecao', case=False, regex=True)
-        mask_status = series_situacao.str.contains('liquidado', case=False, regex=True)
-
-        df_final = df_filt[mask_prev & mask_status]
-        qtd_docs = df_final[col_id].nunique()
-
-        return f"Quantidade de Preventivas Liquidadas: {qtd_docs} ordens (Lembre-se: Quanto MAIOR, MELHOR.)."
+        return f"Quantidade de Preventivas Liquidadas: {qtd_docs:.0f} ordens (Lembre-se: Quanto MAIOR, MELHOR.)."
 
     except Exception as e:
-        traceback.print_exc()
+        LOG.exception("falha na tool", extra=campos(tool="PREVENTIVAS_LIQUIDADAS"))
         return f"Erro Prev. Liquidadas: {str(e)}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_km_falhas(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula KmFalhas.
     Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL KMFALHAS CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="KMFALHAS", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df_km = get_df_by_name("IND003")
-        df_oco = get_df_by_name("MANT001")
-        
-        df_k, _ = aplicar_filtro_periodo(df_km.copy(), "IND003", data_inicial, data_final)
-        df_o, _ = aplicar_filtro_periodo(df_oco.copy(), "MANT001", data_inicial, data_final)
-
-        if filtro_coluna and filtro_valor:
-            r1, _ = aplicar_filtro_inteligente(df_k, filtro_coluna, filtro_valor)
-            if r1 is not None: df_k = r1
-            r2, _ = aplicar_filtro_inteligente(df_o, filtro_coluna, filtro_valor)
-            if r2 is not None: df_o = r2
-
-        col_km = next((c for c in df_k.columns if "kmrodado" in normalizar_texto(c)), None)
-        col_tipo = next((c for c in df_o.columns if any(x in normalizar_texto(c) for x in ["detalhesservico", "tipo"])), None)
-
-        total_km = pd.to_numeric(df_k[col_km], errors='coerce').fillna(0).sum()
-        qtd_quebras = df_o[col_tipo].astype(str).apply(normalizar_texto).str.contains('quebra').sum()
-
-        if qtd_quebras == 0: return f"KmFalhas: Indefinido (0 quebras). Km: {total_km}"
-        res = total_km / qtd_quebras
+        res, m = _kpi_pelo_plano("KMFALHAS", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["km"] is None or m["quebras"] is None: return "Erro: Colunas não encontradas."
+        if m["quebras"] == 0: return f"KmFalhas: Indefinido (0 quebras). Km: {m['km']:,.2f}"
         return f"O KmFalhas é {res:,.2f} Km/Quebra (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_qetg(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula QETG.
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL QETG CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="QETG", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df_km = get_df_by_name("IND003")
-        df_man = get_df_by_name("MANT001")
-        
-        df_k, _ = aplicar_filtro_periodo(df_km.copy(), "IND003", data_inicial, data_final)
-        df_m, _ = aplicar_filtro_periodo(df_man.copy(), "MANT001", data_inicial, data_final)
-
-        if filtro_coluna and filtro_valor:
-            r1, _ = aplicar_filtro_inteligente(df_k, filtro_coluna, filtro_valor)
-            if r1 is not None: df_k = r1
-            r2, _ = aplicar_filtro_inteligente(df_m, filtro_coluna, filtro_valor)
-            if r2 is not None: df_m = r2
-            
-        col_km = next((c for c in df_k.columns if "kmrodado" in normalizar_texto(c)), None)
-        col_tipo = next((c for c in df_m.columns if any(x in normalizar_texto(c) for x in ["detalhesservico", "tipo"])), None)
-        col_id = next((c for c in df_m.columns if "oiddocumento" in normalizar_texto(c)), None)
-
-        total_km = pd.to_numeric(df_k[col_km], errors='coerce').fillna(0).sum()
-        mask = df_m[col_tipo].astype(str).apply(normalizar_texto).str.contains('garagem')
-        qtd = df_m[mask][col_id].nunique()
-
-        if qtd == 0: return f"QETG: Indefinido. Km: {total_km}"
-        res = total_km / qtd
+        res, m = _kpi_pelo_plano("QETG", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["km"] is None or m["trocas_garagem"] is None: return "Erro: Colunas não encontradas."
+        if m["trocas_garagem"] == 0: return f"QETG: Indefinido. Km: {m['km']:,.2f}"
         return f"O QETG é {res:,.2f} Km/Troca (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_qett(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula QETT.
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
-    print(f"\n{Fore.CYAN}🛠️ TOOL QETT CHAMADA:{Style.RESET_ALL}")
+    LOG.info("🛠️ tool chamada", extra=campos(tool="QETT", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
     try:
-        df_km = get_df_by_name("IND003")
-        df_man = get_df_by_name("MANT001")
-        
-        df_k, _ = aplicar_filtro_periodo(df_km.copy(), "IND003", data_inicial, data_final)
-        df_m, _ = aplicar_filtro_periodo(df_man.copy(), "MANT001", data_inicial, data_final)
-
-        if filtro_coluna and filtro_valor:
-            r1, _ = aplicar_filtro_inteligente(df_k, filtro_coluna, filtro_valor)
-            if r1 is not None: df_k = r1
-            r2, _ = aplicar_filtro_inteligente(df_m, filtro_coluna, filtro_valor)
-            if r2 is not None: df_m = r2
-            
-        col_km = next((c for c in df_k.columns if "kmrodado" in normalizar_texto(c)), None)
-        col_tipo = next((c for c in df_m.columns if any(x in normalizar_texto(c) for x in ["detalhesservico", "tipo"])), None)
-        col_id = next((c for c in df_m.columns if "oiddocumento" in normalizar_texto(c)), None)
-
-        total_km = pd.to_numeric(df_k[col_km], errors='coerce').fillna(0).sum()
-        mask = df_m[col_tipo].astype(str).apply(normalizar_texto).str.contains('terminal')
-        qtd = df_m[mask][col_id].nunique()
-
-        if qtd == 0: return f"QETT: Indefinido. Km: {total_km}"
-        res = total_km / qtd
+        res, m = _kpi_pelo_plano("QETT", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if m["km"] is None or m["trocas_terminal"] is None: return "Erro: Colunas não encontradas."
+        if m["trocas_terminal"] == 0: return f"QETT: Indefinido. Km: {m['km']:,.2f}"
         return f"O QETT é {res:,.2f} Km/Troca (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
-def _calcular_indicador_prefixo(nome, prefixo, chars, f_col, f_val, d_ini, d_fim):
-    """Função interna auxiliar para índices manuais."""
+# ====================================================
+# Pivô de siglas do INDMANTMANUAL (CDTDM, índices acumulados, IAVLIT, PCV, IOALO)
+# ====================================================
+# Um único groupby por (Símbolo, início da Descrição) soma o Valor do período/filtro; sem agrupamento,
+# o backend pandas lê daqui a célula de cada medida do INDMANTMANUAL (backends._celula_pivo), então as
+# tools dessas siglas compartilham um só pivô. Colunas do pivô = regra de casamento da sigla:
+#   simbolo               Símbolo exato (CDTDM)
+#   descricao             prefixo da Descrição com o nº de caracteres da sigla (índices acumulados)
+#   simbolo_ou_descricao  qualquer um dos dois, linha contada uma vez (IAVLIT, PCV, IOALO)
+
+# Sigla -> nº de caracteres comparados no início da Descrição
+SIGLAS_MANUAL = {"CDTDML": 6, "CAIEFO": 6, "CAIEMF": 6, "QVA": 3, "QVV": 3, "TIC": 3, "TIA": 3, "TO": 2, "TOPP": 4}
+REGRAS_PIVO = ("simbolo", "descricao", "simbolo_ou_descricao")
+MAX_PIVOS_MANUAL = 64
+
+_PIVOS_MANUAL = OrderedDict()
+_PIVOS_LOCK = threading.Lock()
+
+def _montar_pivo_manual(df):
+    """DataFrame sigla x regra (NaN na regra cuja coluna não existe); None sem a coluna Valor."""
+    col_v = next((c for c in df.columns if "valor" in normalizar_texto(c)), None)
+    if not col_v: return None
+    col_s = next((c for c in df.columns if "simbolo" in normalizar_texto(c)), None)
+    col_d = next((c for c in df.columns if "descricao" in normalizar_texto(c)), None)
+
+    vazio = pd.Series("", index=df.index)
+    simbolo = df[col_s].astype(str).str.strip().str.upper() if col_s else vazio
+    inicio = df[col_d].astype(str).str.strip().str.upper().str.slice(0, max(SIGLAS_MANUAL.values())) if col_d else vazio
+    # dropna=False: Símbolo/Descrição nulos não casam com sigla nenhuma, mas não podem sumir da soma
+    grade = pd.to_numeric(df[col_v], errors='coerce').fillna(0).groupby([simbolo.rename("s"), inicio.rename("d")], dropna=False).sum()
+
+    simbolos = pd.Series(grade.index.get_level_values("s"), dtype=object)
+    inicios = pd.Series(grade.index.get_level_values("d"), dtype=object)
+    valores = grade.to_numpy()
+    linhas = {}
+    for sigla, chars in SIGLAS_MANUAL.items():
+        por_simbolo = (simbolos == sigla).to_numpy() if col_s else None
+        por_descricao = (inicios.str.slice(0, chars) == sigla).fillna(False).to_numpy(dtype=bool) if col_d else None
+        if por_simbolo is None and por_descricao is None:
+            qualquer = None
+        else:
+            qualquer = (por_simbolo if por_simbolo is not None else False) | (por_descricao if por_descricao is not None else False)
+        linhas[sigla] = [valores[m].sum() if m is not None else float("nan") for m in (por_simbolo, por_descricao, qualquer)]
+    return pd.DataFrame.from_dict(linhas, orient="index", columns=list(REGRAS_PIVO))
+
+@rastrear("pivo.manual", entrada=lambda filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None: {
+    "filtro_coluna": filtro_coluna, "data_inicial": data_inicial, "data_final": data_final})
+def pivo_siglas_manual(filtro_coluna=None, filtro_valor=None, data_inicial=None, data_final=None):
+    """
+    Soma de Valor do INDMANTMANUAL por sigla (SIGLAS_MANUAL) e regra (REGRAS_PIVO) no período e filtro,
+    em cache por (período, filtro, versão da tabela). None se a tabela ou a coluna Valor não existem.
+    Mesmo período (fim inclui o dia inteiro) e filtro inteligente das tools.
+    """
+    if get_df_by_name("INDMANTMANUAL", copiar=False) is None: return None
+    chave = (data_inicial, data_final, filtro_coluna, filtro_valor, versao_tabela("INDMANTMANUAL"))
+    with _PIVOS_LOCK:
+        if chave in _PIVOS_MANUAL:
+            _PIVOS_MANUAL.move_to_end(chave)
+            anotar(cache="acerto")
+            return _PIVOS_MANUAL[chave]
+
+    # Tools do mesmo turno pedindo o mesmo pivô ao mesmo tempo esperam um único groupby
+    pivo = no_rascunho(("pivo",) + chave, lambda: _montar_pivo_manual(
+        recorte_tabela("INDMANTMANUAL", data_inicial, data_final, filtro_coluna, filtro_valor)))
+    anotar(cache="falta")
+
+    with _PIVOS_LOCK:
+        _PIVOS_MANUAL[chave] = pivo
+        while len(_PIVOS_MANUAL) > MAX_PIVOS_MANUAL:
+            _PIVOS_MANUAL.popitem(last=False)
+    return pivo
+
+def _calcular_indicador_prefixo(nome, f_col, f_val, d_ini, d_fim):
+    """Função interna auxiliar para índices manuais (prefixo da Descrição, ver SIGLAS_MANUAL)."""
     try:
-        df = get_df_by_name("INDMANTMANUAL")
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "INDMANTMANUAL", d_ini, d_fim)
-        if f_col and f_val:
-            r, _ = aplicar_filtro_inteligente(df_filt, f_col, f_val)
-            if r is not None: df_filt = r
-        
-        col_valor = next((c for c in df_filt.columns if "valor" in normalizar_texto(c)), None)
-        col_desc = next((c for c in df_filt.columns if "descricao" in normalizar_texto(c)), None)
-        
-        if not col_valor or not col_desc: return "Erro colunas."
-        
-        mask = df_filt[col_desc].astype(str).str.strip().str.upper().str.slice(0, chars) == prefixo.upper()
-        total = pd.to_numeric(df_filt[mask][col_valor], errors='coerce').fillna(0).sum()
+        total, _ = _kpi_pelo_plano(nome, f_col, f_val, d_ini, d_fim)
+        if total is None: return "Erro colunas."
 
         if nome == "TO":
             return f"Índice acumulado {nome}: {total:,.2f} pontos (Lembre-se: Quanto MENOR, MELHOR.)."
@@ -555,19 +841,13 @@ def _calcular_indicador_prefixo(nome, prefixo, chars, f_col, f_val, d_ini, d_fim
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_cdtdm(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
     """Calcula CDTDM (MANTMANUAL 'CDTDML').
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
     try:
-        df = get_df_by_name("INDMANTMANUAL")
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "INDMANTMANUAL", data_inicial, data_final)
-        if filtro_coluna and filtro_valor:
-            r, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if r is not None: df_filt = r
-        col_v = next((c for c in df_filt.columns if "valor" in normalizar_texto(c)), None)
-        col_s = next((c for c in df_filt.columns if "simbolo" in normalizar_texto(c)), None)
-        mask = df_filt[col_s].astype(str).str.upper().str.strip() == "CDTDML"
-        total = pd.to_numeric(df_filt[mask][col_v], errors='coerce').fillna(0).sum()
+        total, _ = _kpi_pelo_plano("CDTDM", filtro_coluna, filtro_valor, data_inicial, data_final)
+        if total is None: return "Erro: Colunas Valor/Símbolo não encontradas."
         return f"A Pontuação Total do CDTDM é {total:,.2f} pontos (Lembre-se: Quanto MENOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
@@ -578,221 +858,277 @@ def calcular_cdtdm(filtro_coluna: Optional[str] = None, filtro_valor: Optional[s
 
 # Tools wrappers para prefixos
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_caiefo(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador CAIEFO (Vistorias de Limpeza/Manutenção)."""
-    return _calcular_indicador_prefixo("CAIEFO", "CAIEFO", 6, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("CAIEFO", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_qva(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador QVA (Quantidade de Veículos Aprovados)."""
-    return _calcular_indicador_prefixo("QVA", "QVA", 3, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("QVA", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_qvv(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador QVV (Quantidade de Veículos Vistoriados)."""
-    return _calcular_indicador_prefixo("QVV", "QVV", 3, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("QVV", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_tic(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador TIC (Total de Itens Conformes/Corretos).
     NÃO APLIQUE FILTROS QUE NÃO SÃO SOLICITADOS NA PERGUNTA"""
-    return _calcular_indicador_prefixo("TIC", "TIC", 3, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("TIC", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_to(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador TO (Total de Ocorrências/Observações).
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
-    return _calcular_indicador_prefixo("TO", "TO", 2, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("TO", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_topp(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador TOPP (Total de Ocorrências Ponderadas/Prioritárias).
     IMPORTANTE: Quanto MENOR o valor, MELHOR o resultado. Quanto MAIOR o valor, PIOR o resultado"""
-    return _calcular_indicador_prefixo("TOPP", "TOPP", 4, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("TOPP", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_tia(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula o indicador TIA (Total de Itens Avaliados)."""
-    return _calcular_indicador_prefixo("TIA", "TIA", 3, filtro_coluna, filtro_valor, data_inicial, data_final)
+    return _calcular_indicador_prefixo("TIA", filtro_coluna, filtro_valor, data_inicial, data_final)
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_iavlit(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula IAVLIT (QVA/QVV).
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
     try:
-        df = get_df_by_name("INDMANTMANUAL")
-        # 1. Filtros
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "INDMANTMANUAL", data_inicial, data_final)
-        if filtro_coluna and filtro_valor:
-            r, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if r is not None: df_filt = r
-            
-        # 2. Identifica Colunas
-        col_v = next((c for c in df_filt.columns if "valor" in normalizar_texto(c)), None)
-        col_s = next((c for c in df_filt.columns if "simbolo" in normalizar_texto(c)), None)
-        col_d = next((c for c in df_filt.columns if "descricao" in normalizar_texto(c)), None)
-        
-        if not col_v: return "Erro: Coluna Valor não encontrada."
-
-        # 3. Função Auxiliar de Busca (Olha Símbolo OU Descrição)
-        def calcular_soma(sigla, chars):
-            mask = pd.Series(False, index=df_filt.index)
-            # Tenta pelo Símbolo (exato)
-            if col_s:
-                mask |= (df_filt[col_s].astype(str).str.strip().str.upper() == sigla)
-            # Tenta pela Descrição (prefixo)
-            if col_d:
-                mask |= (df_filt[col_d].astype(str).str.strip().str.upper().str.slice(0, chars) == sigla)
-            return pd.to_numeric(df_filt[mask][col_v], errors='coerce').fillna(0).sum()
-
-        # 4. Cálculos
-        val_qva = calcular_soma("QVA", 3)
-        val_qvv = calcular_soma("QVV", 3)
-        
-        print(f"   DEBUG IAVLIT -> QVA: {val_qva} | QVV: {val_qvv}")
+        # QVA/QVV pelo Símbolo (exato) OU pela Descrição (prefixo)
+        res, m = _kpi_pelo_plano("IAVLIT", filtro_coluna, filtro_valor, data_inicial, data_final)
+        val_qva, val_qvv = m["qva"], m["qvv"]
+        if val_qva is None or val_qvv is None: return "Erro: Colunas Valor/Símbolo/Descrição não encontradas."
+
+        LOG.debug("IAVLIT: parciais", extra=campos(qva=val_qva, qvv=val_qvv))
 
         if val_qva == 0 and val_qvv == 0: return "O IAVLIT é 1.00 (QVA e QVV zerados)."
-        if val_qvv == 0: return f"IAVLIT: Indefinido (QVA: {val_qva})."
-        
-        res = val_qva / val_qvv
+        if val_qvv == 0: return f"IAVLIT: Indefinido (QVA: {val_qva:.0f})."
         return f"O IAVLIT é {res:,.4f} (QVA: {val_qva:,.0f} / QVV: {val_qvv:,.0f}) (Lembre-se: Quanto MAIOR, MELHOR.)."
 
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_pcv(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula PCV (TIC / 66% TIA).
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
     try:
-        df = get_df_by_name("INDMANTMANUAL")
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "INDMANTMANUAL", data_inicial, data_final)
-        if filtro_coluna and filtro_valor:
-            r, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if r is not None: df_filt = r
-            
-        col_v = next((c for c in df_filt.columns if "valor" in normalizar_texto(c)), None)
-        col_s = next((c for c in df_filt.columns if "simbolo" in normalizar_texto(c)), None)
-        col_d = next((c for c in df_filt.columns if "descricao" in normalizar_texto(c)), None)
-
-        def calcular_soma(sigla, chars):
-            mask = pd.Series(False, index=df_filt.index)
-            if col_s: mask |= (df_filt[col_s].astype(str).str.strip().str.upper() == sigla)
-            if col_d: mask |= (df_filt[col_d].astype(str).str.strip().str.upper().str.slice(0, chars) == sigla)
-            return pd.to_numeric(df_filt[mask][col_v], errors='coerce').fillna(0).sum()
-        
-        val_tic = calcular_soma("TIC", 3)
-        val_tia = calcular_soma("TIA", 3)
-        
+        res, m = _kpi_pelo_plano("PCV", filtro_coluna, filtro_valor, data_inicial, data_final)
+        val_tic, val_tia = m["tic"], m["tia"]
+        if val_tic is None or val_tia is None: return "Erro: Colunas Valor/Símbolo/Descrição não encontradas."
+
         target = val_tia * 0.66
         if target == 0: return "PCV: 100.00% (Base TIA zero)."
-        res = min(val_tic / target, 1.0)
-        return f"O PCV é {res:.2%} (TIC: {val_tic} / Meta: {target:.1f}) (Lembre-se: Quanto MAIOR, MELHOR.)."
+        return f"O PCV é {res:.2%} (TIC: {val_tic:.0f} / Meta: {target:.1f}) (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
 @tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
 def calcular_ioalo(filtro_coluna: Optional[str]=None, filtro_valor: Optional[str]=None, data_inicial: Optional[str]=None, data_final: Optional[str]=None) -> str:
     """Calcula IOALO (CAIEMF / CAIEFO).
     IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado. Quanto MENOR o valor, PIOR o resultado"""
     try:
-        df = get_df_by_name("INDMANTMANUAL")
-        df_filt, _ = aplicar_filtro_periodo(df.copy(), "INDMANTMANUAL", data_inicial, data_final)
-        if filtro_coluna and filtro_valor:
-            r, _ = aplicar_filtro_inteligente(df_filt, filtro_coluna, filtro_valor)
-            if r is not None: df_filt = r
-            
-        col_v = next((c for c in df_filt.columns if "valor" in normalizar_texto(c)), None)
-        col_s = next((c for c in df_filt.columns if "simbolo" in normalizar_texto(c)), None)
-        col_d = next((c for c in df_filt.columns if "descricao" in normalizar_texto(c)), None)
-        
-        def calcular_soma(sigla, chars):
-            mask = pd.Series(False, index=df_filt.index)
-            if col_s: mask |= (df_filt[col_s].astype(str).str.strip().str.upper() == sigla)
-            if col_d: mask |= (df_filt[col_d].astype(str).str.strip().str.upper().str.slice(0, chars) == sigla)
-            return pd.to_numeric(df_filt[mask][col_v], errors='coerce').fillna(0).sum()
-        
-        val_aprov = calcular_soma("CAIEMF", 6)
-        val_vist = calcular_soma("CAIEFO", 6)
-        
+        res, m = _kpi_pelo_plano("IOALO", filtro_coluna, filtro_valor, data_inicial, data_final)
+        val_aprov, val_vist = m["caiemf"], m["caiefo"]
+        if val_aprov is None or val_vist is None: return "Erro: Colunas Valor/Símbolo/Descrição não encontradas."
+
         if val_vist == 0: return "IOALO: Indefinido."
-        res = val_aprov / val_vist
-        return f"O IOALO é {res:.2%} ({val_aprov} / {val_vist}) (Lembre-se: Quanto MAIOR, MELHOR.)."
+        return f"O IOALO é {res:.2%} ({val_aprov:.0f} / {val_vist:.0f}) (Lembre-se: Quanto MAIOR, MELHOR.)."
     except Exception as e: return f"Erro: {e}"
 
-@tool(args_schema=InputCalculoKPI)
-def calcular_indoa(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
-    """
-    Calcula o INDOA: Média simples de 6 indicadores (OEMCP, OEMPP, CDTDM, QETT, QETG, IAVLIT).
-    Atribui 100 pontos se o indicador atingir a meta ou 0 se falhar.
-    IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado.
-    """
-    print(f"\n{Fore.MAGENTA}🛠️ TOOL INDOA CHAMADA{Style.RESET_ALL}")
-    
-    # Lista de indicadores e lógica (True se 'Quanto Menor Melhor', False se 'Quanto Maior Melhor')
-    indicadores_indoa = {
-        "OEMCP": True, 
-        "OEMPP": True, 
-        "CDTDM": True, 
-        "QETT": False, 
-        "QETG": False, 
-        "IAVLIT": False
-    }
-    
-    # Mapeamento de funções
-    funcs = {
-        "OEMCP": calcular_oemcp.func,
-        "OEMPP": calcular_oempp.func,
-        "CDTDM": calcular_cdtdm.func,
-        "QETT": calcular_qett.func,
-        "QETG": calcular_qetg.func,
-        "IAVLIT": calcular_iavlit.func
-    }
+# ====================================================
+#  INDOA (via plano compartilhado de KPIs, ver kpi_plano.py)
+# ====================================================
+
+# Componentes do INDOA (True se 'Quanto Menor Melhor', False se 'Quanto Maior Melhor')
+INDICADORES_INDOA = {
+    "OEMCP": True,
+    "OEMPP": True,
+    "CDTDM": True,
+    "QETT": False,
+    "QETG": False,
+    "IAVLIT": False
+}
 
+MESES_ABREV = {1: "Jan", 2: "Fev", 3: "Mar", 4: "Abr", 5: "Mai", 6: "Jun",
+               7: "Jul", 8: "Ago", 9: "Set", 10: "Out", 11: "Nov", 12: "Dez"}
+
+def normalizar_serie(series):
+    """Aplica normalizar_texto apenas sobre os valores distintos da coluna (muito mais rápido que .apply)."""
+    series_str = series.astype(str)
+    if series_str.empty:
+        return series_str  # map() de uma série vazia devolve float e quebra o .str de quem usa
+    mapa = {v: normalizar_texto(v) for v in series_str.unique()}
+    return series_str.map(mapa)
+
+def encontrar_coluna_empresa(df):
+    """Prefere a coluna com o NOME da empresa; cai para qualquer coluna de 'empresa'."""
+    colunas = [c for c in df.columns if "empresa" in normalizar_texto(c)]
+    nome = next((c for c in colunas if "nome" in normalizar_texto(c)), None)
+    return nome or (colunas[0] if colunas else None)
+
+def _carregar_metas_mensais(ano):
+    """Lê a tabela de metas uma única vez e devolve as metas indexadas por (empresa, mês)."""
+    df_metas = get_df_by_name("METAS_INDICADORES")
+    if df_metas is None: return None
+
+    datas = pd.to_datetime(df_metas['data'], errors='coerce')
+    df_m = df_metas[datas.dt.year == ano].copy()
+    df_m["__empresa"] = df_m['empresa'].astype(str).str.strip().str.lower()
+    df_m["__mes"] = datas[datas.dt.year == ano].dt.month.astype(int)
+
+    metas = pd.DataFrame(index=pd.MultiIndex.from_frame(df_m[["__empresa", "__mes"]]))
+    for kpi in INDICADORES_INDOA:
+        col = encontrar_coluna_flexivel(df_m, kpi)
+        valores = df_m[col].apply(lambda v: extrair_valor_numerico(str(v))) if col else None
+        metas[kpi] = valores.values if valores is not None else None
+    metas.index.names = ["empresa", "mes"]
+    return metas[~metas.index.duplicated(keep="first")]
+
+def calcular_indoa_valores(componentes, filtro_coluna, filtro_valor, data_inicial):
+    """Pontua os componentes já calculados contra as metas e monta o texto do INDOA."""
     # Determinar a empresa para buscar a meta (padrão 'Leblon' se não informado)
     empresa_meta = "Leblon"
-    if filtro_coluna and "empresa" in filtro_coluna.lower():
+    if filtro_coluna and "empresa" in filtro_coluna.lower() and filtro_valor:
         empresa_meta = filtro_valor
-    
+
     # Data de referência para meta (usa data_inicial ou hoje)
-    dt_ref = data_inicial if data_inicial else datetime.datetime.now().strftime("%Y-%m-%d")
+    dt_ref = pd.to_datetime(data_inicial if data_inicial else datetime.datetime.now().strftime("%Y-%m-%d"))
+    metas = _carregar_metas_mensais(dt_ref.year)
+    chave = (empresa_meta.strip().lower(), dt_ref.month)
+    metas_mes = metas.loc[chave] if metas is not None and chave in metas.index else None
 
     pontos_totais = 0
     detalhes = []
 
-    for kpi, menor_melhor in indicadores_indoa.items():
-        try:
-            # 1. Calcula Valor Atual
-            res_txt = funcs[kpi](filtro_coluna=filtro_coluna, filtro_valor=filtro_valor, data_inicial=data_inicial, data_final=data_final)
-            valor = extrair_valor_numerico(res_txt)
-            
-            # 2. Busca Meta
-            meta_txt = consultar_meta_indicador.func(indicador=kpi, empresa=empresa_meta, data_referencia=dt_ref)
-            meta = extrair_valor_numerico(meta_txt)
-            
-            if valor is not None and meta is not None:
-                # 3. Lógica de Pontuação
-                atingiu = False
-                if menor_melhor:
-                    atingiu = (valor <= meta)
-                else:
-                    atingiu = (valor >= meta)
-                
-                ponto = 100 if atingiu else 0
-                pontos_totais += ponto
-                status = "✅" if atingiu else "❌"
-                detalhes.append(f"{kpi}: {valor:,.2f} (Meta: {meta:,.2f}) {status}")
-            else:
-                detalhes.append(f"{kpi}: Dados ou Meta ausentes ⚠️")
-                
-        except Exception as e:
-            detalhes.append(f"{kpi}: Erro no cálculo")
+    for kpi, menor_melhor in INDICADORES_INDOA.items():
+        valor = componentes.get(kpi)
+        meta = metas_mes[kpi] if metas_mes is not None else None
+
+        if valor is not None and meta is not None and not pd.isna(meta):
+            atingiu = (valor <= meta) if menor_melhor else (valor >= meta)
+            ponto = 100 if atingiu else 0
+            pontos_totais += ponto
+            status = "✅" if atingiu else "❌"
+            detalhes.append(f"{kpi}: {valor:,.2f} (Meta: {meta:,.2f}) {status}")
+        else:
+            detalhes.append(f"{kpi}: Dados ou Meta ausentes ⚠️")
 
-    resultado_final = pontos_totais / 6
+    resultado_final = pontos_totais / len(INDICADORES_INDOA)
     msg_detalhes = "\n   ".join(detalhes)
-    
+
     return (f"O INDOA é {resultado_final:,.2f} pontos.\n"
             f"Composição:\n   {msg_detalhes}\n"
             f"(Cálculo: Soma de pontos / 6. Máximo 100. Quanto MAIOR, MELHOR.)")
 
+@tool(args_schema=InputCalculoKPI)
+@informar_filtro_resolvido
+def calcular_indoa(filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None, data_inicial: Optional[str] = None, data_final: Optional[str] = None) -> str:
+    """
+    Calcula o INDOA: Média simples de 6 indicadores (OEMCP, OEMPP, CDTDM, QETT, QETG, IAVLIT).
+    Atribui 100 pontos se o indicador atingir a meta ou 0 se falhar.
+    IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado.
+    """
+    LOG.info("🛠️ tool chamada", extra=campos(tool="INDOA", data_inicial=data_inicial, data_final=data_final, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
+    try:
+        from kpi_plano import calcular_kpis
+
+        # Um único plano: MANT002, MANT001, IND003 e INDMANTMANUAL lidos/filtrados uma vez
+        componentes = calcular_kpis(list(INDICADORES_INDOA), filtro_coluna, filtro_valor, data_inicial, data_final)
+        return calcular_indoa_valores(componentes, filtro_coluna, filtro_valor, data_inicial)
+    except Exception as e:
+        LOG.exception("falha na tool", extra=campos(tool="INDOA"))
+        return f"Erro INDOA: {str(e)}"
+
+def calcular_indoa_matriz_df(ano, empresa=None):
+    """
+    Calcula os 6 componentes do INDOA para TODAS as empresas e meses do ano num único
+    plano agrupado por (empresa, mês) e junta as metas num único merge.
+    Retorna um DataFrame indexado por (empresa, mês) com valor, meta e atingimento de cada
+    componente, além da pontuação INDOA.
+    """
+    from kpi_plano import calcular_kpis
+
+    filtro_coluna, filtro_valor = ("empresa", empresa) if empresa else (None, None)
+    valores = calcular_kpis(list(INDICADORES_INDOA), filtro_coluna, filtro_valor,
+                            f"{ano}-01-01", f"{ano}-12-31", agrupar_por=("empresa", "mes"))
+    if valores.empty:
+        return pd.DataFrame()
+
+    valores.index = pd.MultiIndex.from_arrays(
+        [valores.index.get_level_values(0), valores.index.get_level_values(1).month],
+        names=["empresa", "mes"])
+
+    # Junta as metas num único merge por (empresa, mês)
+    metas = _carregar_metas_mensais(ano)
+    if metas is None:
+        metas = pd.DataFrame(index=valores.index, columns=list(INDICADORES_INDOA), dtype=float)
+    matriz = valores.join(metas.add_prefix("meta_"), how="left")
+
+    pontos = pd.Series(0, index=matriz.index)
+    for kpi, menor_melhor in INDICADORES_INDOA.items():
+        valor, meta = matriz[kpi], pd.to_numeric(matriz[f"meta_{kpi}"], errors='coerce')
+        atingiu = (valor <= meta) if menor_melhor else (valor >= meta)
+        # None = dados ou meta ausentes (não pontua, mas continua na média de 6)
+        matriz[f"ok_{kpi}"] = atingiu.where(valor.notna() & meta.notna())
+        pontos += atingiu.fillna(False).astype(int) * 100
+
+    matriz["INDOA"] = pontos / len(INDICADORES_INDOA)
+    return matriz
+
+class InputIndoaMatriz(BaseModel):
+    ano: int = Field(..., description="Ano para análise (ex: 2024)")
+    empresa: Optional[str] = Field(default=None, description="Empresa específica (ex: 'Leblon'). Deixe vazio para TODAS as empresas.")
+
+@tool(args_schema=InputIndoaMatriz)
+def calcular_indoa_matriz(ano: int, empresa: Optional[str] = None) -> str:
+    """
+    Calcula o INDOA de TODAS as empresas para TODOS os meses de um ano de uma só vez,
+    com o detalhamento de cada componente (OEMCP, OEMPP, CDTDM, QETT, QETG, IAVLIT) vs meta.
+    Use esta tool para relatórios gerenciais de INDOA por empresa e mês (não chame calcular_indoa várias vezes).
+    IMPORTANTE: Quanto MAIOR o valor, MELHOR o resultado.
+    """
+    LOG.info("🛠️ tool chamada", extra=campos(tool="INDOA_MATRIZ", ano=ano, empresa=empresa))
+    try:
+        matriz = calcular_indoa_matriz_df(ano, empresa)
+        if matriz.empty and empresa:
+            return f"Empresa '{empresa}' não encontrada nos dados de {ano} (valor do filtro inexistente)."
+        if matriz.empty:
+            return f"Não foram encontrados dados para calcular o INDOA em {ano}."
+
+        linhas = [f"📊 INDOA por empresa e mês em {ano}:"]
+        for emp, df_emp in matriz.groupby(level="empresa"):
+            linhas.append(f"\n🏢 {emp.title()} (média anual: {df_emp['INDOA'].mean():,.2f} pontos)")
+            for (_, mes), row in df_emp.iterrows():
+                partes = []
+                for kpi in INDICADORES_INDOA:
+                    ok = row[f"ok_{kpi}"]
+                    if pd.isna(ok):
+                        partes.append(f"{kpi} ⚠️")
+                    else:
+                        partes.append(f"{kpi} {row[kpi]:,.2f}/{row[f'meta_{kpi}']:,.2f} {'✅' if ok else '❌'}")
+                linhas.append(f"• {MESES_ABREV[mes]}: {row['INDOA']:,.2f} pts | " + " | ".join(partes))
+
+        linhas.append("\n(Formato: valor/meta. Cálculo: Soma de pontos / 6. Máximo 100. Quanto MAIOR, MELHOR.)")
+        return "\n".join(linhas)
+    except Exception as e:
+        LOG.exception("falha na tool", extra=campos(tool="INDOA_MATRIZ"))
+        return f"Erro INDOA Matriz: {str(e)}"
+
 # ====================================================
 #  NOVA LÓGICA DE COMPARAÇÃO / EVOLUÇÃO
 # ====================================================
@@ -858,6 +1194,22 @@ def extrair_valor_numerico(texto: str) -> Optional[float]:
             
     return float(valor_str)
 
+def _kpis_do_indicador(nome_kpi):
+    """KPIs do plano por trás de um indicador do CONFIG_KPI (o INDOA é calculado dos seus 6 componentes)."""
+    return list(INDICADORES_INDOA) if nome_kpi == "INDOA" else [nome_kpi]
+
+def _valor_do_indicador(nome_kpi, valores, filtro_coluna, filtro_valor, data_inicial):
+    """
+    Valor numérico do indicador a partir de {KPI: valor ou None} do plano (None se indefinido),
+    na mesma escala e arredondamento do texto da tool (ex: IDF em %, ICMQ com 4 casas).
+    """
+    if nome_kpi == "INDOA":
+        return extrair_valor_numerico(calcular_indoa_valores(valores, filtro_coluna, filtro_valor, data_inicial))
+    from kpi_plano import formatar_kpi
+
+    valor = valores.get(nome_kpi)
+    return None if valor is None else extrair_valor_numerico(formatar_kpi(nome_kpi, valor))
+
 class InputAnaliseEvolucao(BaseModel):
     indicador: str = Field(..., description="Nome exato do indicador (ex: 'ICMQ', 'IDF', 'KmFalhas')")
     filtro_coluna: Optional[str] = Field(default=None, description="Coluna de filtro (ex: 'onibus')")
@@ -868,6 +1220,7 @@ class InputAnaliseEvolucao(BaseModel):
     data_anterior_fim: str = Field(..., description="Data Fim Periodo Anterior (AAAA-MM-DD)")
 
 @tool(args_schema=InputAnaliseEvolucao)
+@informar_filtro_resolvido
 def analisar_evolucao_kpi(indicador: str, data_atual_ini: str, data_atual_fim: str, data_anterior_ini: str, data_anterior_fim: str, filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None) -> str:
     """
     Compara o valor de um indicador entre dois períodos e diz se MELHOROU ou PIOROU.
@@ -887,32 +1240,28 @@ def analisar_evolucao_kpi(indicador: str, data_atual_ini: str, data_atual_fim: s
     if not config:
         return f"Erro: Indicador '{indicador}' não configurado para análise de evolução."
     
-    tool_objeto = config["func"]
-    
-    # Isso evita o erro 'StructuredTool object is not callable'
-    funcao_python_real = tool_objeto.func 
-    
     direcao_melhor = config["melhor"] # MAX ou MIN
     
-    print(f"\n{Fore.MAGENTA}📈 ANALISANDO EVOLUÇÃO [{nome_kpi}]{Style.RESET_ALL}")
-    print(f"   Periodo 1 (Anterior): {data_anterior_ini} a {data_anterior_fim}")
-    print(f"   Periodo 2 (Atual):    {data_atual_ini} a {data_atual_fim}")
+    LOG.info("📈 analisando evolução", extra=campos(tool="EVOLUCAO", indicador=nome_kpi, anterior=f"{data_anterior_ini}..{data_anterior_fim}",
+                                                    atual=f"{data_atual_ini}..{data_atual_fim}", filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
 
     try:
-        # 1. Calcula Período Anterior (Usando .func)
-        res_ant_txt = funcao_python_real(filtro_coluna=filtro_coluna, filtro_valor=filtro_valor, data_inicial=data_anterior_ini, data_final=data_anterior_fim)
-        val_ant = extrair_valor_numerico(res_ant_txt)
-        
-        # 2. Calcula Período Atual (Usando .func)
-        res_atual_txt = funcao_python_real(filtro_coluna=filtro_coluna, filtro_valor=filtro_valor, data_inicial=data_atual_ini, data_final=data_atual_fim)
-        val_atual = extrair_valor_numerico(res_atual_txt)
+        from kpi_plano import calcular_kpis
+
+        # Valores direto do plano (sem passar pelo texto das tools)
+        kpis = _kpis_do_indicador(nome_kpi)
+        val_ant = _valor_do_indicador(nome_kpi, calcular_kpis(kpis, filtro_coluna, filtro_valor, data_anterior_ini, data_anterior_fim),
+                                      filtro_coluna, filtro_valor, data_anterior_ini)
+        val_atual = _valor_do_indicador(nome_kpi, calcular_kpis(kpis, filtro_coluna, filtro_valor, data_atual_ini, data_atual_fim),
+                                        filtro_coluna, filtro_valor, data_atual_ini)
     except Exception as e:
         return f"Erro interno ao executar cálculo comparativo: {str(e)}"
 
     # Verifica erros de extração
     if val_ant is None or val_atual is None:
-        return (f"Não foi possível comparar numericamente.\n"
-                f"Anterior: {res_ant_txt}\nAtual: {res_atual_txt}")
+        return (f"Não foi possível comparar numericamente (sem dados em um dos períodos).\n"
+                f"Anterior: {'Indefinido' if val_ant is None else f'{val_ant:,.2f}'}\n"
+                f"Atual: {'Indefinido' if val_atual is None else f'{val_atual:,.2f}'}")
 
     # 3. Calcula Delta
     delta = val_atual - val_ant
@@ -991,6 +1340,7 @@ class InputCalculoKPIMensal(BaseModel):
     filtro_valor: Optional[str] = Field(default=None, description="Valor do filtro (ex: '1234')")
 
 @tool(args_schema=InputCalculoKPIMensal)
+@informar_filtro_resolvido
 def calcular_kpi_por_mes(indicador: str, ano: int, filtro_coluna: Optional[str] = None, filtro_valor: Optional[str] = None) -> str:
     """
     Calcula o valor de um indicador para TODOS os meses de um ano específico.
@@ -1008,26 +1358,29 @@ def calcular_kpi_por_mes(indicador: str, ano: int, filtro_coluna: Optional[str]
     if not config:
         return f"Erro: Indicador '{indicador}' não configurado nas tools."
         
-    tool_objeto = config["func"]
-    funcao_python_real = tool_objeto.func # Pega a função original ignorando o wrapper do Langchain
     direcao_melhor = config["melhor"]
     
-    print(f"\n{Fore.MAGENTA}📅 CALCULANDO [{nome_kpi}] MÊS A MÊS PARA {ano}{Style.RESET_ALL}")
+    LOG.info("📅 calculando mês a mês", extra=campos(tool="KPI_POR_MES", indicador=nome_kpi, ano=ano, filtro_coluna=filtro_coluna, filtro_valor=filtro_valor))
+
+    try:
+        from kpi_plano import calcular_kpis
+
+        # Um único plano agrupado por mês no lugar de 12 chamadas da tool
+        # (meses sem linhas contam como no cálculo de um mês isolado, ex: 0 ordens)
+        por_mes = calcular_kpis(_kpis_do_indicador(nome_kpi), filtro_coluna, filtro_valor, f"{ano}-01-01", f"{ano}-12-31",
+                                agrupar_por=("mes",), grupos=pd.period_range(f"{ano}-01", f"{ano}-12", freq="M", name="mes"))
+    except Exception as e:
+        return f"Erro ao calcular {nome_kpi} por mês: {e}"
+
+    if por_mes.empty and filtro_coluna and filtro_valor:
+        return f"Não foram encontrados registros com {filtro_coluna} = '{filtro_valor}' em {ano}."
 
     resultados = []
-    for mes in range(1, 13):
-        ultimo_dia = calendar.monthrange(ano, mes)[1]
-        dt_ini = f"{ano}-{mes:02d}-01"
-        dt_fim = f"{ano}-{mes:02d}-{ultimo_dia:02d}"
-        
-        try:
-            # Reutiliza a lógica original da tool já existente
-            res_txt = funcao_python_real(filtro_coluna=filtro_coluna, filtro_valor=filtro_valor, data_inicial=dt_ini, data_final=dt_fim)
-            val = extrair_valor_numerico(res_txt)
-            if val is not None:
-                resultados.append((mes, val, res_txt))
-        except Exception as e:
-            continue
+    for periodo, linha in por_mes.iterrows():
+        valores = {k: (None if pd.isna(v) else float(v)) for k, v in linha.items()}
+        val = _valor_do_indicador(nome_kpi, valores, filtro_coluna, filtro_valor, periodo.start_time.strftime("%Y-%m-%d"))
+        if val is not None:
+            resultados.append((periodo.month, val))
             
     if not resultados:
         return f"Não foram encontrados dados ou não foi possível calcular {nome_kpi} para os meses de {ano}."
@@ -1036,7 +1389,7 @@ def calcular_kpi_por_mes(indicador: str, ano: int, filtro_coluna: Optional[str]
                 7: "Julho", 8: "Agosto", 9: "Setembro", 10: "Outubro", 11: "Novembro", 12: "Dezembro"}
     
     texto_res = f"📊 Análise de {nome_kpi} por mês em {ano}:\n"
-    for mes, val, txt in resultados:
+    for mes, val in resultados:
         texto_res += f"• {meses_pt[mes]}: {val:,.2f}\n"
         
     # Lógica para achar melhor/pior baseado no MIN/MAX configurado
@@ -0,0 +1,89 @@
+import os
+import json
+import threading
+import functools
+import contextlib
+import contextvars
+from concurrent.futures import Future
+
+from rastreamento import anotar
+
+# ====================================================
+# EXECUÇÃO DAS TOOLS DE UM TURNO (chamadas em paralelo do modelo)
+# ====================================================
+# O ToolNode do LangGraph já roda em paralelo (asyncio.gather + threads com o contexto copiado)
+# as tools pedidas numa mesma resposta do modelo. Aqui se evita o trabalho repetido entre elas:
+#   - chamadas idênticas (mesma tool e argumentos) em andamento são coalescidas: as repetidas
+#     esperam a primeira e recebem o mesmo texto (vale também entre turnos simultâneos do servidor);
+#   - no mesmo turno, uma chamada idêntica já concluída devolve o texto guardado;
+#   - o rascunho do turno guarda os recortes já filtrados por período/filtro (tools.recorte_tabela,
+#     backends.preparar_tabela) para as outras tools do turno; é descartado quando o turno acaba.
+# Tudo que sai do rascunho é compartilhado entre threads: somente leitura.
+#
+# Configuração via .env (valores padrão entre parênteses):
+#   RAYBOT_COALESCER_TOOLS (1)   0 = cada chamada roda isolada e sem rascunho (comparação/diagnóstico)
+
+ATIVO = os.getenv("RAYBOT_COALESCER_TOOLS", "1").strip().lower() in ("1", "true", "sim", "yes")
+
+class ChamadasUnicas:
+    """
+    calcular() roda uma vez por chave; quem pede a mesma chave durante o cálculo espera por ele.
+    Com manter=False a chave sai ao terminar (só coalesce o que está em andamento); erros nunca ficam guardados.
+    """
+
+    def __init__(self, nome, manter=True):
+        self.nome = nome
+        self.manter = manter
+        self._futuros = {}
+        self._lock = threading.Lock()
+
+    def obter(self, chave, calcular):
+        with self._lock:
+            futuro = self._futuros.get(chave)
+            dono = futuro is None
+            if dono:
+                futuro = self._futuros[chave] = Future()
+        if not dono:
+            anotar(**{self.nome: "acerto"})
+            return futuro.result()
+        try:
+            valor = calcular()
+        except BaseException as e:
+            with self._lock:
+                self._futuros.pop(chave, None)
+            futuro.set_exception(e)
+            raise
+        futuro.set_result(valor)
+        if not self.manter:
+            with self._lock:
+                self._futuros.pop(chave, None)
+        return valor
+
+_EM_ANDAMENTO = ChamadasUnicas("coalescida", manter=False)
+_rascunho = contextvars.ContextVar("raybot_rascunho", default=None)
+
+@contextlib.contextmanager
+def turno():
+    """Abre o rascunho do turno; as tools rodando em threads copiadas deste contexto o compartilham."""
+    token = _rascunho.set(ChamadasUnicas("rascunho") if ATIVO else None)
+    try:
+        yield
+    finally:
+        _rascunho.reset(token)
+
+def no_rascunho(chave, calcular):
+    """Valor de calcular() guardado no rascunho do turno pela chave; fora de um turno só chama calcular()."""
+    rascunho = _rascunho.get()
+    return calcular() if rascunho is None else rascunho.obter(chave, calcular)
+
+def envolver_ferramenta(ferramenta):
+    """Cópia da tool (StructuredTool) com chamadas idênticas coalescidas e reaproveitadas no turno."""
+    func = getattr(ferramenta, "func", None)
+    if func is None or not ATIVO:
+        return ferramenta
+
+    @functools.wraps(func)
+    def envolvida(*args, **kwargs):
+        chave = (ferramenta.name, json.dumps([args, kwargs], sort_keys=True, ensure_ascii=False, default=str))
+        return no_rascunho(("ferramenta",) + chave, lambda: _EM_ANDAMENTO.obter(chave, lambda: func(*args, **kwargs)))
+    return ferramenta.model_copy(update={"func": envolvida})